@@ -1,26 +1,41 @@
-from fastapi import FastAPI, Query, Request
-from fastapi.middleware.cors import CORSMiddleware
-from classify import get_highest_paying_ad, log_query_time, load_total_data, load_query_cost, load_ads
-from datetime import datetime, timezone
-import json
-import os
-from pydantic import BaseModel
-from typing import List
-import io
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-from fastapi.responses import StreamingResponse
-import validators
-
-
-CLICK_DATA_PATH = "ad_clicks.json"
+import startup
+
+# Import cost of each dependency is recorded for /startup_report; openai and matplotlib are loaded lazily on first use
+with startup.timed_imports():
+    from fastapi import FastAPI, Query, Request
+    from fastapi.middleware.cors import CORSMiddleware
+    from classify import get_highest_paying_ad_async, keyword_cache, keyword_batcher, llm_latency, ad_stats, AD_LATENCY_BUDGET_S, LLM_HEDGE, LLM_BATCHING
+    import os
+    from assets import ASSET_DIR, IMMUTABLE_CACHE_CONTROL, CachedStaticFiles, ad_payloads
+    from auction import auction
+    from llm_client import llm
+    from response_cache import response_cache
+    from pacing import pacing
+    from inventory import inventory
+    from storage import VersionConflict, store
+    from telemetry import telemetry
+    from datetime import datetime, timezone
+    from rollups import rollups, billing_period
+    from topk import unclaimed
+    from canonical import canonicalizer
+    from metrics import registry, stage
+    from profiler import PROFILER_ENABLED, profiler
+    from shared import SHARED_STATE, follower
+    from events import events, RESOLUTIONS
+    from ingest import ClickEvent, QueryTimeEvent, apply_events, parse_events
+    from pydantic import BaseModel
+    from typing import List
+    from charts import ChartBusy, charts
+    from fastapi.responses import JSONResponse, Response
+    import validators
 
-app = FastAPI()
 
-from fastapi.staticfiles import StaticFiles
+app = FastAPI()
 
-app.mount("/ad_images", StaticFiles(directory="ad_images"), name="ad_images")
+os.makedirs(ASSET_DIR, exist_ok=True)
+# Optimized variants have content-hashed names and can be cached for good; the originals get a shorter lifetime
+app.mount(f"/{ASSET_DIR}", CachedStaticFiles(directory=ASSET_DIR, cache_control=IMMUTABLE_CACHE_CONTROL), name="ad_assets")
+app.mount("/ad_images", CachedStaticFiles(directory="ad_images"), name="ad_images")
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,32 +46,102 @@ app.add_middleware(
 )
 
 @app.get("/get_ad")
-def get_ad(query: str = Query(...)):
+async def get_ad(request: Request, query: str = Query(...), user_id: str = Query(None)):
     """
-    This function creates the endpoint for getting the highest paying ad that will be used in the frontend.
+    This function creates the endpoint for getting the highest paying ad that will be used in the frontend. It runs on the event
+    loop end to end and answers within the ad latency budget, with no ad if keyword extraction is too slow.
 
     Args:
         query: user question
+        user_id: identifies the user for frequency capping (defaults to the client address)
     Returns:
         dict: dictionary containing the ad
     """
 
-    ad = get_highest_paying_ad(query)
+    user = user_id or (request.client.host if request.client else None)
+    with stage("get_ad"):
+        ad = await get_highest_paying_ad_async(query, user=user)
     if ad is None:
+        _no_ads_served.inc()
         return {"ad": None}
+    _ads_served.inc()
     return {"ad": ad}
 
 
-# Loading and saving the clicks data
-def load_clicks():
-    if os.path.exists(CLICK_DATA_PATH):
-        with open(CLICK_DATA_PATH, "r") as f:
-            return json.load(f)
-    return []
+ads_served = registry.counter("oe_ads_served_total", "Answers from /get_ad, with or without an ad", labels=("result",))
+_ads_served, _no_ads_served = ads_served.labels("ad"), ads_served.labels("none")
+
+# Figures the components already keep, read when /metrics is scraped
+registry.callback("oe_keyword_cache_hits_total", "Keyword-extraction cache hits", lambda: keyword_cache.stats()["hits"], "counter")
+registry.callback("oe_keyword_cache_misses_total", "Keyword-extraction cache misses", lambda: keyword_cache.stats()["misses"], "counter")
+registry.callback("oe_response_cache_hits_total", "Analytics responses served from the response cache",
+                  lambda: response_cache.hits + response_cache.stale_hits, "counter")
+registry.callback("oe_telemetry_queue_depth", "Counter increments waiting to be flushed to storage", lambda: telemetry.stats()["queue_depth"])
+registry.callback("oe_telemetry_flushes_total", "Telemetry flushes to storage", lambda: telemetry.flushes, "counter")
+registry.callback("oe_llm_budget_timeouts_total", "Ad lookups that ran out of latency budget", lambda: ad_stats["budget_timeouts"], "counter")
+
+
+@startup.warmup_hook("inventory")
+def warm_inventory():
+    inventory.snapshot()
+
+
+@app.on_event("startup")
+def report_startup():
+    # Seed the analytics rollups and the unclaimed mentions index before taking traffic; from then on they follow telemetry increments
+    events.load()
+    rollups.load()
+    unclaimed.load()
+    ad_payloads.prepare()
+    if SHARED_STATE:
+        # Follow the purchases, counters and events written by the other workers
+        follower.start()
+    startup.mark_ready()
+    startup.run_warmup()
+    print(f"ad service ready in {startup.ready_ms:.0f} ms")
+
 
-def save_clicks(clicks):
-    with open(CLICK_DATA_PATH, "w") as f:
-        json.dump(clicks, f, indent=2)
+@app.on_event("shutdown")
+def flush_telemetry():
+    telemetry.close()
+    pacing.close()
+    charts.close()
+    follower.close()
+
+
+# Re-render cached charts in the background whenever the data behind them changes
+inventory.subscribe(lambda snapshot, previous: charts.refresh())
+telemetry.on_flush(lambda batch: charts.refresh())
+if SHARED_STATE:
+    follower.watch("charts", store.counters_stamp, charts.refresh)
+
+
+async def chart_response(request, key, producer, error):
+    """
+    Serves a chart from the chart cache with a strong ETag, answering 304 if the client's copy is still current. Renders
+    happen in the chart process pool; if it is saturated, or a render fails, the client gets 503 with Retry-After instead
+    of waiting or an error.
+
+    Args:
+        request: the fastAPI request (for If-None-Match)
+        key (str): identifies the chart in the cache
+        producer (callable): returns the chart spec, or None if there is no data
+        error (dict): returned when there is no data to plot
+
+    Returns:
+        fastapi Response containing the PNG image (or 304 Not Modified)
+    """
+    try:
+        result = await charts.get(key, producer, request.headers.get("if-none-match"))
+    except ChartBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+    if result is None:
+        return error
+    etag, png = result
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if png is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=png, media_type="image/png", headers=headers)
 
 @app.post("/track_click")
 async def track_click(request: Request):
@@ -76,106 +161,126 @@ async def track_click(request: Request):
     time = str(datetime.now(timezone.utc))
     data = await request.json()
 
-    disease = data.get("disease").lower()
-
-    clicks = load_clicks()
-    clicks[disease]["clicks"] +=1
-    save_clicks(clicks)
+    # Single-event wrapper around the batch ingestion path
+    result = apply_events([(ClickEvent(disease=data.get("disease"), company=data.get("company")), None)])[0]
+    if result["status"] != "ok":
+        return {"error": result["error"]}
 
     return {"status": "ok", "logged": time}
 
-@app.get("/categories_for_sale")
-def categories_for_sale():
+
+@app.post("/ingest")
+async def ingest_events(request: Request, flush: bool = False):
     """
-    Endpoint for getting the categories that have been searched for/about but are not purchased by any company
+    Batch endpoint for client telemetry, so the frontend can send many clicks and query times in one request.
+    Expected payload: a JSON list (or NDJSON, with Content-Type application/x-ndjson) of events such as
+    {"type": "click", "disease": "diabetes", "company": "eli lilly"} or
+    {"type": "query_time", "diseases": ["diabetes"], "duration_ms": 5400}
 
     Args:
-        None
+        request: fastAPI request containing the events
+        flush (bool): persist the batch before answering instead of with the next telemetry flush
+
     Returns:
-        dict: containing unpurchased diseases and their numbers of mentions
+        dict: accepted/rejected counts and the status of each event, in order
     """
-    path = "uncategorized.json"
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    try:
+        parsed = parse_events(await request.body(), ndjson=ndjson)
+    except ValueError as e:
+        return {"error": str(e)}
 
-    if not os.path.exists(path):
-        return {"unclaimed_diseases": []}
+    results = apply_events(parsed, flush=flush)
+    accepted = sum(1 for result in results if result["status"] == "ok")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
 
-    with open(path, "r") as f:
-        data = json.load(f)
+@app.get("/categories_for_sale")
+def categories_for_sale_endpoint(request: Request, limit: int = Query(None, ge=1), offset: int = Query(0, ge=0)):
+    """
+    Endpoint for getting the categories that have been searched for/about but are not purchased by any company.
+    Served from the response cache until the uncategorized counters change.
 
-    # Handle both possible structures gracefully
-    sorted_diseases = sorted(
-        data.items(),
-        key=lambda x: x[1]["mentions"] if isinstance(x[1], dict) else x[1],
-        reverse=True
+    Args:
+        limit: how many diseases to return (all that are tracked if omitted)
+        offset: how many of the most mentioned diseases to skip
+    """
+    return response_cache.respond(
+        request, f"categories_for_sale:{limit}:{offset}", (telemetry.version("uncategorized"), unclaimed.generation),
+        lambda: categories_for_sale(limit, offset),
     )
 
-    # Normalize to consistent output
-    formatted = []
-    for d, v in sorted_diseases:
-        mentions = v["mentions"] if isinstance(v, dict) else v
-        formatted.append({"disease": d, "mentions": mentions})
 
-    return {"unclaimed_diseases": formatted}
+def categories_for_sale(limit=None, offset=0):
+    """
+    The categories that have been searched for/about but are not purchased by any company, read from the ranked index
+    of unclaimed mentions (topk.unclaimed) rather than sorting the whole table
+
+    Args:
+        limit (int): how many diseases to return (None for all that are tracked)
+        offset (int): how many of the most mentioned diseases to skip
+    Returns:
+        dict: containing unpurchased diseases and their numbers of mentions, most mentioned first, the number of
+            diseases tracked and whether the counts are approximate (see OE_UNCLAIMED_TOPK_MODE)
+    """
+    ranked, total, approximate = unclaimed.page(limit, offset)
+    formatted = [{"disease": d, "mentions": mentions} for d, mentions in ranked]
+    return {"unclaimed_diseases": formatted, "total": total, "approximate": approximate}
 
 
 @app.get("/categories_for_sale_chart")
-def categories_for_sale_chart():
+async def categories_for_sale_chart(request: Request):
     """
     Returns a bar chart (PNG) of unpurchased but mentioned disease categories.
     """
-    path = "uncategorized.json"
-
-    if not os.path.exists(path):
-        return {"error": "No uncategorized data found."}
+    return await chart_response(request, "categories_for_sale", categories_for_sale_spec, {"error": "No uncategorized data found."})
 
-    with open(path, "r") as f:
-        data = json.load(f)
 
-    # Handle both flat and nested structures
-    sorted_diseases = sorted(
-        data.items(),
-        key=lambda x: x[1]["mentions"] if isinstance(x[1], dict) else x[1],
-        reverse=True
-    )
+def categories_for_sale_spec():
+    top, _, _ = unclaimed.page(10)  # top 10 for clarity
 
-    diseases = [d for d, _ in sorted_diseases][:10]  # top 10 for clarity
-    mentions = [
-        v["mentions"] if isinstance(v, dict) else v
-        for _, v in sorted_diseases[:10]
-    ]
+    if not top:
+        return None
 
-    # --- Create bar chart ---
-    fig, ax = plt.subplots(figsize=(8, 5), dpi=200)
-    ax.barh(diseases[::-1], mentions[::-1], color="#4C9AFF")
-    ax.set_xlabel("Mentions")
-    ax.set_ylabel("Disease")
-    ax.set_title("Top Unpurchased but Mentioned Disease Categories")
-    plt.tight_layout()
+    diseases = [d for d, _ in top]
+    mentions = [m for _, m in top]
 
-    # --- Save to buffer ---
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", dpi=200)
-    plt.close(fig)
-    buf.seek(0)
+    # --- Bar chart spec ---
+    return {
+        "kind": "barh",
+        "labels": diseases[::-1],
+        "values": mentions[::-1],
+        "color": "#4C9AFF",
+        "xlabel": "Mentions",
+        "ylabel": "Disease",
+        "title": "Top Unpurchased but Mentioned Disease Categories",
+        "figsize": [8, 5],
+    }
 
-    return StreamingResponse(buf, media_type="image/png")
 
 
+def analytics_versions():
+    """
+    The data versions behind the company and revenue views: inventory, usage counters and the day (per-day rates and
+    prorated spend move with the date)
+    """
+    return (inventory.snapshot().version, rollups.version, datetime.now().date().toordinal())
 
 
-# Helper function to get json content
-def load_json(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            return json.load(f)
-    return {}
+@app.get("/company_summary/{company_name}")
+def company_summary_endpoint(company_name: str, request: Request):
+    """
+    Endpoint for getting company specific information about the drug categories they have purchased and relevant metrics regarding
+    advertising. Served from the response cache until the underlying data changes; cached per spelling of the name, since
+    the response echoes it.
+    """
+    return response_cache.respond(
+        request, f"company_summary:{company_name}", analytics_versions(), lambda: company_summary(company_name)
+    )
 
 
-@app.get("/company_summary/{company_name}")
 def company_summary(company_name: str):
     """
-    Endpoint for getting company specific information about the drug categories they have purchased and relevant metrics regarding
-    advertising
+    Company specific information about the drug categories they have purchased and relevant metrics regarding advertising
 
     Args:
         company_name (str): name of the company whose metrics you're getting
@@ -183,144 +288,114 @@ def company_summary(company_name: str):
     Returns:
         dict: company name and metrics
     """
+    # Served from the materialized rollups, so this only touches the categories the company owns
+    return {"company": company_name, "summary": rollups.company_summary(company_name)}
 
-    mentions = load_json("disease_counts.json")
-    clicks = load_json("ad_clicks.json")
-    categories = load_json("categories_ads.json")
-    times = load_json("disease_times.json")
 
-    total_queries = load_total_data().get("total_queries",0)
+@app.get("/company_summary")
+def all_company_summaries_endpoint(request: Request):
+    """
+    Bulk variant of company_summary for the dashboard, served from the response cache until the underlying data changes
+    """
+    return response_cache.respond(request, "company_summary:*", analytics_versions(), all_company_summaries)
 
-    cat_prices = {}
-    for disease in categories:
-        cat_prices[disease] = categories[disease]["category_cost"]
 
-    
-    start_date = datetime(2025, 10, 10)
-    today = datetime.now()
-    days_passed = (today - start_date).days
-    revenue_fraction = days_passed / 30
-
-    # Get the purchased categories for this company
-    purchased_categories = [cat for cat, info in categories.items() if info["company"].lower() == company_name.lower()]
-
-    summary = []
-    for cat in purchased_categories:
-        summary.append({
-            "disease": cat,
-            "mentions": mentions.get(cat, 0),
-            "clicks": clicks.get(cat,{}).get("clicks",0),
-            "mentions_per_query": str(round((mentions.get(cat, 0) / total_queries if total_queries > 0 else 0) * 100, 3)) + "%",
-            "clicks_per_mention": clicks.get(cat, {}).get("clicks", 0) / mentions.get(cat,0) if mentions.get(cat,0) > 0 else 0,
-            "times": (times.get(cat,0) / 1000) / mentions.get(cat, 0) if mentions.get(cat, 0) > 0 else 0,
-            "monthly_category_cost": cat_prices.get(cat, 0),
-            "total_paid": revenue_fraction * cat_prices.get(cat, 0),
-            "clicks_per_dollar": clicks.get(cat,{}).get("clicks",0) / (revenue_fraction * cat_prices.get(cat, 0)),
-            "mentions_per_day": mentions.get(cat, 0) / days_passed,
-            "clicks_per_day": clicks.get(cat,{}).get("clicks",0) / days_passed
-        })
-
-    return {"company": company_name, "summary": summary}
+def all_company_summaries():
+    """
+    Every company's per-category metrics and totals in one call
+
+    Args:
+        None
+
+    Returns:
+        dict: list of companies with their summary and totals
+    """
+    totals = rollups.company_totals()
+    return {
+        "companies": [
+            {"company": company, "summary": rollups.company_summary(company), "totals": company_totals}
+            for company, company_totals in totals.items()
+        ]
+    }
 
 
 @app.get("/pie/total_paid/{company}")
-def pie_total_paid(company: str):
+async def pie_total_paid(company: str, request: Request):
     """
     Endpoint to get a pie chart of how much a company has paid for each one of their purchased drug categories
 
     Args:
         company (str): name of the company
     Returns:
-        fastapi StreamingResponse containing the matplotlib graph
+        fastapi Response containing the matplotlib graph
     """
-    with open('categories_ads.json', 'r') as f:
-        data = json.load(f)
-
-    # Filter categories owned by this company
-    labels = [cat for cat in data if data[cat]["company"].lower() == company.lower()]
-    values = [data[cat]["category_cost"] for cat in labels]
+    def spec():
+        snapshot = inventory.snapshot()
 
-    if not labels:
-        return {"error": f"No categories found for company {company}"}
+        # Filter categories owned by this company
+        labels = list(snapshot.company_categories(company))
+        values = [snapshot.categories[cat]["category_cost"] for cat in labels]
 
-    fig, ax = plt.subplots(figsize=(6, 6))
-    ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
-    ax.set_title(f"Total Paid per Category ({company})")
+        if not labels:
+            return None
+        return {"kind": "pie", "labels": labels, "values": values, "title": f"Total Paid per Category ({company})", "figsize": [6, 6]}
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", dpi=200)
-    plt.close(fig)
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="image/png")
+    return await chart_response(request, f"pie_total_paid:{company}", spec, {"error": f"No categories found for company {company}"})
 
 
 @app.get("/pie/total_clicks/{company}")
-def pie_total_clicks(company: str):
+async def pie_total_clicks(company: str, request: Request):
     """
     Endpoint to get a pie chart of how many clicks the ads are receiving for each one of the company's purchased drug categories
 
     Args:
         company (str): name of the company
     Returns:
-        fastapi StreamingResponse containing the matplotlib graph
+        fastapi Response containing the matplotlib graph
     """
-    with open('categories_ads.json', 'r') as f:
-        ads_data = json.load(f)
+    def spec():
+        snapshot = inventory.snapshot()
 
-    clicks_data = load_ads()  # {disease: clicks}
+        # Filter for this company's categories
+        labels = list(snapshot.company_categories(company))
+        values = [rollups.category(cat)["clicks"] for cat in labels]
 
-    # Filter for this company's categories
-    labels = []
-    values = []
-    for cat, info in ads_data.items():
-        if info["company"].lower() == company.lower():
-            labels.append(cat)
-            values.append(clicks_data[cat]["clicks"])
+        if not labels:
+            return None
+        return {"kind": "pie", "labels": labels, "values": values, "title": f"Total Clicks per Category ({company})", "figsize": [6, 6]}
 
-    if not labels:
-        return {"error": f"No clicks for company {company}"}
+    return await chart_response(request, f"pie_total_clicks:{company}", spec, {"error": f"No clicks for company {company}"})
 
-    fig, ax = plt.subplots(figsize=(6, 6))
-    ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
-    ax.set_title(f"Total Clicks per Category ({company})")
+@app.get("/revenue")
+def revenue_endpoint(request: Request):
+    """
+    Endpoint for tracking the revenue and revenue-related metrics for OpenEvidence. Served from the response cache until
+    the underlying data changes.
+    """
+    return response_cache.respond(request, "revenue", analytics_versions(), revenue_tracker)
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", dpi=200)
-    plt.close(fig)
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="image/png")
 
-@app.get("/revenue")
 def revenue_tracker():
     """
-    Endpoint for tracking the revenue and revenue-related metrics for OpenEvidence
+    The revenue and revenue-related metrics for OpenEvidence
 
     Args:
         None
     Returns:
         (dict): containing the revenue metrics
     """
-    total_costs_data = load_query_cost()
-    total_costs = total_costs_data.get("query", 0)
+    total_costs = rollups.api_costs
 
-    # 2️⃣ Load ad purchase data (monthly revenues)
-    with open("categories_ads.json", "r") as f:
-        ad_data = json.load(f)
+    # 2️⃣ Monthly ad revenue per company (maintained by the rollups as categories change hands)
+    monthly_by_company = rollups.monthly_revenue_by_company()
 
-    # October 10th refers to the day on which all the companies purchased the categories
-    # Also the day I received the assessment
-    start_date = datetime(2025, 10, 10)
-    today = datetime.now()
-    days_passed = (today - start_date).days
-    revenue_fraction = days_passed / 30
+    days_passed, revenue_fraction = billing_period()
 
     company_revenue = {}
     total_revenue = 0
-    for disease, info in ad_data.items():
-        company = info["company"]
-        monthly_cost = info.get("category_cost", 0)
+    for company, monthly_cost in monthly_by_company.items():
         prorated = monthly_cost * revenue_fraction
-        company_revenue[company] = company_revenue.get(company, 0) + prorated
+        company_revenue[company] = prorated
         total_revenue += prorated
 
     net_profit = total_revenue - total_costs
@@ -338,7 +413,7 @@ def revenue_tracker():
 
 
 @app.get("/revenue_chart")
-def revenue_chart():
+async def revenue_chart(request: Request):
     """
     Endpoint for getting a piechart of different companies contribution to OE's revenue
 
@@ -346,31 +421,23 @@ def revenue_chart():
         None
 
     Returns:
-        fastapi StreamingResponse containing the matplotlib plot image
+        fastapi Response containing the matplotlib plot image
     """
+    return await chart_response(request, "revenue_chart", revenue_chart_spec, {"error": "No revenue data available"})
+
+
+def revenue_chart_spec():
     # Reuse the revenue data from the tracker
     revenue_data = revenue_tracker()
     company_data = revenue_data["revenue_breakdown_by_company"]
 
     if not company_data:
-        return {"error": "No revenue data available"}
+        return None
 
-    # Create pie chart
-    fig, ax = plt.subplots(figsize=(5, 5))
     labels = list(company_data.keys())
     labels = [label.upper() for label in labels]
     values = list(company_data.values())
-
-    ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
-    ax.set_title("Revenue Share by Company")
-
-    # Save as bytes and return
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", dpi = 200)
-    buf.seek(0)
-    plt.close(fig)
-
-    return StreamingResponse(buf, media_type="image/png")
+    return {"kind": "pie", "labels": labels, "values": values, "title": "Revenue Share by Company", "figsize": [5, 5]}
 
 
 
@@ -384,29 +451,92 @@ def log_time_endpoint(data: TimeLogRequest):
     """
     Logging the times that users are spending on a query about some set of diseases
     """
-    log_query_time(data.diseases, data.duration_ms)
+    apply_events([(QueryTimeEvent(diseases=data.diseases, duration_ms=data.duration_ms), None)])
     return {"status": "ok"}
 
 
 
+# How often a purchase without an explicit version is re-validated after losing a race to another purchase
+MAX_PURCHASE_ATTEMPTS = 5
+
 @app.post("/purchase_category")
 def purchase_category(purchase: dict):
     """
     This function provides the logic for approving the purchase of a disease category by a drug company. It verifies that the sale is valid
     (price is above current price, buying company is valid and not current owner, etc.). It also updates the json files to reflect the new owner of the
     category and the new advertisement/link
+
+    The purchase is a compare-and-swap on the category's version: it only goes through if nobody else bought the category between
+    the checks and the write. Clients can pass the "version" they saw in /categories_ads to bid on exactly that state; a stale
+    version is rejected. Without it, a purchase that loses a race is re-checked against the new owner and price.
     """
     disease = purchase.get("disease")
     new_company = purchase.get("company")
     bid_price = float(purchase.get("bid_price"))
     new_link = purchase.get("ad_link")
+    pinned_version = purchase.get("version")
 
     new_company = new_company.lower()
 
-    # Load category data
-    with open("categories_ads.json", "r") as f:
-        ads_data = json.load(f)
+    for _ in range(MAX_PURCHASE_ATTEMPTS):
+        # Load category data
+        snapshot = inventory.snapshot()
+        ads_data = snapshot.categories
+
+        error = validate_purchase(ads_data, disease, new_company, bid_price, new_link)
+        if error is not None:
+            return error
 
+        new_image = "ad_images/"+ PURCHASE_COMPANIES[new_company] + "_" + "_".join(disease.split(" ")) + ".png"
+        expected_version = snapshot.version_of(disease) if pinned_version is None else int(pinned_version)
+
+        # Flush buffered clicks first so they don't land on top of the click reset
+        telemetry.flush()
+        try:
+            # Update ownership and reset the category's clicks in one atomic write, then swap in a new inventory snapshot
+            new_snapshot = inventory.purchase(
+                disease,
+                expected_version,
+                company=new_company,
+                category_cost=bid_price,
+                ad_path=new_image,
+                link=new_link,
+            )
+        except VersionConflict:
+            if pinned_version is not None:
+                return {"error": f"{disease} has been bought since version {pinned_version}; check the new price and bid again"}
+            continue
+
+        telemetry.discard("ad_clicks", disease)
+        rollups.reset_clicks(disease)
+        return {
+            "message": f"{new_company} successfully purchased {disease} for ${bid_price}",
+            "version": new_snapshot.version_of(disease),
+        }
+
+    return {"error": f"{disease} is being bought by several companies at once; try again"}
+
+
+PURCHASE_COMPANIES = {"pfizer":"pfizer", 
+                      "genentech": "genentech", 
+                      "glaxo-smith kline": "gsk", 
+                      "glaxo smith kline": "gsk", 
+                      "glaxosmith kline": "gsk", 
+                      "gsk": "gsk",
+                      "lilly": "lilly",
+                      "eli lilly": "lilly",
+                      "elililly": "lilly",
+                      "eli-lilly": "lilly"
+                      }
+
+
+def validate_purchase(ads_data, disease, new_company, bid_price, new_link):
+    """
+    Checks a bid against one inventory snapshot
+
+    Returns:
+        dict: the error to send back, or None if the bid is valid
+    """
     if disease not in ads_data:
         return {"error": "Disease category not found"}
 
@@ -416,18 +546,7 @@ def purchase_category(purchase: dict):
     
     if ads_data[disease]["company"] == new_company:
         return {"error": ads_data[disease]["company"] + " has already purchased " + disease}
-    conversion = {"pfizer":"pfizer", 
-                  "genentech": "genentech", 
-                  "glaxo-smith kline": "gsk", 
-                  "glaxo smith kline": "gsk", 
-                  "glaxosmith kline": "gsk", 
-                  "gsk": "gsk",
-                  "lilly": "lilly",
-                  "eli lilly": "lilly",
-                  "elililly": "lilly",
-                  "eli-lilly": "lilly"
-                  }
-    if new_company.lower() not in conversion:
+    if new_company.lower() not in PURCHASE_COMPANIES:
         return {"error": ads_data[disease]["company"] + " is not in set of valid drug companies."}
     def is_float(s):
         try:
@@ -440,36 +559,302 @@ def purchase_category(purchase: dict):
     
     if validators.url(new_link) != True:
         return {"error": "Invalid link."}
-    
-    new_image = "ad_images/"+ conversion[new_company] + "_" + "_".join(disease.split(" ")) + ".png"
-        
+    return None
+
+
+@app.post("/place_bid")
+def place_bid(bid: dict):
+    """
+    Places a standing bid on a category without buying it. With OE_AUCTION_MODE=weighted or second_price, every standing
+    bid on a matched category competes for the ad alongside the owner's. The owner's bid is its category cost, so owners
+    raise it through /purchase_category; placing another bid replaces the company's previous one.
+    """
+    if auction.mode == "highest":
+        return {"error": "Standing bids only take part in the weighted and second_price auctions."}
+
+    disease = bid.get("disease")
+    company = (bid.get("company") or "").lower()
+    link = bid.get("ad_link")
+    try:
+        bid_price = float(bid.get("bid_price"))
+    except (TypeError, ValueError):
+        return {"error": "Invalid bid price."}
+
+    ads_data = inventory.snapshot().categories
+    if disease not in ads_data:
+        return {"error": "Disease category not found"}
+    if company not in PURCHASE_COMPANIES:
+        return {"error": company + " is not in set of valid drug companies."}
+    if ads_data[disease]["company"] == company:
+        return {"error": company + " owns " + disease + "; raise its price through /purchase_category"}
+    if bid_price <= 0:
+        return {"error": "Invalid bid price."}
+    if validators.url(link) != True:
+        return {"error": "Invalid link."}
 
-    # Update ownership
-    ads_data[disease]["company"] = new_company
-    ads_data[disease]["category_cost"] = bid_price
-    ads_data[disease]["ad_path"] = new_image
-    ads_data[disease]["link"] = new_link
+    ad_path = "ad_images/" + PURCHASE_COMPANIES[company] + "_" + "_".join(disease.split(" ")) + ".png"
+    auction.place_bid(disease, company, bid_price, ad_path, link)
+    return {"message": f"{company} bid ${bid_price} on {disease}", "bidders": auction.bidders(disease)}
 
-    # Save updates
-    with open("categories_ads.json", "w") as f:
-        json.dump(ads_data, f, indent=2)
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Endpoint for Prometheus: per-stage latency histograms of the ad-serving path, LLM token/cost counters, cache hits and
+    json file traffic, in the Prometheus text format
+    """
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-    # Optionally reset click data
-    with open("ad_clicks.json", "r") as f:
-        click_data = json.load(f)
 
-    if disease in click_data:
-        click_data[disease] = {"clicks": 0, "mentions": 0}
+@app.get("/debug/profile")
+def profile_endpoint(seconds: float = Query(10, gt=0), interval_ms: float = Query(5, gt=0), idle: bool = False):
+    """
+    Samples the stacks of every thread in this worker for a while and returns them as collapsed stacks, ready for
+    flamegraph.pl or speedscope. Only available when OE_PROFILER=1.
+
+    Args:
+        seconds: how long to sample (at most 60)
+        interval_ms: time between samples
+        idle: keep threads that are only waiting for work
+    """
+    if not PROFILER_ENABLED:
+        return JSONResponse({"error": "profiling is disabled; start the server with OE_PROFILER=1"}, status_code=404)
+    try:
+        stacks, samples = profiler.profile(seconds, interval_ms / 1000, include_idle=idle)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    return Response(content=stacks, media_type="text/plain", headers={"X-Profile-Samples": str(samples)})
+
+
+@app.get("/auction/stats")
+def auction_stats():
+    """
+    Endpoint for inspecting the ad auction
 
-    with open("ad_clicks.json", "w") as f:
-        json.dump(click_data, f, indent=2)
+    Args:
+        None
+
+    Returns:
+        dict: auction mode and the number of standing bids per category
+    """
+    return auction.stats()
+
+
+@app.get("/pacing/stats")
+def pacing_stats():
+    """
+    Endpoint for monitoring advertiser budgets and frequency caps
+
+    Args:
+        None
+
+    Returns:
+        dict: caps, today's impressions and how many ads were skipped for being over budget
+    """
+    return pacing.stats()
+
+
+@app.get("/ad_payloads/stats")
+def ad_payload_stats():
+    """
+    Endpoint for monitoring the prebuilt ad payloads and image variants
+
+    Args:
+        None
+
+    Returns:
+        dict: number of payloads, rebuilds and image variants generated
+    """
+    return ad_payloads.stats()
+
+
+@app.get("/response_cache/stats")
+def response_cache_stats():
+    """
+    Endpoint for monitoring the response cache of the analytics endpoints
+
+    Args:
+        None
+
+    Returns:
+        dict: occupancy and hit/miss counters
+    """
+    return response_cache.stats()
+
+
+@app.get("/unclaimed/stats")
+def unclaimed_stats():
+    """
+    Endpoint for monitoring the ranked index of unclaimed disease mentions
+
+    Args:
+        None
+
+    Returns:
+        dict: mode, capacity, entries tracked and evictions
+    """
+    return unclaimed.stats()
+
+
+@app.get("/shared_state/stats")
+def shared_state_stats():
+    """
+    Endpoint for monitoring how this worker follows the writes of the other workers (OE_SHARED_STATE=1)
+
+    Args:
+        None
+
+    Returns:
+        dict: refresh interval, what is watched and how often each was refreshed
+    """
+    return follower.stats()
+
+
+@app.get("/telemetry/stats")
+def telemetry_stats():
+    """
+    Endpoint for monitoring the buffered telemetry writer
+
+    Args:
+        None
+
+    Returns:
+        dict: queue depth and flush latency of the counter buffer
+    """
+    return telemetry.stats()
+
+
+@app.get("/events/stats")
+def event_store_stats():
+    """
+    Endpoint for monitoring the time-bucketed event store
+
+    Args:
+        None
+
+    Returns:
+        dict: events recorded, log size, compactions and retention per resolution
+    """
+    return events.stats()
+
+
+@app.get("/events/{metric}/{key}")
+def event_series(metric: str, key: str, resolution: str = "day", last: int = Query(30, ge=1)):
+    """
+    Endpoint for range queries over the event store, e.g. /events/clicks/lung cancer?resolution=day&last=30 for clicks per
+    day on lung cancer over the last 30 days
+
+    Args:
+        metric (str): clicks, mentions, time_ms or queries
+        key (str): the disease category (total_queries for queries)
+        resolution (str): minute, hour or day
+        last (int): number of most recent buckets
+
+    Returns:
+        dict: one value per bucket, oldest first
+    """
+    if resolution not in RESOLUTIONS:
+        return {"error": f"resolution must be one of {', '.join(RESOLUTIONS)}"}
+    series = events.series(metric, key.lower(), resolution, last=last)
+    return {
+        "metric": metric,
+        "key": key.lower(),
+        "resolution": resolution,
+        "buckets": [
+            {"start": datetime.fromtimestamp(start, timezone.utc).isoformat(), "value": value} for start, value in series
+        ],
+    }
+
+
+@app.get("/llm/stats")
+def llm_stats():
+    """
+    Endpoint for monitoring the latency of the keyword-extraction LLM calls behind /get_ad
+
+    Args:
+        None
+
+    Returns:
+        dict: LLM latency percentiles, circuit breaker state and retries, latency budget timeouts, hedging counters and
+            micro-batching figures
+    """
+    return {
+        "latency": llm_latency.stats(),
+        "upstream": llm.stats(),
+        "ad_latency_budget_ms": AD_LATENCY_BUDGET_S * 1000,
+        "hedging_enabled": LLM_HEDGE,
+        **ad_stats,
+        "batching_enabled": LLM_BATCHING,
+        "batching": keyword_batcher.stats(),
+    }
+
+
+@app.get("/charts/stats")
+def chart_stats():
+    """
+    Endpoint for monitoring the chart cache
+
+    Args:
+        None
+
+    Returns:
+        dict: cache occupancy and hit/render counters
+    """
+    return charts.stats()
+
+
+@app.get("/startup_report")
+def startup_report():
+    """
+    Endpoint for tracking cold-start cost: time to ready, import cost per module and warm-up hook timings
+
+    Args:
+        None
+
+    Returns:
+        dict: startup timings in milliseconds
+    """
+    return startup.report()
+
+
+@app.get("/keyword_cache/stats")
+def keyword_cache_stats():
+    """
+    Endpoint for monitoring the keyword-extraction cache in front of the LLM
+
+    Args:
+        None
+
+    Returns:
+        dict: hit/miss/eviction counters and the LLM spend saved by the cache
+    """
+    return keyword_cache.stats()
+
+
+@app.get("/canonical/stats")
+def canonical_stats():
+    """
+    Endpoint for monitoring disease-name canonicalization
+
+    Args:
+        None
+
+    Returns:
+        dict: aliases indexed, memo occupancy and how extracted names were matched
+    """
+    return canonicalizer.stats()
 
-    return {"message": f"{new_company} successfully purchased {disease} for ${bid_price}"}
 
 @app.get("/categories_ads")
+def get_categories_endpoint(request: Request):
+    """
+    Endpoint for getting the information about different ads for the diseases, cached per inventory version
+    """
+    return response_cache.respond(request, "categories_ads", (inventory.snapshot().version,), get_categories)
+
+
 def get_categories():
     """
-    This function provides an endpoint for getting the information about different ads for the diseases
+    The information about different ads for the diseases
 
     Args:
         None
@@ -477,6 +862,4 @@ def get_categories():
     Returns:
         dict containing ad information
     """
-    with open("categories_ads.json", "r") as f:
-        data = json.load(f)
-    return data
+    return inventory.snapshot().categories
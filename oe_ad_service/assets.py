@@ -0,0 +1,273 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from starlette.staticfiles import StaticFiles
+from inventory import inventory
+from startup import lazy_import, warmup_hook
+
+# Optimized ad images are written here and served under the same path
+ASSET_DIR = os.environ.get("OE_ASSET_DIR", "ad_assets")
+# Serve optimized variants instead of the original PNGs (0 keeps the original ad_path in ad payloads)
+AD_IMAGE_VARIANTS = os.environ.get("OE_AD_IMAGE_VARIANTS", "1") == "1"
+AD_IMAGE_WIDTH = int(os.environ.get("OE_AD_IMAGE_WIDTH", "768"))
+AD_IMAGE_QUALITY = int(os.environ.get("OE_AD_IMAGE_QUALITY", "80"))
+# Variant filenames are content-hashed, so they can be cached forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+SOURCE_CACHE_CONTROL = "public, max-age=3600"
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles (which already sends ETag and Last-Modified and answers conditional requests) with a Cache-Control
+    header on every file it serves.
+    """
+
+    def __init__(self, *args, cache_control=SOURCE_CACHE_CONTROL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = self.cache_control
+        return response
+
+
+class AssetPipeline:
+    """
+    Turns ad images into optimized variants once: resized to AD_IMAGE_WIDTH and re-encoded as WebP, under a filename
+    carrying a hash of the source content. A manifest remembers which sources have been processed, so restarts don't
+    re-encode anything. Without Pillow the source is copied under its content-hashed name as is.
+
+    Args:
+        out_dir (str): where variants and the manifest are written
+        width (int): maximum width (and height) of the variant
+        quality (int): WebP quality
+    """
+
+    def __init__(self, out_dir=ASSET_DIR, width=AD_IMAGE_WIDTH, quality=AD_IMAGE_QUALITY):
+        self.out_dir = out_dir
+        self.width = width
+        self.quality = quality
+        self._manifest_path = os.path.join(out_dir, "manifest.json")
+        self._manifest = None
+        self._lock = threading.Lock()
+        self.generated = 0
+
+    def _load_manifest(self):
+        # Called with self._lock held
+        if self._manifest is None:
+            self._manifest = {}
+            if os.path.exists(self._manifest_path):
+                with open(self._manifest_path, "r") as f:
+                    self._manifest = json.load(f)
+        return self._manifest
+
+    def cached(self, source):
+        """
+        Returns:
+            str: the public path of the source's variant if it is already up to date, else None
+        """
+        if not os.path.exists(source):
+            return None
+        stat = os.stat(source)
+        with self._lock:
+            entry = self._load_manifest().get(source)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        if not os.path.exists(os.path.join(self.out_dir, entry["file"])):
+            return None
+        return f"{self.out_dir}/{entry['file']}"
+
+    def build(self, source):
+        """
+        Generates the variant for one source image (if it isn't up to date already).
+
+        Args:
+            source (str): path of the original image, e.g. ad_images/pfizer_arthritis.png
+
+        Returns:
+            str: the public path of the variant, or None if the source doesn't exist
+        """
+        path = self.cached(source)
+        if path is not None or not os.path.exists(source):
+            return path
+
+        with open(source, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(source))[0]
+
+        try:
+            image_module = lazy_import("PIL.Image")
+        except ImportError:
+            image_module = None
+        if image_module is not None:
+            image = image_module.open(io.BytesIO(data))
+            image.thumbnail((self.width, self.width))
+            filename = f"{stem}.{digest}.w{self.width}.webp"
+            out = io.BytesIO()
+            image.save(out, format="WEBP", quality=self.quality, method=6)
+            payload = out.getvalue()
+        else:
+            filename = f"{stem}.{digest}{os.path.splitext(source)[1]}"
+            payload = data
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        target = os.path.join(self.out_dir, filename)
+        with open(target + ".tmp", "wb") as f:
+            f.write(payload)
+        os.replace(target + ".tmp", target)
+
+        stat = os.stat(source)
+        with self._lock:
+            manifest = dict(self._load_manifest())
+            old = manifest.get(source)
+            manifest[source] = {"file": filename, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            with open(self._manifest_path + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(self._manifest_path + ".tmp", self._manifest_path)
+            self._manifest = manifest
+            self.generated += 1
+        if old is not None and old["file"] != filename and old["file"] not in {e["file"] for e in manifest.values()}:
+            # The source changed; its old variant is no longer referenced
+            try:
+                os.remove(os.path.join(self.out_dir, old["file"]))
+            except FileNotFoundError:
+                pass
+        return f"{self.out_dir}/{filename}"
+
+
+class AdPayloads:
+    """
+    The ad payload returned by /get_ad for each purchased category, built when the inventory changes rather than on
+    every request. Only categories whose ad information changed are rebuilt, and their image variants are generated on
+    a background thread; until a variant is ready the payload points at the original image.
+
+    Args:
+        inventory (AdInventory): the ad inventory to follow
+        assets (AssetPipeline): builds the optimized image variants (None serves the original images)
+    """
+
+    def __init__(self, inventory, assets=None):
+        self.inventory = inventory
+        self.assets = assets
+        self._payloads = None  # disease -> payload (without "category", which echoes the caller's keyword)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ad-assets")
+        self.rebuilds = 0
+
+        inventory.subscribe(self._on_inventory)
+
+    def _payload(self, info):
+        ad_path = info["ad_path"]
+        if self.assets is not None:
+            variant = self.assets.cached(ad_path)
+            if variant is not None:
+                ad_path = variant
+        return {"ad_path": ad_path, "company": info["company"], "cost": info["category_cost"], "link": info["link"]}
+
+    def _build(self, snapshot, diseases):
+        # Called with self._lock held
+        payloads = dict(self._payloads or {})
+        for disease in diseases:
+            info = snapshot.categories.get(disease)
+            if info is None:
+                payloads.pop(disease, None)
+            else:
+                payloads[disease] = self._payload(info)
+        self._payloads = payloads
+        self.rebuilds += 1
+
+        if self.assets is not None:
+            pending = [d for d in diseases if d in payloads and payloads[d]["ad_path"] == snapshot.categories[d]["ad_path"]]
+            if pending:
+                self._executor.submit(self._generate, pending)
+
+    def _generate(self, diseases):
+        built = []
+        for disease in diseases:
+            info = self.inventory.snapshot().categories.get(disease)
+            if info is None:
+                continue
+            try:
+                if self.assets.build(info["ad_path"]) is not None:
+                    built.append(disease)
+            except Exception as e:
+                print(f"ad image variant for {disease} failed: {e}")
+        if built:
+            with self._lock:
+                self._build(self.inventory.snapshot(), built)
+
+    def _on_inventory(self, snapshot, previous):
+        with self._lock:
+            if self._payloads is None:
+                return
+            changed = [d for d, info in snapshot.categories.items() if previous is None or previous.categories.get(d) != info]
+            changed += [d for d in self._payloads if d not in snapshot.categories]
+            if changed:
+                self._build(snapshot, changed)
+
+    def warm(self):
+        """
+        Generates every missing image variant now (instead of on the background thread) and rebuilds the payloads.
+        """
+        snapshot = self.inventory.snapshot()
+        if self.assets is not None:
+            for info in snapshot.categories.values():
+                self.assets.build(info["ad_path"])
+        with self._lock:
+            self._build(snapshot, list(snapshot.categories))
+
+    def image_path(self, ad_path):
+        """
+        Returns:
+            str: the optimized variant of an ad image if it is ready, else the image itself
+        """
+        if self.assets is None:
+            return ad_path
+        return self.assets.cached(ad_path) or ad_path
+
+    def get(self, disease):
+        """
+        Args:
+            disease (str): the category (lowercase)
+
+        Returns:
+            dict: ad_path, company, cost and link for the category, or None if it isn't purchased
+        """
+        payloads = self._payloads
+        if payloads is None:
+            payloads = self.prepare()
+        return payloads.get(disease)
+
+    def prepare(self):
+        """
+        Builds the payloads for the whole inventory (on app startup or first use) and queues any missing image variants.
+
+        Returns:
+            dict: disease -> payload
+        """
+        with self._lock:
+            if self._payloads is None:
+                snapshot = self.inventory.snapshot()
+                self._build(snapshot, list(snapshot.categories))
+            return self._payloads
+
+    def stats(self):
+        return {
+            "payloads": len(self._payloads or {}),
+            "rebuilds": self.rebuilds,
+            "variants_generated": self.assets.generated if self.assets is not None else 0,
+            "variants_enabled": self.assets is not None,
+        }
+
+
+ad_payloads = AdPayloads(inventory, AssetPipeline() if AD_IMAGE_VARIANTS else None)
+
+
+@warmup_hook("ad_images")
+def warm_ad_images():
+    ad_payloads.warm()
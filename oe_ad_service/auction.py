@@ -0,0 +1,329 @@
+import os
+import random
+import threading
+from inventory import inventory
+from storage import store
+
+# How an ad is chosen among the matched categories:
+#   "highest"      - the owner of the most expensive matched category (the original rule)
+#   "weighted"     - any standing bidder, at random in proportion to its bid
+#   "second_price" - the highest standing bid wins and pays the highest bid of another company
+AUCTION_MODE = os.environ.get("OE_AUCTION_MODE", "highest")
+AUCTION_MODES = ("highest", "weighted", "second_price")
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over non-negative weights: point updates, prefix sums and weighted sampling are all O(log n), and
+    appending a weight is O(log n) too.
+    """
+
+    def __init__(self):
+        self._tree = [0.0]  # 1-based
+        self._weights = []
+        self.total = 0.0
+
+    def __len__(self):
+        return len(self._weights)
+
+    def prefix_sum(self, count):
+        """
+        Returns:
+            float: the sum of the first count weights
+        """
+        total = 0.0
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def append(self, weight):
+        index = len(self._weights) + 1
+        # The new node covers (index - lowbit, index]; everything but its own weight is already in the tree
+        lowbit = index & -index
+        self._tree.append(weight + self.prefix_sum(index - 1) - self.prefix_sum(index - lowbit))
+        self._weights.append(weight)
+        self.total += weight
+        return index - 1
+
+    def set(self, position, weight):
+        delta = weight - self._weights[position]
+        self._weights[position] = weight
+        self.total += delta
+        index = position + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def find(self, value):
+        """
+        Returns:
+            int: the position whose cumulative weight range contains value (0 <= value < total)
+        """
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = position + step
+            if nxt < len(self._tree) and self._tree[nxt] <= value:
+                position = nxt
+                value -= self._tree[nxt]
+            step >>= 1
+        return min(position, len(self._weights) - 1)
+
+
+class CategoryAuction:
+    """
+    The standing bids on one category. Bids live in a Fenwick tree for weighted sampling, and the two highest bids are
+    kept up to date as bids are placed, so second-price selection doesn't have to scan the bidders.
+    """
+
+    def __init__(self):
+        self._tree = FenwickTree()
+        self._positions = {}  # company -> position in the tree
+        self._bidders = []  # position -> {"company", "bid", "ad_path", "link"}
+        self._top = []  # up to two (bid, position), highest first; None when it needs recomputing
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def total(self):
+        return self._tree.total
+
+    def place_bid(self, company, bid, ad_path, link):
+        """
+        Adds a bidder or changes its bid. O(log n).
+        """
+        entry = {"company": company, "bid": bid, "ad_path": ad_path, "link": link}
+        position = self._positions.get(company)
+        if position is None:
+            position = self._tree.append(bid)
+            self._positions[company] = position
+            self._bidders.append(entry)
+            lowered = False
+        else:
+            lowered = bid < self._bidders[position]["bid"]
+            self._bidders[position] = entry
+            self._tree.set(position, bid)
+
+        if self._top is None or lowered:
+            self._top = None
+        else:
+            top = [(b, p) for b, p in self._top if p != position] + [(bid, position)]
+            self._top = sorted(top, reverse=True)[:2]
+
+    def remove(self, company):
+        position = self._positions.pop(company, None)
+        if position is not None:
+            # The slot stays in the tree with no weight, so other positions don't move
+            self._tree.set(position, 0.0)
+            self._bidders[position] = None
+            self._top = None
+
+    def sample(self, rng):
+        """
+        Returns:
+            dict: a bidder chosen at random in proportion to its bid, or None if there are no bids
+        """
+        if self._tree.total <= 0:
+            return None
+        return self._bidders[self._tree.find(rng.random() * self._tree.total)]
+
+    def top_two(self, eligible=None):
+        """
+        Args:
+            eligible (callable): optional filter on bidders (e.g. budget checks); called with the bidder entry
+
+        Returns:
+            list[dict]: the highest and second highest eligible bidders (fewer if there are fewer bidders)
+        """
+        if self._top is None:
+            self._top = self._ranked()[:2]
+        top = [self._bidders[position] for _, position in self._top]
+        if eligible is None or all(eligible(entry) for entry in top):
+            return top
+        # Someone at the top is filtered out; fall back to walking the full ranking
+        found = []
+        for _, position in self._ranked():
+            if eligible(self._bidders[position]):
+                found.append(self._bidders[position])
+                if len(found) == 2:
+                    break
+        return found
+
+    def _ranked(self):
+        return sorted(((entry["bid"], position) for position, entry in enumerate(self._bidders) if entry is not None), reverse=True)
+
+    def eligible_bidders(self, eligible):
+        return [entry for entry in self._bidders if entry is not None and entry["bid"] > 0 and eligible(entry)]
+
+
+class AuctionEngine:
+    """
+    Per-category auctions over every company that has bought into a category. The current owner (from the ad inventory)
+    always bids its category_cost; companies that were outbid keep their last bid standing, purchases add or raise bids
+    through the inventory subscription, and any valid company can place a standing bid without buying the category. Standing bids are persisted through the storage backend. In "highest" mode the
+    engine isn't consulted, and purchases made meanwhile leave no standing bids behind.
+
+    Args:
+        inventory (AdInventory): the ad inventory to follow
+        store (JsonStore | SqliteStore): where standing bids are persisted
+        mode (str): one of AUCTION_MODES
+        seed (int): seed for the weighted selection, for reproducible runs
+    """
+
+    def __init__(self, inventory, store, mode=AUCTION_MODE, seed=None):
+        if mode not in AUCTION_MODES:
+            raise ValueError(f"Unknown auction mode {mode}")
+        self.inventory = inventory
+        self.store = store
+        self.mode = mode
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._auctions = None  # disease -> CategoryAuction
+
+        if mode != "highest":
+            # Under the original rule only the owners count, so purchases don't need to be turned into bids
+            inventory.subscribe(self._on_inventory)
+
+    def _load(self):
+        auctions = self._auctions
+        if auctions is not None:
+            return auctions
+        with self._lock:
+            if self._auctions is None:
+                auctions = {}
+                for disease, bidders in self.store.load_bids().items():
+                    auction = auctions.setdefault(disease, CategoryAuction())
+                    for company, entry in bidders.items():
+                        auction.place_bid(company, entry["bid"], entry.get("ad_path"), entry.get("link"))
+                for disease, info in self.inventory.snapshot().categories.items():
+                    auctions.setdefault(disease, CategoryAuction()).place_bid(
+                        info["company"], info["category_cost"], info.get("ad_path"), info.get("link")
+                    )
+                self._auctions = auctions
+            return self._auctions
+
+    def _on_inventory(self, snapshot, previous):
+        for disease, info in snapshot.categories.items():
+            old = previous.categories.get(disease) if previous is not None else None
+            if old == info:
+                continue
+            if old is not None and old["company"] != info["company"]:
+                # The outbid owner keeps its last bid standing
+                self.place_bid(disease, old["company"], old["category_cost"], old.get("ad_path"), old.get("link"))
+            self.place_bid(disease, info["company"], info["category_cost"], info.get("ad_path"), info.get("link"))
+
+    def place_bid(self, disease, company, bid, ad_path=None, link=None, persist=True):
+        """
+        Adds or raises a company's standing bid on a category.
+
+        Args:
+            disease (str): the disease category
+            company (str): the bidding company
+            bid (float): the bid amount
+            ad_path (str): the ad image shown if the bid wins
+            link (str): the ad link
+            persist (bool): also save the bid to storage
+        """
+        auctions = self._load()
+        with self._lock:
+            auctions.setdefault(disease, CategoryAuction()).place_bid(company, bid, ad_path, link)
+        if persist:
+            self.store.save_bid(disease, company, {"bid": bid, "ad_path": ad_path, "link": link})
+
+    def bidders(self, disease):
+        """
+        Returns:
+            int: the number of standing bids on the category
+        """
+        auction = self._load().get(disease)
+        return len(auction) if auction is not None else 0
+
+    def select(self, keywords, eligible=None):
+        """
+        Runs the configured auction over the categories found in a question.
+
+        Args:
+            keywords (list[str]): disease keywords found in the question (any casing; returned as given)
+            eligible (callable): optional filter called with (company, category); bidders it rejects (e.g. over budget)
+                are skipped
+
+        Returns:
+            dict: category, ad_path, company, cost (the winning bid, or the price paid under second_price) and link, or
+                None if none of the categories has an eligible bid
+        """
+        auctions = self._load()
+        matched = []
+        for keyword in keywords:
+            auction = auctions.get(keyword.lower())
+            if auction is not None and len(auction):
+                matched.append((keyword, auction))
+        if not matched:
+            return None
+
+        with self._lock:
+            if self.mode == "weighted":
+                category, winner = self._sample(matched, eligible)
+                if winner is None:
+                    return None
+                price = winner["bid"]
+            else:
+                contenders = []
+                for category, auction in matched:
+                    entry_ok = None if eligible is None else (lambda entry, category=category: eligible(entry["company"], category))
+                    contenders.extend((entry["bid"], category, entry) for entry in auction.top_two(entry_ok))
+                if not contenders:
+                    return None
+                contenders.sort(key=lambda c: c[0], reverse=True)
+                price, category, winner = contenders[0]
+                if self.mode == "second_price":
+                    # The winner's own bids on the other matched categories don't set its price. Every category's top
+                    # two are in the contenders, so the best bid of another company is among them.
+                    price = next((bid for bid, _, entry in contenders[1:] if entry["company"] != winner["company"]), price)
+
+        return {
+            "category": category,
+            "ad_path": winner["ad_path"],
+            "company": winner["company"],
+            "cost": price,
+            "link": winner["link"],
+        }
+
+    def _sample(self, matched, eligible, attempts=8):
+        # Pick a category in proportion to its total bids, then a bidder within it. Ineligible draws are retried a few
+        # times before falling back to a weighted pick over the eligible bidders only.
+        total = sum(auction.total for _, auction in matched)
+        for _ in range(attempts):
+            point = self.rng.random() * total
+            for category, auction in matched:
+                if point < auction.total:
+                    break
+                point -= auction.total
+            winner = auction.sample(self.rng)
+            if winner is not None and (eligible is None or eligible(winner["company"], category)):
+                return category, winner
+        if eligible is None:
+            return None, None
+
+        pool = [(category, entry) for category, auction in matched
+                for entry in auction.eligible_bidders(lambda entry, category=category: eligible(entry["company"], category))]
+        if not pool:
+            return None, None
+        point = self.rng.random() * sum(entry["bid"] for _, entry in pool)
+        for category, entry in pool:
+            if point < entry["bid"]:
+                return category, entry
+            point -= entry["bid"]
+        return pool[-1]
+
+    def stats(self):
+        auctions = self._load()
+        return {
+            "mode": self.mode,
+            "categories": len(auctions),
+            "bidders": {disease: len(auction) for disease, auction in auctions.items()},
+        }
+
+
+auction = AuctionEngine(inventory, store)
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from latency import LatencyTracker
+
+
+class MicroBatcher:
+    """
+    Collects items submitted on the event loop within a short window (or until the batch is full) and hands them to a
+    single send coroutine, resolving each caller's future with its own result.
+
+    Args:
+        send (coroutine function): takes a list of items and returns a list of results in the same order; an exception
+            in the list is raised to that item's caller only
+        window_s (float): how long the first item of a batch may wait for company
+        max_batch (int): dispatch immediately once this many items are waiting
+    """
+
+    def __init__(self, send, window_s, max_batch):
+        self.send = send
+        self.window_s = window_s
+        self.max_batch = max_batch
+
+        self._queue = []  # (item, future, enqueued_at)
+        self._timer = None
+        self._tasks = set()
+
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = {}
+        self.queue_delay = LatencyTracker(min_samples=1)
+
+    async def submit(self, item):
+        """
+        Args:
+            item: the item to send (here, a user question)
+
+        Returns:
+            the result for this item
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((item, future, time.perf_counter()))
+
+        if len(self._queue) >= self.max_batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+        if self._queue:
+            self._timer = asyncio.get_running_loop().call_later(self.window_s, self._dispatch)
+        if not batch:
+            return
+
+        now = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            self.queue_delay.record(now - enqueued_at)
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.send([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        """
+        Returns:
+            dict: batch counts, batch size distribution and the queueing delay added by batching
+        """
+        return {
+            "window_ms": self.window_s * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 3) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_delay": self.queue_delay.stats(),
+            "waiting": len(self._queue),
+        }
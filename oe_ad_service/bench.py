@@ -0,0 +1,402 @@
+"""
+Offline load test for the ad service. It starts the service on a scratch copy of this directory (so the data files here
+are never touched), with the OpenAI client pointed at a local fake chat-completions server (fake_openai.py), then drives
+/get_ad, /track_click, /log_query_time, /purchase_category, the analytics endpoints and the chart endpoints at a fixed
+request rate with a realistic mix of questions. It reports p50/p95/p99 latency and throughput per operation and the
+server's file writes and syscalls per request, and compares them against the committed baseline (bench_baseline.json);
+any regression beyond the tolerance makes the run exit with status 1. Run it from the oe_ad_service directory:
+
+    python bench.py
+    python bench.py --qps 100 --duration 30 --llm-latency-ms 500
+    python bench.py --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from fake_openai import EXTRA_DISEASES, FakeChatCompletions
+from matcher import load_synonyms
+
+BASELINE_PATH = "bench_baseline.json"
+
+# operation -> share of the requests sent
+DEFAULT_MIX = {
+    "get_ad": 70,
+    "track_click": 8,
+    "log_query_time": 10,
+    "analytics": 5,
+    "charts": 6,
+    "purchase_category": 1,
+}
+
+# Latency regressions smaller than this are noise at any tolerance
+LATENCY_SLACK_MS = 2.0
+# A percentile is only compared when at least this many requests were slower than it (p99 needs 500 requests)
+MIN_TAIL_SAMPLES = 5
+IO_SLACK = {"file_write_kb_per_request": 1.0, "syscalls_per_request": 2.0}
+
+QUESTION_TEMPLATES = [
+    "What are some common symptoms of {}?",
+    "What are the latest treatment options for {}?",
+    "Is {} hereditary?",
+    "How is {} diagnosed in adults?",
+    "What lifestyle changes help with {}?",
+    "What are some demographics that are at higher risk for {} and {}?",
+]
+NO_DISEASE_QUESTIONS = [
+    "What day is it?",
+    "How much water should I drink every day?",
+    "What is a normal resting heart rate?",
+    "How many hours of sleep do adults need?",
+    "Is coffee bad for you?",
+]
+COMPANIES = ["pfizer", "genentech", "gsk", "eli lilly"]
+AD_LINK = "https://example.com/ads/landing"
+
+
+class Workload:
+    """
+    Generates the requests of a benchmark run. Questions are drawn from a fixed pool with Zipf-like popularity, so popular
+    questions repeat (as they do in production) while the tail keeps missing the keyword cache. Roughly half of the
+    questions name a purchased category, some use a synonym or abbreviation, some name a disease nobody bought and the
+    rest mention no disease at all.
+
+    Args:
+        categories (dict): the ad inventory the server starts with (categories_ads.json)
+        mix (dict): operation -> share of the requests
+        seed (int): seed for everything random, so runs are repeatable
+        pool_size (int): number of distinct questions
+    """
+
+    def __init__(self, categories, mix=DEFAULT_MIX, seed=1, pool_size=400):
+        self.rng = random.Random(seed)
+        self.categories = {disease: dict(info) for disease, info in categories.items()}
+        self.operations = list(mix)
+        self.weights = [mix[op] for op in self.operations]
+
+        synonyms = load_synonyms()
+        purchased = list(categories)
+        aliases = [alias for disease in purchased for alias in synonyms.get(disease, {}).get("aliases", [])]
+        unclaimed = EXTRA_DISEASES + [disease for disease in synonyms if disease not in categories]
+
+        self.questions = []
+        for _ in range(pool_size):
+            kind = self.rng.random()
+            if kind < 0.15:
+                self.questions.append(self.rng.choice(NO_DISEASE_QUESTIONS))
+                continue
+            names = purchased if kind < 0.65 else aliases if kind < 0.8 else unclaimed
+            template = self.rng.choice(QUESTION_TEMPLATES)
+            picks = [self.rng.choice(names) for _ in range(template.count("{}"))]
+            self.questions.append(template.format(*picks))
+        self.popularity = [1 / (rank + 1) ** 1.1 for rank in range(pool_size)]
+
+    def next(self):
+        """
+        Returns:
+            tuple: (operation, HTTP method, path, keyword arguments for httpx)
+        """
+        op = self.rng.choices(self.operations, self.weights)[0]
+        rng = self.rng
+        if op == "get_ad":
+            question = rng.choices(self.questions, self.popularity)[0]
+            return op, "GET", "/get_ad", {"params": {"query": question, "user_id": f"user-{rng.randrange(1000)}"}}
+        if op == "track_click":
+            disease = rng.choice(list(self.categories))
+            return op, "POST", "/track_click", {"json": {"disease": disease, "company": self.categories[disease]["company"]}}
+        if op == "log_query_time":
+            diseases = rng.sample(list(self.categories) + EXTRA_DISEASES[:5], rng.randint(1, 2))
+            return op, "POST", "/log_query_time", {"json": {"diseases": diseases, "duration_ms": rng.randint(2000, 120000)}}
+        if op == "analytics":
+            company = rng.choice(COMPANIES)
+            path = rng.choice([f"/company_summary/{company}", "/company_summary", "/revenue",
+                               "/categories_for_sale?limit=20", "/categories_ads"])
+            return op, "GET", path, {}
+        if op == "charts":
+            company = rng.choice(COMPANIES)
+            path = rng.choice(["/categories_for_sale_chart", "/revenue_chart", f"/pie/total_clicks/{company}",
+                               f"/pie/total_paid/{company}"])
+            return op, "GET", path, {}
+
+        # A valid bid by a company that doesn't own the category yet, one dollar over the last price we know of
+        disease = rng.choice(list(self.categories))
+        info = self.categories[disease]
+        company = rng.choice([c for c in COMPANIES if c != info["company"]])
+        bid = info["category_cost"] + 1
+        info.update(company=company, category_cost=bid)
+        return op, "POST", "/purchase_category", {"json": {"disease": disease, "company": company, "bid_price": bid, "ad_link": AD_LINK}}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def process_io(pid):
+    """
+    Returns:
+        dict: the process's I/O counters from /proc (empty where that isn't available)
+    """
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f.read().splitlines() if line)}
+    except OSError:
+        return {}
+
+
+async def drive(base_url, workload, qps, duration_s, max_in_flight):
+    """
+    Sends requests open-loop at a fixed rate: request i is due at start + i / qps whether or not earlier ones have
+    finished, and its latency is measured from when it was due, so a slow server can't hide its queueing delay.
+
+    Returns:
+        tuple: ({operation: [latency ms]}, {operation: errors}, requests dropped for exceeding max_in_flight, elapsed s)
+    """
+    latencies = {}
+    errors = {}
+    dropped = 0
+    loop = asyncio.get_running_loop()
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        async def send(op, method, path, kwargs, due):
+            try:
+                response = await client.request(method, path, **kwargs)
+                failed = response.status_code >= 400 or (response.headers.get("content-type", "").startswith("application/json")
+                                                         and op != "purchase_category" and "error" in response.json())
+            except httpx.HTTPError:
+                failed = True
+            latencies.setdefault(op, []).append((loop.time() - due) * 1000)
+            if failed:
+                errors[op] = errors.get(op, 0) + 1
+
+        tasks = set()
+        start = loop.time()
+        total = int(qps * duration_s)
+        for i in range(total):
+            due = start + i / qps
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            op, method, path, kwargs = workload.next()
+            if len(tasks) >= max_in_flight:
+                dropped += 1
+                continue
+            task = asyncio.ensure_future(send(op, method, path, kwargs, due))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = loop.time() - start
+
+    return latencies, errors, dropped, elapsed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, llm_url, port, env_overrides):
+    env = dict(os.environ)
+    env.update({"OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": llm_url})
+    env.update(env_overrides)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/startup_report", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("server did not start within 60s")
+
+
+def run(args):
+    """
+    Runs one benchmark.
+
+    Returns:
+        dict: the scenario settings and the measured metrics
+    """
+    source = os.path.dirname(os.path.abspath(__file__))
+    scratch = tempfile.mkdtemp(prefix="oe-bench-")
+    workdir = os.path.join(scratch, "oe_ad_service")
+    shutil.copytree(source, workdir, ignore=shutil.ignore_patterns(
+        "__pycache__", "ad_assets", "*.db", "*.db-*", "events.log*", BASELINE_PATH))
+
+    fake = FakeChatCompletions(args.llm_latency_ms, args.llm_jitter_ms, args.completion_tokens, seed=args.seed,
+                               error_rate=args.llm_error_rate, slow_rate=args.llm_slow_rate, slow_ms=args.llm_slow_ms)
+    llm_url = fake.start()
+    port = free_port()
+    server = None
+    try:
+        env = dict(item.split("=", 1) for item in args.env)
+        server = start_server(workdir, llm_url, port, env)
+        with open(os.path.join(workdir, "categories_ads.json"), "r") as f:
+            workload = Workload(json.load(f), seed=args.seed)
+        base_url = f"http://127.0.0.1:{port}"
+
+        if args.warmup > 0:
+            asyncio.run(drive(base_url, workload, args.qps, args.warmup, args.max_in_flight))
+        llm_requests = fake.requests
+        io_before = process_io(server.pid)
+        latencies, errors, dropped, elapsed = asyncio.run(drive(base_url, workload, args.qps, args.duration, args.max_in_flight))
+        io_after = process_io(server.pid)
+        llm_requests = fake.requests - llm_requests
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        fake.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    completed = sum(len(values) for values in latencies.values())
+    operations = {}
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        operations[op] = {
+            "requests": len(values),
+            "errors": errors.get(op, 0),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+        }
+    metrics = {
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "requests": completed,
+        "dropped": dropped,
+        "error_rate": round(sum(errors.values()) / completed, 4) if completed else 0.0,
+        "llm_requests_per_request": round(llm_requests / completed, 4) if completed else 0.0,
+        "operations": operations,
+    }
+    if io_before and io_after and completed:
+        delta = {key: io_after[key] - io_before.get(key, 0) for key in io_after}
+        # write_bytes counts only what reaches files; the syscall counts include the requests' own socket traffic
+        metrics["file_write_kb_per_request"] = round(delta.get("write_bytes", 0) / 1024 / completed, 3)
+        metrics["syscalls_per_request"] = round((delta.get("syscr", 0) + delta.get("syscw", 0)) / completed, 2)
+
+    scenario = {
+        "qps": args.qps, "duration_s": args.duration, "seed": args.seed, "llm_latency_ms": args.llm_latency_ms,
+        "llm_jitter_ms": args.llm_jitter_ms, "completion_tokens": args.completion_tokens, "env": env,
+    }
+    if args.llm_error_rate or args.llm_slow_rate:
+        scenario.update(llm_error_rate=args.llm_error_rate, llm_slow_rate=args.llm_slow_rate, llm_slow_ms=args.llm_slow_ms)
+    return {"scenario": scenario, "metrics": metrics}
+
+
+def compare(result, baseline, tolerance):
+    """
+    Args:
+        result (dict): output of run
+        baseline (dict): a previous run's output
+        tolerance (float): allowed relative slowdown, e.g. 0.25 for 25%; latencies on a shared machine easily vary by
+            half between identical runs, hence the default of 1 (twice as slow)
+
+    Returns:
+        list[str]: a description of each regression (empty if there are none)
+    """
+    current, base = result["metrics"], baseline["metrics"]
+    regressions = []
+    for op, stats in base["operations"].items():
+        now = current["operations"].get(op)
+        if now is None:
+            continue
+        for key, q in (("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99)):
+            if min(now["requests"], stats["requests"]) * (100 - q) / 100 < MIN_TAIL_SAMPLES:
+                continue
+            limit = stats[key] * (1 + tolerance) + LATENCY_SLACK_MS
+            if now[key] > limit:
+                regressions.append(f"{op} {key}: {now[key]} > {limit:.2f} (baseline {stats[key]})")
+    limit = base["throughput_rps"] * (1 - tolerance)
+    if current["throughput_rps"] < limit:
+        regressions.append(f"throughput_rps: {current['throughput_rps']} < {limit:.2f} (baseline {base['throughput_rps']})")
+    for key, slack in IO_SLACK.items():
+        if key in base and key in current:
+            limit = base[key] * (1 + tolerance) + slack
+            if current[key] > limit:
+                regressions.append(f"{key}: {current[key]} > {limit:.2f} (baseline {base[key]})")
+    if current["error_rate"] > base["error_rate"] + 0.01:
+        regressions.append(f"error_rate: {current['error_rate']} (baseline {base['error_rate']})")
+    return regressions
+
+
+def print_report(result):
+    metrics = result["metrics"]
+    print(f"{'operation':<20}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, stats in metrics["operations"].items():
+        print(f"{op:<20}{stats['requests']:>10}{stats['errors']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"throughput: {metrics['throughput_rps']} req/s ({metrics['dropped']} dropped), error rate {metrics['error_rate']}")
+    print(f"LLM requests per request: {metrics['llm_requests_per_request']}")
+    if "file_write_kb_per_request" in metrics:
+        print(f"file writes: {metrics['file_write_kb_per_request']} KB/request, syscalls: {metrics['syscalls_per_request']}/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the ad service against a local fake OpenAI API")
+    parser.add_argument("--qps", type=float, default=50, help="target request rate")
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="requests outstanding before new ones are dropped")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="mean latency of the fake LLM")
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--completion-tokens", type=int, default=12, help="completion tokens per answered question")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake LLM requests answered with a 500")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="share of fake LLM requests delayed by --llm-slow-ms")
+    parser.add_argument("--llm-slow-ms", type=float, default=5000)
+    parser.add_argument("--env", nargs="*", default=[], help="extra server settings, e.g. OE_STORAGE_BACKEND=sqlite")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=1.0, help="allowed relative regression against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="save this run as the new baseline")
+    parser.add_argument("--output", help="also write the results to this json file")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --update-baseline to record one")
+        return
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    if baseline["scenario"] != result["scenario"]:
+        print("the baseline was recorded with different settings; rerun with those settings or --update-baseline")
+        sys.exit(2)
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print("regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("no regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import os
+import threading
+from collections import Counter
+from inventory import inventory
+from keyword_cache import normalize_query
+from matcher import display_name, load_synonyms
+
+# Map extracted disease names onto canonical categories before they are counted (0 counts them as extracted)
+CANONICALIZE = os.environ.get("OE_CANONICALIZE", "1") == "1"
+# Minimum trigram (Dice) similarity for a fuzzy match; 1 disables fuzzy matching
+FUZZY_THRESHOLD = float(os.environ.get("OE_CANONICAL_FUZZY_THRESHOLD", "0.8"))
+# Shorter names are only matched exactly; abbreviations are too close to each other for fuzzy matching
+FUZZY_MIN_LENGTH = 5
+# Distinct extracted names remembered; the memo is cleared once it is full
+MEMO_SIZE = int(os.environ.get("OE_CANONICAL_MEMO_SIZE", "10000"))
+
+# Counter tables keyed on disease names, re-keyed by rekey()
+REKEY_TABLES = ("disease_counts", "uncategorized", "disease_times", "ad_clicks")
+
+
+def clean_name(name):
+    """
+    The key a disease name is counted under when it doesn't map to a canonical category (what identify_keywords has
+    always used: lowercased, with surrounding and repeated whitespace removed).
+    """
+    return " ".join(name.lower().split())
+
+
+def trigrams(text):
+    padded = "  " + text + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index from character trigrams to names, for finding the most similar known name to a misspelled or
+    inflected one ("breast cancers", "type 2 diabetis").
+    """
+
+    def __init__(self, names):
+        self._names = []  # id -> (name, trigram count)
+        self._postings = {}  # trigram -> [ids]
+        for name in names:
+            grams = trigrams(name)
+            self._names.append((name, len(grams)))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(len(self._names) - 1)
+
+    def best(self, text, threshold):
+        """
+        Returns:
+            tuple: (most similar indexed name, Dice similarity), or (None, 0.0) if nothing reaches the threshold
+        """
+        grams = trigrams(text)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        best, best_score = None, 0.0
+        for name_id, count in shared.items():
+            name, size = self._names[name_id]
+            score = 2 * count / (len(grams) + size)
+            if score > best_score:
+                best, best_score = name, score
+        if best_score < threshold:
+            return None, 0.0
+        return best, best_score
+
+
+class Canonicalizer:
+    """
+    Maps disease names extracted by the LLM onto canonical categories, so "Type 2 Diabetes", "diabetes mellitus" and
+    "T2D" are all counted as diabetes. The vocabulary is the curated synonym table (disease_synonyms.json) plus the
+    purchased categories. A name is looked up exactly (after folding case and punctuation), then by trigram similarity;
+    names that match nothing are kept as they are. Results are memoized on the raw name, so repeated extractions cost
+    one dict lookup.
+
+    The vocabulary follows the ad inventory; adding or removing a category rebuilds the index and clears the memo.
+
+    Args:
+        inventory (AdInventory): the ad inventory to follow
+        synonyms (dict): canonical disease -> {"aliases": [...]} (defaults to disease_synonyms.json)
+        threshold (float): minimum similarity for a fuzzy match
+        memo_size (int): distinct raw names remembered
+    """
+
+    def __init__(self, inventory, synonyms=None, threshold=FUZZY_THRESHOLD, memo_size=MEMO_SIZE):
+        self.synonyms = load_synonyms() if synonyms is None else synonyms
+        self.threshold = threshold
+        self.memo_size = memo_size
+        self._lock = threading.Lock()
+        self._categories = None
+        self._exact = {}  # normalized alias -> canonical disease
+        self._fuzzy = None
+        self._memo = {}  # raw name -> canonical key
+
+        self.memo_hits = 0
+        self.exact_matches = 0
+        self.fuzzy_matches = 0
+        self.unmatched = 0
+
+        self._sync(inventory.snapshot())
+        inventory.subscribe(lambda snapshot, previous: self._sync(snapshot))
+
+    def _sync(self, snapshot):
+        categories = frozenset(snapshot.categories)
+        if categories == self._categories:
+            return
+        exact = {}
+        for canonical in set(self.synonyms) | categories:
+            for alias in [canonical] + self.synonyms.get(canonical, {}).get("aliases", []):
+                normalized = normalize_query(alias)
+                if normalized:
+                    exact.setdefault(normalized, canonical)
+        with self._lock:
+            self._exact = exact
+            self._fuzzy = TrigramIndex([alias for alias in exact if len(alias) >= FUZZY_MIN_LENGTH])
+            self._memo = {}
+            self._categories = categories
+
+    def canonical(self, name):
+        """
+        Args:
+            name (str): a disease name as extracted (any casing)
+
+        Returns:
+            str: the canonical category it refers to, or the cleaned name if it doesn't refer to a known one
+        """
+        key = self._memo.get(name)
+        if key is not None:
+            self.memo_hits += 1
+            return key
+
+        normalized = normalize_query(name)
+        key = self._exact.get(normalized)
+        if key is not None:
+            self.exact_matches += 1
+        elif self.threshold < 1 and len(normalized) >= FUZZY_MIN_LENGTH:
+            alias, _ = self._fuzzy.best(normalized, self.threshold)
+            if alias is not None:
+                key = self._exact[alias]
+                self.fuzzy_matches += 1
+        if key is None:
+            key = clean_name(name)
+            self.unmatched += 1
+
+        with self._lock:
+            if len(self._memo) >= self.memo_size:
+                self._memo = {}
+            self._memo[name] = key
+        return key
+
+    def keywords(self, names):
+        """
+        Canonicalizes the keywords extracted from a question. Names that map to a different canonical category are
+        replaced by its display name (e.g. "NSCLC" -> "Lung Cancer"), and names that refer to the same category are
+        listed once.
+
+        Args:
+            names (list[str]): the extracted disease names
+
+        Returns:
+            list[str]: the keywords, in order of first mention
+        """
+        keywords = []
+        seen = set()
+        for name in names:
+            key = self.canonical(name)
+            if key in seen:
+                continue
+            seen.add(key)
+            keywords.append(name if key == clean_name(name) else display_name(key, self.synonyms))
+        return keywords
+
+    def stats(self):
+        return {
+            "enabled": CANONICALIZE,
+            "aliases": len(self._exact),
+            "memo_entries": len(self._memo),
+            "memo_hits": self.memo_hits,
+            "exact_matches": self.exact_matches,
+            "fuzzy_matches": self.fuzzy_matches,
+            "unmatched": self.unmatched,
+            "fuzzy_threshold": self.threshold,
+        }
+
+
+def rekey(store, canonicalizer, tables=REKEY_TABLES, dry_run=False):
+    """
+    One-off job that merges the counters recorded under non-canonical names into their canonical keys. Run it with the
+    server stopped, since the server's telemetry buffer would otherwise write old keys back.
+
+    Mentions that turn out to refer to a purchased category are dropped from the uncategorized table, since they would
+    not have been recorded there with canonicalization in place.
+
+    Args:
+        store (JsonStore | SqliteStore): the storage backend to re-key
+        canonicalizer (Canonicalizer): maps names to their canonical keys
+        tables (tuple): the counter tables to re-key
+        dry_run (bool): only report what would change
+
+    Returns:
+        dict: table -> {"before": keys, "after": keys, "renamed": {old key: new key}, "dropped": [keys]}
+    """
+    purchased = set(store.load_categories())
+    report = {}
+    for name in tables:
+        data = store.load_table(name)
+        merged = {}
+        renamed = {}
+        dropped = []
+        for key, value in data.items():
+            new_key = canonicalizer.canonical(key)
+            if name == "uncategorized" and new_key in purchased:
+                dropped.append(key)
+                continue
+            if new_key != key:
+                renamed[key] = new_key
+            merged[new_key] = _merge(merged.get(new_key), value, keep=new_key == key)
+
+        report[name] = {"before": len(data), "after": len(merged), "renamed": renamed, "dropped": dropped}
+        if not dry_run and (renamed or dropped):
+            store.save_table(name, merged)
+    return report
+
+
+def _merge(existing, value, keep):
+    # Counters are numbers or (ad_clicks) dicts of numbers plus descriptive fields; the canonical key's own descriptive
+    # fields win over those of the names merged into it
+    if existing is None:
+        return dict(value) if isinstance(value, dict) else value
+    if not isinstance(value, dict):
+        return existing + value
+    primary, other = (value, existing) if keep else (existing, value)
+    merged = {**other, **primary}
+    for field in set(existing) | set(value):
+        a, b = existing.get(field), value.get(field)
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            merged[field] = a + b
+    return merged
+
+
+canonicalizer = Canonicalizer(inventory)
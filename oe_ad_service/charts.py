@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from startup import lazy_import, warmup_hook
+
+CHART_CACHE_SIZE = int(os.environ.get("OE_CHART_CACHE_SIZE", "64"))
+# Renders run in this many worker processes (0 renders on a thread in the API process instead)
+CHART_WORKERS = int(os.environ.get("OE_CHART_WORKERS", "2"))
+# At most this many renders may be queued or running; beyond that requests are turned away with 503
+CHART_QUEUE_SIZE = int(os.environ.get("OE_CHART_QUEUE_SIZE", "8"))
+CHART_RENDER_TIMEOUT_S = float(os.environ.get("OE_CHART_RENDER_TIMEOUT", "10"))
+CHART_RETRY_AFTER_S = 2
+
+
+class ChartBusy(Exception):
+    """
+    Raised when a chart can't be rendered right now (render queue full, render timed out or failed). Callers should answer
+    503 with a Retry-After header.
+    """
+
+    def __init__(self, reason, retry_after=CHART_RETRY_AFTER_S):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def render_chart(spec):
+    """
+    Renders a chart spec to PNG bytes. Uses the object-oriented Figure API with its own Agg canvas rather than pyplot, so
+    there is no global figure state and several charts can render at once. matplotlib is only imported here, i.e. in the
+    render processes, never by the API worker itself.
+
+    Args:
+        spec (dict): plain chart data; "kind" is "barh" or "pie", plus labels, values, title and figsize
+
+    Returns:
+        bytes: the PNG image
+    """
+    Figure = lazy_import("matplotlib.figure").Figure
+    FigureCanvasAgg = lazy_import("matplotlib.backends.backend_agg").FigureCanvasAgg
+
+    fig = Figure(figsize=tuple(spec["figsize"]), dpi=200)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    if spec["kind"] == "barh":
+        ax.barh(spec["labels"], spec["values"], color=spec.get("color"))
+        ax.set_xlabel(spec.get("xlabel", ""))
+        ax.set_ylabel(spec.get("ylabel", ""))
+        fig.tight_layout()
+    elif spec["kind"] == "pie":
+        ax.pie(spec["values"], labels=spec["labels"], autopct="%1.1f%%", startangle=90)
+    else:
+        raise ValueError(f"Unknown chart kind {spec['kind']}")
+    ax.set_title(spec["title"])
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight", dpi=200)
+    return buf.getvalue()
+
+
+def spec_etag(spec):
+    """
+    The chart's data version: a strong ETag derived from everything that goes into the image.
+    """
+    return '"' + hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:32] + '"'
+
+
+class ChartService:
+    """
+    Renders each chart once per version of its underlying data and keeps the PNG bytes in a bounded LRU. Charts are
+    identified by a key (e.g. "pie_total_paid:pfizer") and described by a producer that returns the chart spec, or None
+    when there is nothing to plot. When the data changes, refresh() re-renders the charts that have been requested before
+    on a background thread so the next request finds them warm.
+
+    Rendering happens in a dedicated process pool that only ever sees plain chart specs and hands back PNG bytes, so a
+    cold render never competes with /get_ad for the API worker. The number of queued renders is bounded, identical
+    renders in flight are shared, and a full queue or a slow render raises ChartBusy instead of piling up work. If a render
+    process dies, the broken pool is dropped and the next render starts a new one.
+
+    Args:
+        max_entries (int): number of charts kept
+        workers (int): render processes (0 renders on a thread in this process)
+        queue_size (int): maximum renders queued or running at once
+        render_timeout_s (float): how long a request waits for its render
+    """
+
+    def __init__(self, max_entries=CHART_CACHE_SIZE, workers=CHART_WORKERS, queue_size=CHART_QUEUE_SIZE, render_timeout_s=CHART_RENDER_TIMEOUT_S):
+        self.max_entries = max_entries
+        self.workers = workers
+        self.queue_size = queue_size
+        self.render_timeout_s = render_timeout_s
+
+        self._entries = OrderedDict()  # key -> (etag, png, producer)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart-refresh")
+        self._refresh_pending = threading.Event()
+
+        self._pool = None
+        self._closed = False
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._inflight = {}  # etag -> concurrent future of the render
+
+        self.hits = 0
+        self.not_modified = 0
+        self.renders = 0
+        self.background_renders = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.pool_restarts = 0
+
+    def _render_pool(self):
+        # Called with self._lock held
+        if self._pool is None:
+            if self.workers > 0:
+                # spawn rather than fork: the API process is multi-threaded
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chart-render")
+        return self._pool
+
+    def _discard_pool(self, pool):
+        # A render process died, which breaks the whole pool; drop it so the next render starts a fresh one
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self.pool_restarts += 1
+        print("chart render pool broke, starting a new one on the next render")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit_render(self, spec, etag):
+        """
+        Queues a render (or joins an identical one already in flight).
+
+        Args:
+            spec (dict): the chart spec
+            etag (str): its data version
+
+        Returns:
+            concurrent.futures.Future: resolves to the PNG bytes
+
+        Raises:
+            ChartBusy: the render queue is full, the render pool broke and is being replaced, or the service is closed
+        """
+        with self._lock:
+            future = self._inflight.get(etag)
+            if future is not None:
+                return future
+            if self._closed:
+                raise ChartBusy("chart renderer is shut down")
+            if not self._slots.acquire(blocking=False):
+                self.rejected += 1
+                raise ChartBusy("chart render queue is full")
+            pool = self._render_pool()
+            try:
+                future = pool.submit(render_chart, spec)
+            except BrokenProcessPool:
+                self._slots.release()
+                broken = True
+            except Exception:
+                self._slots.release()
+                raise
+            else:
+                broken = False
+                self._inflight[etag] = future
+        if broken:
+            self._discard_pool(pool)
+            raise ChartBusy("chart renderer is restarting")
+
+        def done(finished):
+            with self._lock:
+                self._inflight.pop(etag, None)
+            self._slots.release()
+            if not finished.cancelled() and isinstance(finished.exception(), BrokenProcessPool):
+                self._discard_pool(pool)
+
+        future.add_done_callback(done)
+        return future
+
+    async def get(self, key, producer, if_none_match=None):
+        """
+        Args:
+            key (str): identifies the chart
+            producer (callable): returns the chart spec, or None if there is no data
+            if_none_match (str): the client's If-None-Match header, if any
+
+        Returns:
+            tuple: (etag, png bytes) or (etag, None) if the client's copy is current; None if there is no data
+
+        Raises:
+            ChartBusy: the chart needs rendering but the render queue is full, or the render timed out or failed
+        """
+        loop = asyncio.get_running_loop()
+        spec = await loop.run_in_executor(None, producer)
+        if spec is None:
+            return None
+        etag = spec_etag(spec)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            self.not_modified += 1
+            self._remember(key, producer, entry)
+            return etag, None
+
+        if entry is not None and entry[0] == etag:
+            self.hits += 1
+            return etag, entry[1]
+
+        future = self.submit_render(spec, etag)
+        try:
+            png = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.render_timeout_s)
+        except asyncio.TimeoutError:
+            # The render keeps going in the pool and still holds its queue slot until it finishes
+            self.timeouts += 1
+            raise ChartBusy("chart render timed out")
+        except Exception as e:
+            # A render process died (the pool is replaced by the done callback) or the render itself failed
+            self.failures += 1
+            print(f"chart render failed for {key}: {e!r}")
+            raise ChartBusy("chart render failed")
+        self.renders += 1
+        self._store(key, etag, png, producer)
+        return etag, png
+
+    def _remember(self, key, producer, entry):
+        # Keep track of the chart so background refreshes cover it even if we never rendered it ourselves
+        if entry is None:
+            self._store(key, None, None, producer)
+
+    def _store(self, key, etag, png, producer):
+        with self._lock:
+            self._entries[key] = (etag, png, producer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self):
+        """
+        Schedules a background re-render of every cached chart whose data has changed. Repeated calls while a refresh is
+        already queued are coalesced.
+        """
+        if self._closed or self._refresh_pending.is_set():
+            return
+        self._refresh_pending.set()
+        self._executor.submit(self._refresh)
+
+    def _refresh(self):
+        self._refresh_pending.clear()
+        with self._lock:
+            entries = list(self._entries.items())
+
+        for key, (etag, _, producer) in entries:
+            try:
+                spec = producer()
+                if spec is None:
+                    continue
+                new_etag = spec_etag(spec)
+                if new_etag == etag:
+                    continue
+                png = self.submit_render(spec, new_etag).result(timeout=self.render_timeout_s)
+            except ChartBusy:
+                # Leave it for the next request; background work never competes for a full queue
+                continue
+            except FutureTimeoutError:
+                self.timeouts += 1
+                continue
+            except Exception as e:
+                print(f"chart refresh failed for {key}: {e}")
+                continue
+            self.background_renders += 1
+            with self._lock:
+                if key in self._entries:
+                    self._entries[key] = (new_etag, png, producer)
+
+    def stats(self):
+        """
+        Returns:
+            dict: cache occupancy and hit/render counters
+        """
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "renders": self.renders,
+            "background_renders": self.background_renders,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "pool_restarts": self.pool_restarts,
+            "render_workers": self.workers,
+            "render_queue_size": self.queue_size,
+            "renders_in_flight": len(self._inflight),
+        }
+
+    def close(self):
+        """
+        Cancels queued renders and stops the render pool. Called on app shutdown; renders requested afterwards (e.g. by
+        a background refresh still running) are refused rather than starting a new pool.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._closed = True
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+
+charts = ChartService()
+
+
+@warmup_hook("charts")
+def warm_charts():
+    # Starts the render processes and gets matplotlib imported in them before the first real chart request
+    spec = {"kind": "pie", "labels": ["warm-up"], "values": [1], "title": "warm-up", "figsize": [1, 1]}
+    charts.submit_render(spec, spec_etag(spec)).result(timeout=60)
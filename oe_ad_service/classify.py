@@ -1,50 +1,73 @@
+import asyncio
+import hashlib
 import os
-import openai
-import json
-client = openai.OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-DATA_PATH = "disease_counts.json"
-UNCATEGORIZED = "uncategorized.json"
-ADS_PATH = "ad_clicks.json"
-TIME_PATH = "disease_times.json"
-TOTAL_QUERIES_PATH = "total_queries.json"
-QUERY_COST_PATH = "query_costs.json"
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from assets import ad_payloads
+from auction import auction
+from batcher import MicroBatcher
+from canonical import CANONICALIZE, canonicalizer
+from keyword_cache import KeywordCache
+from inventory import inventory
+from latency import LatencyTracker
+from llm_client import CircuitOpenError, LLMUnavailable, llm
+from matcher import LocalMatcher, display_name
+from metrics import registry, stage
+from pacing import pacing
+from startup import warmup_hook
+from storage import store
+from telemetry import telemetry
+
+# The OpenAI clients (and the openai package itself) are only loaded when the first LLM call needs them; see llm_client.py
+# for their timeouts, retries and circuit breaker
+@warmup_hook("openai")
+def warm_openai():
+    llm.client()
+    llm.async_client()
+
+# Time /get_ad may spend finding an ad before it gives up and answers without one
+AD_LATENCY_BUDGET_S = float(os.environ.get("OE_AD_LATENCY_BUDGET_MS", "2000")) / 1000
+# Send a second, hedged LLM request when the first one is slower than the recent p95
+LLM_HEDGE = os.environ.get("OE_LLM_HEDGE", "0") == "1"
+# Questions arriving within the batch window are sent to the LLM together in one numbered multi-question prompt
+LLM_BATCHING = os.environ.get("OE_LLM_BATCHING", "1") == "1"
+LLM_BATCH_WINDOW_S = float(os.environ.get("OE_LLM_BATCH_WINDOW_MS", "5")) / 1000
+LLM_BATCH_MAX = int(os.environ.get("OE_LLM_BATCH_MAX", "8"))
+
+llm_latency = LatencyTracker()
+llm_requests = registry.counter("oe_llm_requests_total", "Keyword-extraction LLM calls", labels=("prompt",))
+llm_tokens = registry.counter("oe_llm_tokens_total", "Tokens used by keyword-extraction LLM calls", labels=("kind",))
+llm_cost = registry.counter("oe_llm_cost_usd_total", "Spend on keyword-extraction LLM calls in USD")
+ad_stats = {"budget_timeouts": 0, "hedges_sent": 0, "hedges_won": 0, "llm_unavailable": 0}
+
+# How identify_keywords uses the local matcher:
+#   "off"       - always ask the LLM
+#   "local"     - questions that match a purchased category locally skip the LLM entirely
+#   "async_llm" - as "local", but the LLM is still called in the background to record uncategorized mentions
+LOCAL_MATCH_MODE = os.environ.get("OE_LOCAL_MATCH_MODE", "async_llm")
 
 # Loading and Saving Time Spent on Query Data
 def load_time_data():
-    if os.path.exists(TIME_PATH):
-        with open(TIME_PATH, "r") as f:
-            return json.load(f)
-    return {}
+    return store.load_table("disease_times")
 
 def save_time_data(data):
-    with open(TIME_PATH, "w") as f:
-        json.dump(data, f, indent=2)
+    store.save_table("disease_times", data)
 
 # Loading, Saving, and Incremeneting Total Number of Queries Data
 def load_total_data():
-    if os.path.exists(TOTAL_QUERIES_PATH):
-        with open(TOTAL_QUERIES_PATH, "r") as f:
-            return json.load(f)
-    return {}
+    return store.load_table("total_queries")
 def save_total_data(data):
-    with open(TOTAL_QUERIES_PATH, "w") as f:
-        json.dump({"total_queries": data}, f)
+    store.save_table("total_queries", {"total_queries": data})
 
 def increment_total_queries():
-    total = load_total_data().get("total_queries", 0)
-    total+=1
-    save_total_data(total)
+    telemetry.incr("total_queries", "total_queries")
 
-# Logging time spent on queries in json
+# Logging time spent on queries (buffered, flushed to storage in batches)
 def log_query_time(diseases, duration_ms):
-    data = load_time_data()
-
     for disease in diseases:
-        if disease not in data:
-            data[disease] = 0
-        data[disease] += duration_ms
-
-    save_time_data(data)
+        telemetry.incr("disease_times", disease, duration_ms)
 
     increment_total_queries()
 
@@ -60,67 +83,135 @@ def get_highest_paying_ad(query):
     Returns:
         dict: the relevant information for ad
     """
-    keywords = identify_keywords(query)
-    
-    with open('categories_ads.json', 'r') as f:
-        data = json.load(f)
-    
+    return select_ad(identify_keywords(query))
+
+
+async def get_highest_paying_ad_async(query, budget_s=None, user=None):
+    """
+    Async version of get_highest_paying_ad used by the /get_ad route. Keyword extraction has to finish within the latency
+    budget; if it doesn't, the lookup keeps running in the background (so its result still reaches the cache and the
+    counters) and the caller gets the best local answer, usually no ad.
+
+    Args:
+        query (str): the user question
+        budget_s (float): seconds to wait for keyword extraction (defaults to AD_LATENCY_BUDGET_S)
+        user (str): who the ad is for, for frequency capping (optional)
+
+    Returns:
+        dict: the relevant information for ad
+    """
+    lookup = asyncio.ensure_future(identify_keywords_async(query))
+    try:
+        keywords = await asyncio.wait_for(asyncio.shield(lookup), budget_s if budget_s is not None else AD_LATENCY_BUDGET_S)
+    except asyncio.TimeoutError:
+        ad_stats["budget_timeouts"] += 1
+        _keep_alive(lookup)
+        matcher = get_local_matcher()
+        return select_ad([display_name(disease, matcher.synonyms) for disease in matcher.match(query)], user)
+    return select_ad(keywords, user)
+
+
+@stage("select_ad")
+def select_ad(keywords, user=None):
+    """
+    Picks the highest paying ad among the purchased categories in a list of keywords. With OE_AUCTION_MODE set to
+    "weighted" or "second_price" the choice is made by the auction engine over every standing bid instead. Advertisers
+    that are over their daily budget, or have hit the frequency cap for this user, are skipped.
+
+    Args:
+        keywords (list[str]): disease keywords found in the question
+        user (str): who the ad is for, for frequency capping (optional)
+
+    Returns:
+        dict: the relevant information for ad, or None if no keyword is a purchased category
+    """
+    if auction.mode != "highest":
+        ad = auction.select(keywords, eligible=lambda company, category: pacing.allows(company, category, user))
+        if ad is not None:
+            ad["ad_path"] = ad_payloads.image_path(ad["ad_path"])
+            pacing.record(ad["company"], ad["category"], user)
+        return ad
+
     matched_ads = []
 
     for keyword in keywords:
-        if keyword.lower() in data:
-            ad_info = data[keyword.lower()]
-            matched_ads.append({
-                "category": keyword,
-                "ad_path": ad_info["ad_path"],
-                "company": ad_info["company"],
-                "cost": ad_info["category_cost"],
-                "link": ad_info["link"]
-            })
+        # Payloads are prebuilt whenever the inventory changes; only the category echoes the caller's keyword
+        payload = ad_payloads.get(keyword.lower())
+        if payload is not None:
+            matched_ads.append({"category": keyword, **payload})
     
+    # Skip advertisers that are over budget or frequency capped
+    matched_ads = [ad for ad in matched_ads if pacing.allows(ad["company"], ad["category"], user)]
+
     # If no matching ads, return None
     if not matched_ads:
         return None
 
     # Select the ad with the highest cost
     best_ad = max(matched_ads, key=lambda x: x["cost"])
+    pacing.record(best_ad["company"], best_ad["category"], user)
     return best_ad
     
 
 # Loading and saving counts of disease mentions
 def load_counts():
-    if os.path.exists(DATA_PATH):
-        with open(DATA_PATH, "r") as f:
-            return json.load(f)
-    return {}
+    return store.load_table("disease_counts")
 
 def save_counts(counts):
-    with open(DATA_PATH, "w") as f:
-        json.dump(counts, f, indent=2)
+    store.save_table("disease_counts", counts)
 
 # Loading and saving unpurchased disease categories mentions
 def load_unclaimed():
-    if os.path.exists(UNCATEGORIZED):
-        with open(UNCATEGORIZED, "r") as f:
-            return json.load(f)
-    return {}
+    return store.load_table("uncategorized")
 
 def save_unclaimed(unclaimed):
-    with open(UNCATEGORIZED, "w") as f:
-        json.dump(unclaimed, f, indent=2)
+    store.save_table("uncategorized", unclaimed)
 
 # Loading clicks data
 def load_ads():
-    if os.path.exists(ADS_PATH):
-        with open(ADS_PATH, "r") as f:
-            return json.load(f)
-    return {}
+    return store.load_table("ad_clicks")
 
 
+_local_matcher = None
+_local_matcher_lock = threading.Lock()
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="uncategorized-lookup")
+
+@warmup_hook("matcher")
+def get_local_matcher():
+    """
+    Returns:
+        LocalMatcher: the matcher over the purchased categories (built on first use, kept in sync with the inventory)
+    """
+    global _local_matcher
+    if _local_matcher is None:
+        with _local_matcher_lock:
+            if _local_matcher is None:
+                _local_matcher = LocalMatcher(inventory)
+    return _local_matcher
+
+
+def parse_keywords(response):
+    """
+    Parses the numbered disease list returned by the LLM.
+
+    Args:
+        response (str): the GPT response
+
+    Returns:
+        list[str]: the disease(s) in the response
+    """
+    if "NO DISEASES" in response:
+        return []
+    lines = response.split("\n")
+    return [" ".join(line.split(" ")[1:]) for line in lines]
+
+
+@stage("identify_keywords")
 def identify_keywords(query):
     """
     This function extracts the disease keywords from the GPT response. It then returns list of diseases. 
-    It also updates some of the information about disease mentions in the json files
+    It also updates some of the information about disease mentions in the json files. Questions that mention a purchased
+    category (or one of its synonyms) are resolved locally without calling GPT, depending on LOCAL_MATCH_MODE.
 
     Args:
         query (str): the user question
@@ -128,43 +219,159 @@ def identify_keywords(query):
     Returns:
         list[str]: the disease(s) mentioned in the prompt
     """
-    response = gpt_lookup(query)
-    if "NO DISEASES" in response:
+    with stage("local_match"):
+        local = match_locally(query)
+    if local is not None:
+        if LOCAL_MATCH_MODE == "async_llm":
+            _background.submit(record_unclaimed_mentions, query)
+        return local
+
+    try:
+        response = gpt_lookup(query)
+    except LLMUnavailable:
+        # The LLM is down or the circuit is open, and the local matcher found nothing: no ad
+        ad_stats["llm_unavailable"] += 1
         return []
-    lines = response.split("\n")
-    lines = [" ".join(line.split(" ")[1:]) for line in lines]
+    lines = canonical_keywords(parse_keywords(response))
+    record_mentions(lines)
+    return lines
 
-    counts = load_counts()
-    for disease in lines:
-        counts[disease.lower()] = counts.get(disease.lower(), 0) + 1
-    save_counts(counts)
 
+@stage("identify_keywords")
+async def identify_keywords_async(query):
+    """
+    Async version of identify_keywords; the LLM call goes through the async client so no threadpool thread is held while
+    waiting on it.
 
-    uncategorized = load_unclaimed()
-    ads = load_ads()
+    Args:
+        query (str): the user question
+
+    Returns:
+        list[str]: the disease(s) mentioned in the prompt
+    """
+    with stage("local_match"):
+        local = match_locally(query)
+    if local is not None:
+        if LOCAL_MATCH_MODE == "async_llm":
+            _keep_alive(asyncio.ensure_future(record_unclaimed_mentions_async(query)))
+        return local
+
+    try:
+        response = await gpt_lookup_async(query)
+    except LLMUnavailable:
+        ad_stats["llm_unavailable"] += 1
+        return []
+    lines = canonical_keywords(parse_keywords(response))
+    record_mentions(lines)
+    return lines
+
+
+def match_locally(query):
+    """
+    Tries to resolve a question with the local matcher (unless LOCAL_MATCH_MODE is "off") and counts the mentions if it does.
+
+    Args:
+        query (str): the user question
+
+    Returns:
+        list[str]: the purchased categories mentioned, or None if the LLM has to be asked
+    """
+    if LOCAL_MATCH_MODE == "off":
+        return None
+    matcher = get_local_matcher()
+    local = matcher.match(query)
+    if not local:
+        return None
+    for disease in local:
+        telemetry.incr("disease_counts", disease)
+    return [display_name(disease, matcher.synonyms) for disease in local]
+
+
+@stage("canonicalize")
+def canonical_keywords(lines):
+    """
+    Maps the diseases extracted by the LLM onto their canonical categories (e.g. "T2D" -> "Diabetes"), unless
+    OE_CANONICALIZE is off.
+    """
+    if not CANONICALIZE:
+        return lines
+    return canonicalizer.keywords(lines)
+
+
+def disease_key(disease):
+    # The key a disease is counted under
+    return canonicalizer.canonical(disease) if CANONICALIZE else disease.lower()
+
+
+@stage("record_mentions")
+def record_mentions(lines):
+    # Counter updates are buffered and written out in batches by the telemetry flusher
+    snapshot = inventory.snapshot()
     for disease in lines:
-        if disease.lower() not in ads:
-            uncategorized[disease.lower()] = uncategorized.get(disease.lower(), 0) + 1
-    save_unclaimed(uncategorized)
+        key = disease_key(disease)
+        telemetry.incr("disease_counts", key)
+        if snapshot.lookup(key) is None:
+            telemetry.incr("uncategorized", key)
 
 
-    return lines
+# Background tasks are referenced here until they finish so the event loop doesn't garbage collect them
+_pending_tasks = set()
+
+def _keep_alive(task):
+    _pending_tasks.add(task)
+    task.add_done_callback(_pending_tasks.discard)
+
+
+def record_unclaimed_mentions(query):
+    """
+    Background half of the local fast path: asks GPT about a question that was already answered locally and records only
+    the diseases that aren't purchased categories (the purchased ones were counted when the question was matched).
+
+    Args:
+        query (str): the user question
+    """
+    try:
+        lines = parse_keywords(gpt_lookup(query))
+    except CircuitOpenError:
+        return
+    except Exception as e:
+        print(f"background keyword lookup failed: {e}")
+        return
+    record_unclaimed(lines)
+
+
+async def record_unclaimed_mentions_async(query):
+    try:
+        lines = parse_keywords(await gpt_lookup_async(query))
+    except CircuitOpenError:
+        return
+    except Exception as e:
+        print(f"background keyword lookup failed: {e}")
+        return
+    record_unclaimed(lines)
+
+
+@stage("record_mentions")
+def record_unclaimed(lines):
+    snapshot = inventory.snapshot()
+    for disease in lines:
+        key = disease_key(disease)
+        if snapshot.lookup(key) is None:
+            telemetry.incr("disease_counts", key)
+            telemetry.incr("uncategorized", key)
 
 # Loading and saving cost data for the LLM queries
 def load_query_cost():
-    if os.path.exists(QUERY_COST_PATH):
-        with open(QUERY_COST_PATH, "r") as f:
-            return json.load(f)
-    return {}
+    return store.load_table("query_costs")
 
 def save_query_cost(data):
-    with open(QUERY_COST_PATH, "w") as f:
-        json.dump(data, f, indent=2)
+    store.save_table("query_costs", data)
 
 def gpt_lookup(query):
     """
     This function calls GPT to identify the keywords in a prompt. It also computes the cost of the query to identify the keywords and
-    updates the query cost json information.
+    updates the query cost json information. Responses are cached on the normalized question, so repeated questions skip the
+    LLM call (and its cost) entirely.
 
     Args:
         query (str): The user query
@@ -172,29 +379,232 @@ def gpt_lookup(query):
     Returns:
         (str): The GPT response containing the diseases mentioned in the prompt
     """
-    prompt = prepare_prompt(query)
-    response = client.chat.completions.create(
-        model="gpt-4.1",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.1,
-        max_tokens=1000,
-    )
-    usage = response.usage
+    cached = keyword_cache.get(query)
+    if cached is not None:
+        return cached
+
+    request = completion_request(query)
+    llm.client()
+    start = time.perf_counter()
+    with stage("llm_call"):
+        response = llm.create(**request)
+    llm_latency.record(time.perf_counter() - start)
+    return handle_completion(query, response)
+
+
+async def gpt_lookup_async(query):
+    """
+    Async version of gpt_lookup. Concurrent questions are micro-batched into a single LLM call when batching is enabled.
+
+    Args:
+        query (str): The user query
+
+    Returns:
+        (str): The GPT response containing the diseases mentioned in the prompt
+    """
+    cached = keyword_cache.get(query)
+    if cached is not None:
+        return cached
+
+    if LLM_BATCHING:
+        return await keyword_batcher.submit(query)
+    return await hedged_lookup(query)
+
+
+async def hedged_lookup(query):
+    """
+    One async keyword-extraction call for a single question. If hedging is enabled and the call is still running after the
+    recent p95 latency, a second identical request is sent and whichever answers first wins.
+
+    Args:
+        query (str): The user query
+
+    Returns:
+        (str): The GPT response containing the diseases mentioned in the prompt
+    """
+    request = completion_request(query)
+
+    async def timed_call():
+        llm.async_client()
+        start = time.perf_counter()
+        with stage("llm_call"):
+            response = await llm.acreate(**request)
+        llm_latency.record(time.perf_counter() - start)
+        return response
+
+    primary = asyncio.ensure_future(timed_call())
+    hedge_after = llm_latency.percentile(95) if LLM_HEDGE else None
+    if hedge_after is None:
+        return handle_completion(query, await primary)
+
+    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+    if done:
+        return handle_completion(query, primary.result())
+
+    ad_stats["hedges_sent"] += 1
+    hedge = asyncio.ensure_future(timed_call())
+    done, pending = await asyncio.wait({primary, hedge}, return_when=asyncio.FIRST_COMPLETED)
+    winner = done.pop()
+    if winner.exception() is not None and pending:
+        # The first to finish failed (e.g. the circuit opened meanwhile); the other request may still succeed
+        done, pending = await asyncio.wait(pending)
+        winner = done.pop()
+    for task in pending:
+        task.cancel()
+    if winner is hedge:
+        ad_stats["hedges_won"] += 1
+    return handle_completion(query, winner.result())
+
+
+async def send_keyword_batch(queries):
+    """
+    Sends a micro-batch of questions to the LLM. A batch of one uses the normal single-question prompt; larger batches share
+    one numbered multi-question prompt, so the instruction text is paid for once. Questions whose answer can't be found in
+    the batched response are retried on their own, and a retry that fails only fails its own question.
+
+    Args:
+        queries (list[str]): the user questions
+
+    Returns:
+        list[str | Exception]: the GPT response for each question, in the same order, or the error of its retry
+    """
+    if len(queries) == 1:
+        return [await hedged_lookup(queries[0])]
+
+    request = batch_completion_request(queries)
+    llm.async_client()
+    start = time.perf_counter()
+    with stage("llm_batch_call"):
+        response = await llm.acreate(**request)
+    llm_latency.record(time.perf_counter() - start)
+
+    total_cost = completion_cost(response.usage)
+    record_llm_usage("batch", response.usage, total_cost)
+    telemetry.incr("query_costs", "query", total_cost)
+    try:
+        answers = parse_batch_response(response.choices[0].message.content, len(queries))
+    except Exception as e:
+        print(f"unreadable batch response, asking each question on its own: {e}")
+        answers = [None] * len(queries)
+
+    results = list(answers)
+    retries = []
+    for i, (query, answer) in enumerate(zip(queries, answers)):
+        if answer is None:
+            retries.append(i)
+        else:
+            keyword_cache.put(query, answer, total_cost / len(queries))
+    retried = await asyncio.gather(*(hedged_lookup(queries[i]) for i in retries), return_exceptions=True)
+    for i, result in zip(retries, retried):
+        results[i] = result
+    return results
+
+
+def completion_request(query):
+    """
+    Args:
+        query (str): The user query
+
+    Returns:
+        dict: the keyword arguments for chat.completions.create
+    """
+    with stage("prepare_prompt"):
+        prompt = prepare_prompt(query)
+    return {
+        "model": "gpt-4.1",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.1,
+        "max_tokens": 1000,
+    }
+
+
+def handle_completion(query, response):
+    """
+    Records the cost of a keyword-extraction completion, caches it and returns its text.
+
+    Args:
+        query (str): The user query
+        response: the chat completion returned by the OpenAI client
+
+    Returns:
+        (str): The GPT response containing the diseases mentioned in the prompt
+    """
+    total_cost = completion_cost(response.usage)
+    record_llm_usage("single", response.usage, total_cost)
+
+    telemetry.incr("query_costs", "query", total_cost)
+    gpt_response = response.choices[0].message.content
+
+    keyword_cache.put(query, gpt_response, total_cost)
+    return gpt_response
+
+
+def record_llm_usage(prompt, usage, cost):
+    # Feeds the LLM counters exported at /metrics
+    llm_requests.labels(prompt).inc()
+    llm_tokens.labels("prompt").inc(usage.prompt_tokens)
+    llm_tokens.labels("completion").inc(usage.completion_tokens)
+    llm_cost.inc(cost)
+
+
+def completion_cost(usage):
+    """
+    Args:
+        usage: the token usage of a chat completion
+
+    Returns:
+        float: the cost of the completion in USD
+    """
     prompt_tokens = usage.prompt_tokens
     completion_tokens = usage.completion_tokens
 
     input_cost = 0.005 / 1000
     output_cost = 0.015 / 1000
 
-    total_cost = prompt_tokens * input_cost + completion_tokens * output_cost
+    return prompt_tokens * input_cost + completion_tokens * output_cost
 
-    cost_dict = load_query_cost()
-    cost_dict["query"] = cost_dict.get("query", 0) + total_cost
 
-    save_query_cost(cost_dict)
-    gpt_response = response.choices[0].message.content
+def batch_completion_request(queries):
+    """
+    Args:
+        queries (list[str]): the user questions
 
-    return gpt_response
+    Returns:
+        dict: the keyword arguments for chat.completions.create for a batched prompt
+    """
+    with stage("prepare_prompt"):
+        prompt = prepare_batch_prompt(queries)
+    return {
+        "model": "gpt-4.1",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.1,
+        "max_tokens": 1000,
+    }
+
+
+_QUESTION_HEADER = re.compile(r"^\s*Question\s+(\d+)\s*:\s*$", re.MULTILINE)
+
+def parse_batch_response(response, count):
+    """
+    Splits the response to a batched prompt back into one answer per question, in the same format as the single-question
+    prompt ("1. Arthritis" lines or "NO DISEASES").
+
+    Args:
+        response (str): the GPT response to prepare_batch_prompt
+        count (int): number of questions in the batch
+
+    Returns:
+        list[str]: the answer for each question, or None where the response has no usable answer
+    """
+    answers = [None] * count
+    headers = list(_QUESTION_HEADER.finditer(response))
+    for i, header in enumerate(headers):
+        number = int(header.group(1))
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(response)
+        body = "\n".join(line.strip() for line in response[header.end():end].strip().split("\n") if line.strip())
+        if 1 <= number <= count and body:
+            answers[number - 1] = body
+    return answers
 
 
 def prepare_prompt(user_question):
@@ -230,3 +640,46 @@ def prepare_prompt(user_question):
     Here is the user question:
     {user_question}
     """
+
+
+def prepare_batch_prompt(user_questions):
+    """
+    This function prepares one prompt that asks GPT to identify the keywords in several user questions at once.
+
+    Args:
+        user_questions (list[str]): the User questions
+
+    Returns:
+        (str): the prompt, with the questions numbered from 1
+    """
+    # Questions are flattened onto one line each so they can't be confused with the numbering
+    numbered = "\n".join(f"Question {i}: {' '.join(question.split())}" for i, question in enumerate(user_questions, start=1))
+    return f"""You are tasked with identifying the relevant diseases or conditions that mentioned, referenced, or relevant to each of the
+    user questions below. For every question, in order, output a line "Question N:" followed by its answer in the following manner:
+
+    Example Output
+
+    Question 1:
+    1. Arthritis
+    2. Colon Cancer
+    Question 2:
+    NO DISEASES
+    Question 3:
+    1. Allergy
+
+
+    A question may mention any number of diseases or even no diseases. When a question has no diseases or conditions, its answer is NO DISEASES.
+    Return nothing else but the content in the format of the example output above, with exactly one answer for every question.
+
+
+    Here are the user questions:
+    {numbered}
+    """
+
+
+# Changing the prompt template changes its version, so stale cached responses are never served
+PROMPT_VERSION = hashlib.sha256(
+    (prepare_prompt("{user_question}") + prepare_batch_prompt(["{user_question}"])).encode()
+).hexdigest()[:12]
+keyword_cache = KeywordCache(PROMPT_VERSION)
+keyword_batcher = MicroBatcher(send_keyword_batch, LLM_BATCH_WINDOW_S, LLM_BATCH_MAX)
@@ -0,0 +1,320 @@
+import atexit
+import json
+import os
+import threading
+import time
+from shared import SHARED_STATE, FileLock, epoch_header, file_stamp, follower, log_epoch
+from telemetry import telemetry
+
+EVENTS_PATH = os.environ.get("OE_EVENTS_PATH", "events.log")  # empty keeps the event store in memory only
+# How many buckets each resolution keeps; older data survives only in the coarser resolutions
+RETENTION = {
+    "minute": int(os.environ.get("OE_EVENTS_MINUTES", "180")),
+    "hour": int(os.environ.get("OE_EVENTS_HOURS", "168")),
+    "day": int(os.environ.get("OE_EVENTS_DAYS", "400")),
+}
+# Rewrite the log as compacted buckets once it grows past this size
+COMPACT_BYTES = int(os.environ.get("OE_EVENTS_COMPACT_BYTES", str(4 * 1024 * 1024)))
+# Per-day rates are averaged over at most this many days
+RATE_WINDOW_DAYS = int(os.environ.get("OE_RATE_WINDOW_DAYS", "30"))
+
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# telemetry table -> event metric
+METRICS = {"disease_counts": "mentions", "ad_clicks": "clicks", "disease_times": "time_ms", "total_queries": "queries"}
+
+
+class BucketRing:
+    """
+    Fixed-size ring of time buckets at one resolution. A bucket's slot is its index modulo the ring size, so writing to a
+    new bucket silently evicts the one retention periods ago and memory never grows.
+
+    Args:
+        resolution_s (int): bucket width in seconds
+        retention (int): number of buckets kept
+    """
+
+    def __init__(self, resolution_s, retention):
+        self.resolution_s = resolution_s
+        self.retention = retention
+        self._slots = [None] * retention  # (bucket start, {(metric, key): amount})
+
+    def bucket_start(self, ts):
+        return int(ts // self.resolution_s) * self.resolution_s
+
+    def add(self, ts, metric, key, amount):
+        start = self.bucket_start(ts)
+        index = (start // self.resolution_s) % self.retention
+        slot = self._slots[index]
+        if slot is None or slot[0] != start:
+            if slot is not None and slot[0] > start:
+                # Older than anything this ring still holds
+                return
+            slot = (start, {})
+            self._slots[index] = slot
+        counts = slot[1]
+        counts[(metric, key)] = counts.get((metric, key), 0) + amount
+
+    def get(self, start):
+        slot = self._slots[(start // self.resolution_s) % self.retention]
+        if slot is None or slot[0] != start:
+            return None
+        return slot[1]
+
+    def buckets(self):
+        return sorted(slot for slot in self._slots if slot is not None)
+
+
+class EventStore:
+    """
+    Time-bucketed counts of clicks, mentions, dwell time and queries. Every telemetry increment is folded into a minute,
+    an hour and a day bucket, so range queries read at most one bucket per step of the requested resolution and never
+    scan raw events. Each resolution is a ring buffer with its own retention: recent minutes are kept in detail, older
+    activity only as hourly and daily totals.
+
+    Events are appended to a log file in batches (alongside the telemetry flushes) and replayed on startup. When the log
+    grows too large it is rewritten as the compacted buckets it describes.
+
+    When several workers share the log, the buckets are built from the log alone: each worker appends its own events
+    and reads back everything appended since it last looked, its own and the other workers', so every worker sees the
+    same counts (up to the flush and refresh intervals). Appends and compactions hold a lock file. A compaction starts the
+    rewritten log with a header carrying the next epoch, so the others notice it even if the new file reuses the old
+    one's inode, and replay it from the start.
+
+    Args:
+        path (str): the append-only event log ("" to keep everything in memory)
+        retention (dict): buckets kept per resolution ("minute", "hour", "day")
+        shared (bool): other workers append to the same log
+    """
+
+    def __init__(self, path=EVENTS_PATH, retention=RETENTION, shared=SHARED_STATE):
+        self.path = path
+        self.retention = retention
+        self.shared = shared
+        self._rings = {}
+        self._reset()
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path + ".lock") if path else None
+        self._unwritten = []  # log lines not yet appended
+        self._epoch = None  # the log read so far (None before the first read), and how far
+        self._offset = 0
+        self.events = 0
+        self.compactions = 0
+        self._loaded = False
+
+    def _reset(self):
+        self._rings = {name: BucketRing(RESOLUTIONS[name], self.retention[name]) for name in RESOLUTIONS}
+        self.first_ts = None
+
+    def _apply(self, ts, resolution, metric, key, amount):
+        # Called with self._lock held. A record at a given resolution feeds that resolution and every coarser one.
+        for name, ring in self._rings.items():
+            if ring.resolution_s >= resolution:
+                ring.add(ts, metric, key, amount)
+        if self.first_ts is None or ts < self.first_ts:
+            self.first_ts = ts
+
+    def load(self):
+        """
+        Replays the event log. Safe to call more than once; only the first call reads the file.
+        """
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            self._follow()
+
+    def _follow(self):
+        # Called with self._lock held. Applies the records appended to the log since it was last read; a log that has
+        # been replaced by a compaction is read again from the start.
+        if not self.path:
+            return
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            epoch, header_end = log_epoch(f.readline())
+            if epoch != self._epoch or os.fstat(f.fileno()).st_size < self._offset:
+                if self._epoch is not None:
+                    self._reset()
+                self._epoch = epoch
+                self._offset = header_end
+            f.seek(self._offset)
+            data = f.read()
+        # A final line without its newline is still being appended (or was torn by a crash); leave it for later
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                ts, resolution, metric, key, amount = json.loads(line)
+            except ValueError:
+                # A torn line from a crash mid-append
+                continue
+            self._apply(ts, resolution, metric, key, amount)
+
+    def follow(self):
+        """
+        Picks up the events other workers have appended to the log since it was last read.
+        """
+        self.load()
+        with self._lock:
+            self._follow()
+
+    def record(self, metric, key, amount=1, ts=None):
+        """
+        Args:
+            metric (str): "clicks", "mentions", "time_ms" or "queries"
+            key (str): the disease category (or "total_queries")
+            amount (int | float): how much to add
+            ts (float): when it happened (defaults to now)
+        """
+        ts = time.time() if ts is None else ts
+        self.load()
+        with self._lock:
+            if not self.shared or not self.path:
+                # Shared logs are only applied once read back, so this worker's events aren't counted twice
+                self._apply(ts, 0, metric, key, amount)
+            if self.path:
+                self._unwritten.append([ts, 0, metric, key, amount])
+            self.events += 1
+
+    def record_incr(self, name, key, amount):
+        """
+        Telemetry listener: turns counter increments into events.
+        """
+        metric = METRICS.get(name)
+        if metric is not None:
+            self.record(metric, key, amount)
+
+    def flush(self):
+        """
+        Appends the buffered events to the log, compacting it if it has grown too large.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            lines, self._unwritten = self._unwritten, []
+        with self._file_lock:
+            if lines:
+                with open(self.path, "a") as f:
+                    f.write("".join(json.dumps(line) + "\n" for line in lines))
+            if self.shared:
+                with self._lock:
+                    self._follow()
+            if os.path.exists(self.path) and os.path.getsize(self.path) > COMPACT_BYTES:
+                self._compact()
+
+    def compact(self):
+        """
+        Rewrites the log as the buckets currently held: every minute bucket, then for each hour and day only what its
+        finer buckets don't already account for. Replaying the result rebuilds exactly the same rings.
+        """
+        if not self.path:
+            return
+        with self._file_lock:
+            self._compact()
+
+    def _compact(self):
+        # Called with self._file_lock held
+        with self._lock:
+            if self.shared:
+                # Catch up with the other workers first, so the rewrite keeps their events
+                self._follow()
+            records = []
+            finer = None
+            for name in ("minute", "hour", "day"):
+                ring = self._rings[name]
+                for start, counts in ring.buckets():
+                    residual = dict(counts)
+                    if finer is not None:
+                        for sub_start in range(start, start + ring.resolution_s, finer.resolution_s):
+                            for item, amount in (finer.get(sub_start) or {}).items():
+                                residual[item] = residual.get(item, 0) - amount
+                    for (metric, key), amount in residual.items():
+                        if amount:
+                            records.append([start, ring.resolution_s, metric, key, amount])
+                finer = ring
+            if not self.shared:
+                # Events still waiting to be appended are already in the rings, so the rewrite covers them
+                self._unwritten = []
+
+            epoch = (self._epoch or 0) + 1
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(epoch_header(epoch))
+                f.write("".join(json.dumps(record) + "\n" for record in records).encode())
+                self._offset = f.tell()
+            os.replace(tmp_path, self.path)
+            self._epoch = epoch
+            self.compactions += 1
+
+    def series(self, metric, key, resolution="day", start=None, end=None, last=None):
+        """
+        Range query: one value per bucket between start and end, oldest first.
+
+        Args:
+            metric (str): "clicks", "mentions", "time_ms" or "queries"
+            key (str): the disease category (or "total_queries")
+            resolution (str): "minute", "hour" or "day"
+            start (float): range start as a unix timestamp
+            end (float): range end as a unix timestamp (defaults to now)
+            last (int): alternatively, the number of most recent buckets (including the current one)
+
+        Returns:
+            list[tuple]: (bucket start, value); buckets older than the resolution's retention are left out
+        """
+        self.load()
+        ring = self._rings[resolution]
+        end = time.time() if end is None else end
+        last_bucket = ring.bucket_start(end)
+        if last is not None:
+            first_bucket = last_bucket - (last - 1) * ring.resolution_s
+        else:
+            first_bucket = ring.bucket_start(start if start is not None else end)
+        oldest = last_bucket - (ring.retention - 1) * ring.resolution_s
+
+        series = []
+        with self._lock:
+            for bucket in range(max(first_bucket, oldest), last_bucket + 1, ring.resolution_s):
+                counts = ring.get(bucket) or {}
+                series.append((bucket, counts.get((metric, key), 0)))
+        return series
+
+    def daily_rate(self, metric, key, days=RATE_WINDOW_DAYS, now=None):
+        """
+        Average per day over the last `days` days, or over the days since recording started if that is shorter.
+
+        Returns:
+            float: the per-day rate (0 if nothing has been recorded yet)
+        """
+        now = time.time() if now is None else now
+        self.load()
+        if self.first_ts is None:
+            return 0
+        observed_days = max(1, int((now - self.first_ts) // 86400) + 1)
+        window = min(days, observed_days)
+        return sum(value for _, value in self.series(metric, key, "day", end=now, last=window)) / window
+
+    def stats(self):
+        with self._lock:
+            return {
+                "events": self.events,
+                "shared": self.shared,
+                "unwritten": len(self._unwritten),
+                "compactions": self.compactions,
+                "log_bytes": os.path.getsize(self.path) if self.path and os.path.exists(self.path) else 0,
+                "retention": {name: ring.retention for name, ring in self._rings.items()},
+                "first_event": self.first_ts,
+            }
+
+
+events = EventStore()
+telemetry.on_incr(events.record_incr)
+telemetry.on_flush(lambda batch: events.flush())
+atexit.register(events.flush)
+if SHARED_STATE and events.path:
+    follower.watch("events", lambda: file_stamp(events.path), events.follow)
@@ -0,0 +1,242 @@
+"""
+Local stand-in for the OpenAI chat-completions API, for benchmarks and tests that must not call the real service. It
+answers the keyword-extraction prompts (single and batched) by looking for known disease names in the questions, after a
+configurable delay and with configurable token usage. Point the service at it with OPENAI_BASE_URL:
+
+    python fake_openai.py --port 8100 --latency-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake uvicorn app:app
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from matcher import load_synonyms
+
+# Diseases the fake model "knows" besides the synonym table; none of them are purchased categories
+EXTRA_DISEASES = [
+    "gout", "eczema", "migraine", "psoriasis", "hypothyroidism", "glaucoma", "anemia", "osteoporosis", "epilepsy",
+    "tuberculosis", "hepatitis c", "celiac disease", "lupus", "sickle cell disease", "parkinson's disease",
+]
+
+_SINGLE_QUESTION = re.compile(r"Here is the user question:\s*(.*)\s*$", re.DOTALL)
+_BATCH_QUESTION = re.compile(r"^\s*Question (\d+): (.*)$", re.MULTILINE)
+
+
+class FakeChatCompletions:
+    """
+    Threaded HTTP server implementing POST /v1/chat/completions for the keyword-extraction prompts. It can also inject
+    faults: a share of the requests fail with an error status, and a share are delayed by an extra amount (to trip client
+    timeouts). The fault settings are plain attributes and can be changed while the server runs.
+
+    Args:
+        latency_ms (float): mean response delay
+        jitter_ms (float): the delay is drawn uniformly from latency_ms +/- jitter_ms
+        completion_tokens (int): completion tokens reported per answered question
+        prompt_tokens (int): prompt tokens reported per request (None estimates them as one per 4 prompt characters)
+        seed (int): seed for the delays and faults
+        error_rate (float): share of requests answered with error_status
+        error_status (int): HTTP status of the injected errors (e.g. 500, 503 or 429)
+        slow_rate (float): share of requests delayed by slow_ms on top of the normal latency
+        slow_ms (float): the extra delay of slow requests
+        unanswerable (iterable[str]): questions containing any of these strings get no answer in a batched prompt, and
+            error_status when asked on their own
+    """
+
+    def __init__(self, latency_ms=300, jitter_ms=100, completion_tokens=12, prompt_tokens=None, seed=None,
+                 error_rate=0.0, error_status=500, slow_rate=0.0, slow_ms=0, unanswerable=()):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.completion_tokens = completion_tokens
+        self.prompt_tokens = prompt_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.unanswerable = tuple(unanswerable)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        names = {}
+        for canonical, entry in load_synonyms().items():
+            display = entry.get("display", canonical.title())
+            for alias in [canonical] + entry.get("aliases", []):
+                names[alias] = display
+        for disease in EXTRA_DISEASES:
+            names[disease] = disease.title()
+        # Longest names first, so "small cell lung cancer" is found rather than "lung cancer" inside it
+        self._patterns = [(re.compile(r"\b" + re.escape(name) + r"\b", re.IGNORECASE), display)
+                          for name, display in sorted(names.items(), key=lambda item: -len(item[0]))]
+
+        self.requests = 0
+        self.questions = 0
+        self.errors = 0
+        self.slow = 0
+
+    def diseases(self, question):
+        """
+        Returns:
+            list[str]: the diseases the fake model finds in a question, in order of first mention
+        """
+        found = []
+        text = question
+        for pattern, display in self._patterns:
+            match = pattern.search(text)
+            if match is not None:
+                found.append((match.start(), display))
+                text = text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+        return [display for _, display in sorted(found)]
+
+    def answer(self, question):
+        if any(text in question for text in self.unanswerable):
+            return None
+        diseases = self.diseases(question)
+        if not diseases:
+            return "NO DISEASES"
+        return "\n".join(f"{i}. {disease}" for i, disease in enumerate(diseases, start=1))
+
+    def complete(self, request):
+        """
+        Builds the chat completion for a request body.
+
+        Returns:
+            dict: the response body, in the OpenAI format (None for an unanswerable question)
+        """
+        prompt = request["messages"][-1]["content"]
+        batch = _BATCH_QUESTION.findall(prompt)
+        if batch:
+            content = "\n".join(f"Question {number}:\n{self.answer(question) or ''}" for number, question in batch)
+            questions = len(batch)
+        else:
+            match = _SINGLE_QUESTION.search(prompt)
+            content = self.answer(match.group(1).strip() if match else prompt)
+            questions = 1
+        with self._lock:
+            self.requests += 1
+            self.questions += questions
+        if content is None:
+            return None
+
+        prompt_tokens = self.prompt_tokens if self.prompt_tokens is not None else len(prompt) // 4
+        completion_tokens = self.completion_tokens * questions
+        return {
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4.1"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def delay_s(self):
+        with self._lock:
+            delay_ms = self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(delay_ms, 0) / 1000
+
+    def fault(self):
+        """
+        Draws the faults for one request.
+
+        Returns:
+            tuple: (HTTP status to fail the request with, or None to answer it; extra delay in seconds)
+        """
+        with self._lock:
+            # No draws without faults, so the seeded delays stay the same as before
+            status = self.error_status if self.error_rate and self._rng.random() < self.error_rate else None
+            extra_s = self.slow_ms / 1000 if self.slow_rate and self._rng.random() < self.slow_rate else 0
+            self.errors += status is not None
+            self.slow += extra_s > 0
+        return status, extra_s
+
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Starts serving on a background thread.
+
+        Args:
+            host (str): address to bind
+            port (int): port to bind (0 picks a free one)
+
+        Returns:
+            str: the base URL to give the OpenAI client
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                status, extra_s = fake.fault()
+                if status is not None:
+                    time.sleep(extra_s)
+                    self._send(status, {"error": {"message": "injected fault", "type": "server_error", "code": None}})
+                    return
+                response = fake.complete(json.loads(body))
+                time.sleep(fake.delay_s() + extra_s)
+                if response is None:
+                    self._send(fake.error_status, {"error": {"message": "unanswerable question", "type": "server_error", "code": None}})
+                    return
+                self._send(200, response)
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                try:
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client timed out or was cancelled before the answer
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI chat-completions API for the keyword prompts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--completion-tokens", type=int, default=12)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed with --error-status")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests delayed by another --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    fake = FakeChatCompletions(args.latency_ms, args.jitter_ms, args.completion_tokens, error_rate=args.error_rate,
+                               error_status=args.error_status, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    print(f"fake OpenAI API at {fake.start(args.host, args.port)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
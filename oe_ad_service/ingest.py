@@ -0,0 +1,132 @@
+import json
+import os
+from typing import Annotated, List, Literal, Optional, Union
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from inventory import inventory
+from telemetry import telemetry
+
+# Largest batch accepted by the ingestion endpoint
+MAX_BATCH_EVENTS = int(os.environ.get("OE_INGEST_MAX_EVENTS", "1000"))
+
+
+class ClickEvent(BaseModel):
+    type: Literal["click"] = "click"
+    disease: str
+    company: Optional[str] = None
+
+
+class QueryTimeEvent(BaseModel):
+    type: Literal["query_time"] = "query_time"
+    diseases: List[str]
+    duration_ms: int
+
+
+Event = Annotated[Union[ClickEvent, QueryTimeEvent], Field(discriminator="type")]
+_event_adapter = TypeAdapter(Event)
+
+
+def parse_events(body, ndjson=False):
+    """
+    Parses and validates a batch of client events.
+
+    Args:
+        body (bytes): a JSON list of events, or one JSON event per line when ndjson is set
+        ndjson (bool): whether the body is newline-delimited JSON
+
+    Returns:
+        list[tuple]: (event, None) for each valid event and (None, error message) for each invalid one, in order
+
+    Raises:
+        ValueError: the body as a whole can't be read as a batch
+    """
+    if ndjson:
+        items = []
+        for line in body.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append((json.loads(line), None))
+            except ValueError:
+                items.append((None, "invalid JSON"))
+    else:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise ValueError("body is not valid JSON")
+        if not isinstance(data, list):
+            raise ValueError("expected a JSON list of events")
+        items = [(item, None) for item in data]
+
+    if len(items) > MAX_BATCH_EVENTS:
+        raise ValueError(f"at most {MAX_BATCH_EVENTS} events per batch")
+
+    parsed = []
+    for item, error in items:
+        if error is not None:
+            parsed.append((None, error))
+            continue
+        try:
+            parsed.append((_event_adapter.validate_python(item), None))
+        except ValidationError as e:
+            parsed.append((None, "; ".join(_describe(err) for err in e.errors())))
+    return parsed
+
+
+def _describe(error):
+    location = ".".join(str(part) for part in error["loc"])
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+
+def increments_for(event, snapshot):
+    """
+    Args:
+        event (ClickEvent | QueryTimeEvent): a validated event
+        snapshot (InventorySnapshot): the inventory the batch is checked against
+
+    Returns:
+        list[tuple]: the counter increments (name, key, amount) the event stands for
+
+    Raises:
+        ValueError: the event refers to something that doesn't exist
+    """
+    if isinstance(event, ClickEvent):
+        disease = event.disease.lower()
+        if snapshot.lookup(disease) is None:
+            raise ValueError(f"No ad for category {disease}")
+        return [("ad_clicks", disease, 1)]
+
+    increments = [("disease_times", disease, event.duration_ms) for disease in event.diseases]
+    increments.append(("total_queries", "total_queries", 1))
+    return increments
+
+
+def apply_events(parsed, flush=False):
+    """
+    Applies a batch of events. All accepted events go into the telemetry buffer together and reach storage in the same
+    flush, i.e. in one storage transaction.
+
+    Args:
+        parsed (list[tuple]): output of parse_events
+        flush (bool): write the batch to storage before returning
+
+    Returns:
+        list[dict]: per-event status, in order
+    """
+    snapshot = inventory.snapshot()
+    increments = []
+    results = []
+    for index, (event, error) in enumerate(parsed):
+        if error is None:
+            try:
+                increments.extend(increments_for(event, snapshot))
+            except ValueError as e:
+                error = str(e)
+        if error is None:
+            results.append({"index": index, "status": "ok"})
+        else:
+            results.append({"index": index, "status": "error", "error": error})
+
+    telemetry.incr_many(increments)
+    if flush:
+        telemetry.flush()
+    return results
@@ -0,0 +1,168 @@
+import threading
+from shared import SHARED_STATE, follower
+from storage import VersionConflict, store
+
+
+class InventorySnapshot:
+    """
+    An immutable, consistent view of the ad inventory at a single version. Readers hold on to a snapshot for the
+    duration of a request so that a concurrent purchase can never give them a half-updated view. Nothing in a snapshot
+    should be mutated after it is built.
+
+    Attributes:
+        version (int): monotonically increasing inventory version
+        categories (dict): disease category -> raw ad information (same shape as categories_ads.json)
+        by_company (dict): lowercased company name -> list of disease categories owned by that company
+    """
+
+    __slots__ = ("version", "categories", "by_company")
+
+    def __init__(self, version, categories):
+        self.version = version
+        self.categories = categories
+
+        by_company = {}
+        for disease, info in categories.items():
+            by_company.setdefault(info["company"].lower(), []).append(disease)
+        self.by_company = by_company
+
+    def lookup(self, keyword):
+        """
+        Keyword -> ad lookup against this snapshot.
+
+        Args:
+            keyword (str): disease keyword (any casing)
+
+        Returns:
+            dict: raw ad information for the category, or None if the category has not been purchased
+        """
+        return self.categories.get(keyword.lower())
+
+    def version_of(self, disease):
+        """
+        Returns:
+            int: the category's own version, bumped on every purchase (None if the category doesn't exist)
+        """
+        info = self.categories.get(disease)
+        return info.get("version", 0) if info is not None else None
+
+    def company_categories(self, company):
+        """
+        Args:
+            company (str): name of the company (any casing)
+
+        Returns:
+            list[str]: the disease categories currently owned by the company
+        """
+        return self.by_company.get(company.lower(), [])
+
+
+class AdInventory:
+    """
+    In-process store for the purchased ad categories. The inventory is read from storage once and then served from
+    memory. Writes build a new snapshot, persist it and swap it in with a single reference assignment, so readers never
+    block and never touch storage.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._write_lock = threading.Lock()
+        self._snapshot = None
+        self._listeners = []
+
+    def _read(self):
+        return self.store.load_categories()
+
+    def snapshot(self):
+        """
+        Returns:
+            InventorySnapshot: the current snapshot (loaded from storage on first use)
+        """
+        snap = self._snapshot
+        if snap is None:
+            with self._write_lock:
+                if self._snapshot is None:
+                    self._snapshot = InventorySnapshot(1, self._read())
+                snap = self._snapshot
+        return snap
+
+    def subscribe(self, listener):
+        """
+        Registers a callback that is handed every new snapshot after a write, so derived indexes can update themselves.
+
+        Args:
+            listener (callable): called with (new_snapshot, previous_snapshot)
+        """
+        self._listeners.append(listener)
+
+    def _publish(self, snapshot, previous):
+        self._snapshot = snapshot
+        for listener in self._listeners:
+            listener(snapshot, previous)
+
+    def reload(self):
+        """
+        Re-reads the inventory from storage and bumps the version. Useful if the data was edited by hand.
+        """
+        with self._write_lock:
+            previous = self._snapshot
+            version = previous.version + 1 if previous is not None else 1
+            self._publish(InventorySnapshot(version, self._read()), previous)
+            return self._snapshot
+
+    def refresh(self):
+        """
+        Reloads the inventory if storage no longer matches the current snapshot, e.g. after a purchase made by another
+        worker process.
+
+        Returns:
+            bool: whether a new snapshot was published
+        """
+        if self._snapshot is None:
+            # Not loaded yet; the first snapshot() reads storage anyway
+            return False
+        categories = self._read()
+        with self._write_lock:
+            current = self._snapshot
+            if categories == current.categories:
+                return False
+            self._publish(InventorySnapshot(current.version + 1, categories), current)
+            return True
+
+    def purchase(self, disease, expected_version, **changes):
+        """
+        Compare-and-swap purchase of a category: applies the changes, bumps the category's version and resets its clicks,
+        all in one atomic storage write, but only if the category is still at expected_version. Writers are serialized;
+        readers keep using their snapshots and never wait.
+
+        Args:
+            disease (str): the disease category being bought
+            expected_version (int): the category version the bid was validated against
+            **changes: the new ad information (company, category_cost, ad_path, link)
+
+        Returns:
+            InventorySnapshot: the new snapshot
+
+        Raises:
+            VersionConflict: the category changed since expected_version (another purchase won)
+        """
+        with self._write_lock:
+            current = self._snapshot if self._snapshot is not None else InventorySnapshot(0, self._read())
+            if current.version_of(disease) != expected_version:
+                raise VersionConflict(f"{disease} has changed since version {expected_version}")
+
+            categories = dict(current.categories)
+            categories[disease] = {**categories[disease], **changes, "version": expected_version + 1}
+            try:
+                self.store.purchase_category(disease, categories[disease], expected_version)
+            except VersionConflict:
+                # Another process got there first; pick up its write so the next attempt sees it
+                self._publish(InventorySnapshot(current.version + 1, self._read()), current)
+                raise
+            self._publish(InventorySnapshot(current.version + 1, categories), current)
+            return self._snapshot
+
+
+inventory = AdInventory(store)
+if SHARED_STATE:
+    follower.watch("inventory", store.categories_stamp, inventory.refresh)
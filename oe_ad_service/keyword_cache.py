@@ -0,0 +1,171 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+KEYWORD_CACHE_SIZE = int(os.environ.get("OE_KEYWORD_CACHE_SIZE", "10000"))
+KEYWORD_CACHE_TTL_S = float(os.environ.get("OE_KEYWORD_CACHE_TTL", str(24 * 60 * 60)))
+# Set to a file path to keep a persistent on-disk tier behind the in-memory LRU
+KEYWORD_CACHE_PATH = os.environ.get("OE_KEYWORD_CACHE_PATH", "")
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_query(query):
+    """
+    Folds case, punctuation and whitespace so that trivially different questions share a cache entry.
+
+    Args:
+        query (str): the user question
+
+    Returns:
+        str: the normalized question
+    """
+    return " ".join(_PUNCTUATION.sub(" ", query.lower()).split())
+
+
+class KeywordCache:
+    """
+    Cache of LLM keyword-extraction responses keyed on the normalized question and the prompt template version.
+    The in-memory tier is an LRU bounded by entry count; every entry also expires after a TTL. An optional SQLite file
+    acts as a second, persistent tier so the cache survives restarts.
+
+    Args:
+        prompt_version (str): identifies the prompt template; entries made with another template are never returned
+        max_entries (int): capacity of the in-memory tier
+        ttl_s (float): seconds an entry stays valid
+        disk_path (str): path of the persistent tier, or empty to keep the cache in memory only
+    """
+
+    def __init__(self, prompt_version, max_entries=KEYWORD_CACHE_SIZE, ttl_s=KEYWORD_CACHE_TTL_S, disk_path=KEYWORD_CACHE_PATH):
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_path = disk_path
+
+        self._entries = OrderedDict()  # key -> (response, cost, created)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.saved_usd = 0.0
+
+        if self.disk_path:
+            self._disk().execute(
+                "CREATE TABLE IF NOT EXISTS keyword_cache "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, cost REAL NOT NULL, created REAL NOT NULL)"
+            )
+
+    def key(self, query):
+        return self.prompt_version + ":" + normalize_query(query)
+
+    def _disk(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.disk_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, query):
+        """
+        Args:
+            query (str): the user question
+
+        Returns:
+            str: the cached LLM response, or None on a miss
+        """
+        key = self.key(query)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, cost, created = entry
+                if now - created <= self.ttl_s:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    self.saved_usd += cost
+                    return response
+                del self._entries[key]
+                self.expired += 1
+
+        if self.disk_path:
+            row = self._disk().execute(
+                "SELECT response, cost, created FROM keyword_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                response, cost, created = row
+                if now - created <= self.ttl_s:
+                    with self._lock:
+                        self._insert(key, (response, cost, created))
+                        self.disk_hits += 1
+                        self.saved_usd += cost
+                    return response
+                self._disk().execute("DELETE FROM keyword_cache WHERE key = ?", (key,))
+                with self._lock:
+                    self.expired += 1
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query, response, cost):
+        """
+        Args:
+            query (str): the user question
+            response (str): the LLM response for it
+            cost (float): what the LLM call cost, credited to the savings counter on every later hit
+        """
+        key = self.key(query)
+        entry = (response, cost, time.time())
+        with self._lock:
+            self._insert(key, entry)
+        if self.disk_path:
+            self._disk().execute(
+                "INSERT OR REPLACE INTO keyword_cache (key, response, cost, created) VALUES (?, ?, ?, ?)",
+                (key, *entry),
+            )
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_path:
+            self._disk().execute("DELETE FROM keyword_cache")
+
+    def stats(self):
+        """
+        Returns:
+            dict: hit/miss/eviction counters and the LLM spend avoided by cache hits
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "prompt_version": self.prompt_version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "persistent": bool(self.disk_path),
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "saved_usd": round(self.saved_usd, 6),
+            }
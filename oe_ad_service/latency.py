@@ -0,0 +1,54 @@
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent latencies (in seconds) for percentile estimates, e.g. the p95 used to decide when to hedge an
+    LLM call.
+
+    Args:
+        window (int): number of most recent samples kept
+        min_samples (int): percentiles are only reported once this many samples have been seen
+    """
+
+    def __init__(self, window=500, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def percentile(self, p):
+        """
+        Args:
+            p (float): percentile between 0 and 100
+
+        Returns:
+            float: the latency at that percentile in seconds, or None if there are too few samples
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self):
+        """
+        Returns:
+            dict: sample count and p50/p95/p99 in milliseconds
+        """
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "samples": self.count,
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "p99_ms": ms(self.percentile(99)),
+        }
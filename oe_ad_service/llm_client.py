@@ -0,0 +1,315 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from metrics import registry
+from startup import lazy_import
+
+# Deadline (seconds) for one keyword-extraction call, retries included
+LLM_TIMEOUT_S = float(os.environ.get("OE_LLM_TIMEOUT", "10"))
+# Timeout (seconds) for opening a connection to the OpenAI API
+LLM_CONNECT_TIMEOUT_S = float(os.environ.get("OE_LLM_CONNECT_TIMEOUT", "2"))
+# Connections to the OpenAI API kept per client, and how many of them stay open while idle
+LLM_MAX_CONNECTIONS = int(os.environ.get("OE_LLM_MAX_CONNECTIONS", "64"))
+LLM_KEEPALIVE_CONNECTIONS = int(os.environ.get("OE_LLM_KEEPALIVE_CONNECTIONS", "32"))
+# Retries of a call that failed with a connection error, a timeout, a 429 or a 5xx, and the backoff before the first one
+# (doubling each time, with full jitter)
+LLM_MAX_RETRIES = int(os.environ.get("OE_LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF_S = float(os.environ.get("OE_LLM_RETRY_BACKOFF_MS", "200")) / 1000
+LLM_RETRY_BACKOFF_MAX_S = 2.0
+# Consecutive failed calls that open the circuit breaker, and seconds it stays open before a trial call is let through
+LLM_BREAKER_FAILURES = int(os.environ.get("OE_LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_S = float(os.environ.get("OE_LLM_BREAKER_COOLDOWN", "30"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+upstream_seconds = registry.histogram("oe_llm_upstream_seconds", "Latency of each request to the OpenAI API, by outcome",
+                                      labels=("outcome",))
+llm_retries = registry.counter("oe_llm_retries_total", "OpenAI requests retried after a transient failure")
+llm_short_circuits = registry.counter("oe_llm_short_circuits_total", "Keyword-extraction calls skipped while the circuit was open")
+
+
+class LLMUnavailable(Exception):
+    """
+    Raised when the LLM could not answer in time: every attempt failed with a transient error, or the deadline passed.
+    """
+
+
+class CircuitOpenError(LLMUnavailable):
+    """
+    Raised without calling the LLM while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing. After `failures` consecutive failed calls the circuit opens and calls
+    fail immediately; after `cooldown_s` a single trial call is let through (half open), and the circuit closes again if
+    it succeeds or reopens if it fails.
+
+    Args:
+        failures (int): consecutive failures that open the circuit
+        cooldown_s (float): seconds the circuit stays open before a trial call
+    """
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown_s=LLM_BREAKER_COOLDOWN_S):
+        self.failures = failures
+        self.cooldown_s = cooldown_s
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+        self.opens = 0
+        self.short_circuits = 0
+
+    def allow(self):
+        """
+        Returns:
+            bool: whether a call may go ahead (False while the circuit is open, or half open with a trial call running)
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown_s:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.short_circuits += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_running = False
+
+    def abandon(self):
+        """
+        A call that was let through ended without telling anything about the upstream (it was cancelled).
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failures):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self.opens += 1
+            self._trial_running = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "opens": self.opens,
+                "short_circuits": self.short_circuits,
+                "failure_threshold": self.failures,
+                "cooldown_s": self.cooldown_s,
+            }
+
+
+class LLMClient:
+    """
+    The OpenAI chat-completions client used for keyword extraction, wrapped so a slow or failing upstream can't take the
+    service down with it:
+
+    - a bounded connection pool with keep-alive, and a short connect timeout
+    - a deadline per call that covers every attempt, so a call never takes longer than timeout_s
+    - bounded retries of transient failures (connection errors, timeouts, 429s and 5xx), with jittered exponential backoff
+    - a circuit breaker that fails calls immediately while the upstream is down, so callers fall back to the local
+      matcher and cached answers instead of queueing up behind it
+
+    Other errors (bad requests, authentication) are raised as they are, without retries. The openai clients (sync and
+    async) are created on first use.
+
+    Args:
+        api_key (str): OpenAI API key (defaults to OPENAI_API_KEY)
+        base_url (str): API base URL (defaults to OPENAI_BASE_URL, or the OpenAI API)
+        timeout_s (float): deadline for a call, retries included
+        connect_timeout_s (float): timeout for opening a connection
+        max_retries (int): retries after the first attempt
+        backoff_s (float): backoff before the first retry
+        breaker (CircuitBreaker): the circuit breaker (a new one with the default settings if None)
+        max_connections (int): connection pool size
+        keepalive_connections (int): idle connections kept open
+    """
+
+    def __init__(self, api_key=None, base_url=None, timeout_s=LLM_TIMEOUT_S, connect_timeout_s=LLM_CONNECT_TIMEOUT_S,
+                 max_retries=LLM_MAX_RETRIES, backoff_s=LLM_RETRY_BACKOFF_S, breaker=None,
+                 max_connections=LLM_MAX_CONNECTIONS, keepalive_connections=LLM_KEEPALIVE_CONNECTIONS):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout_s = timeout_s
+        self.connect_timeout_s = connect_timeout_s
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.max_connections = max_connections
+        self.keepalive_connections = keepalive_connections
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self._retryable = None
+        self._rng = random.Random()
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _options(self, openai, http_client_class):
+        # The Limits class of whichever httpx the openai package is built on
+        limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+            max_connections=self.max_connections, max_keepalive_connections=self.keepalive_connections, keepalive_expiry=30,
+        )
+        return {
+            "api_key": self.api_key if self.api_key is not None else os.environ["OPENAI_API_KEY"],
+            "base_url": self.base_url,
+            "timeout": openai.Timeout(self.timeout_s, connect=self.connect_timeout_s),
+            # Retries are done here, within the call's deadline
+            "max_retries": 0,
+            "http_client": http_client_class(limits=limits),
+        }
+
+    def _openai(self):
+        openai = lazy_import("openai")
+        if self._retryable is None:
+            self._retryable = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+        return openai
+
+    def client(self):
+        """
+        Returns:
+            openai.OpenAI: the sync client (created on first use)
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    openai = self._openai()
+                    self._client = openai.OpenAI(**self._options(openai, openai.DefaultHttpxClient))
+        return self._client
+
+    def async_client(self):
+        """
+        Returns:
+            openai.AsyncOpenAI: the async client (created on first use)
+        """
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    openai = self._openai()
+                    self._async_client = openai.AsyncOpenAI(**self._options(openai, openai.DefaultAsyncHttpxClient))
+        return self._async_client
+
+    def _admit(self):
+        if not self.breaker.allow():
+            llm_short_circuits.inc()
+            raise CircuitOpenError(f"the LLM circuit is open after {self.breaker.consecutive_failures} failures")
+        self.calls += 1
+        return time.monotonic() + self.timeout_s
+
+    def _backoff(self, attempt, deadline, error):
+        # Returns the seconds to wait before the next attempt, or raises if there is no attempt left worth making
+        self.failures += 1
+        if attempt >= self.max_retries:
+            self.breaker.record_failure()
+            raise LLMUnavailable(f"LLM call failed after {attempt + 1} attempts: {error}") from error
+        delay = self._rng.uniform(0, min(LLM_RETRY_BACKOFF_MAX_S, self.backoff_s * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            self.breaker.record_failure()
+            raise LLMUnavailable(f"LLM call ran out of time after {attempt + 1} attempts: {error}") from error
+        self.retries += 1
+        llm_retries.inc()
+        return delay
+
+    def _observe(self, start, outcome):
+        upstream_seconds.labels(outcome).observe(time.perf_counter() - start)
+
+    def create(self, **request):
+        """
+        Sends a chat completion request, retrying transient failures within the deadline.
+
+        Args:
+            **request: the keyword arguments for chat.completions.create
+
+        Returns:
+            the chat completion
+
+        Raises:
+            CircuitOpenError: the circuit is open; the LLM was not called
+            LLMUnavailable: no attempt succeeded before the retries or the deadline ran out
+        """
+        client = self.client()
+        deadline = self._admit()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = client.chat.completions.create(**request, timeout=max(deadline - time.monotonic(), 0.001))
+            except self._retryable as e:
+                self._observe(start, "error")
+                time.sleep(self._backoff(attempt, deadline, e))
+                attempt += 1
+                continue
+            except Exception:
+                # The upstream answered; the request itself was refused (bad request, authentication)
+                self._observe(start, "error")
+                self.breaker.record_success()
+                raise
+            self._observe(start, "ok")
+            self.breaker.record_success()
+            return response
+
+    async def acreate(self, **request):
+        """
+        Async version of create.
+        """
+        client = self.async_client()
+        deadline = self._admit()
+        attempt = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    response = await client.chat.completions.create(**request, timeout=max(deadline - time.monotonic(), 0.001))
+                except self._retryable as e:
+                    self._observe(start, "error")
+                    delay = self._backoff(attempt, deadline, e)
+                except Exception:
+                    self._observe(start, "error")
+                    self.breaker.record_success()
+                    raise
+                else:
+                    self._observe(start, "ok")
+                    self.breaker.record_success()
+                    return response
+                await asyncio.sleep(delay)
+                attempt += 1
+        except asyncio.CancelledError:
+            # Cancelled by the caller (e.g. a losing hedge), during a request or a backoff
+            self.breaker.abandon()
+            raise
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.stats(),
+            "calls": self.calls,
+            "retries": self.retries,
+            "failed_attempts": self.failures,
+            "timeout_s": self.timeout_s,
+            "max_retries": self.max_retries,
+            "max_connections": self.max_connections,
+        }
+
+
+llm = LLMClient()
+
+_BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+registry.callback("oe_llm_circuit_state", "State of the LLM circuit breaker (0 closed, 1 half open, 2 open)",
+                  lambda: _BREAKER_STATES[llm.breaker.state])
@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+from collections import deque
+from keyword_cache import normalize_query
+
+SYNONYMS_PATH = "disease_synonyms.json"
+
+
+def load_synonyms(path=SYNONYMS_PATH):
+    """
+    Loads the curated synonym/abbreviation table.
+
+    Returns:
+        dict: canonical disease -> {"aliases": [...], "display": optional display name}
+    """
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def display_name(disease, synonyms):
+    """
+    The casing used when a locally matched category is handed back to the frontend (mirrors the LLM's output, e.g. "Lung Cancer").
+    """
+    return synonyms.get(disease, {}).get("display", disease.title())
+
+
+class AhoCorasick:
+    """
+    Multi-pattern string automaton. Once built, a scan finds every occurrence of every pattern in a single pass over the
+    text, independent of how many patterns there are. Patterns can be added incrementally; only the failure links are
+    recomputed.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._own = [[]]  # patterns ending exactly at each node: (length, value)
+        self._out = [[]]  # own patterns plus those reachable through failure links
+        self._dirty = False
+
+    def add(self, pattern, value):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._own.append([])
+                self._out.append([])
+            node = nxt
+        self._own[node].append((len(pattern), value))
+        self._dirty = True
+
+    def build(self):
+        """
+        Computes the failure links and output lists breadth-first.
+        """
+        self._out = [list(own) for own in self._own]
+
+        queue = deque(self._goto[0].values())
+        for child in queue:
+            self._fail[child] = 0
+
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._own[child] + self._out[self._fail[child]]
+        self._dirty = False
+
+    def copy(self):
+        clone = AhoCorasick()
+        clone._goto = [dict(edges) for edges in self._goto]
+        clone._fail = list(self._fail)
+        clone._own = [list(own) for own in self._own]
+        clone._out = [list(out) for out in self._out]
+        clone._dirty = self._dirty
+        return clone
+
+    def search(self, text):
+        """
+        Args:
+            text (str): the text to scan
+
+        Returns:
+            list[tuple]: (start, end, value) for every pattern occurrence
+        """
+        if self._dirty:
+            self.build()
+
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._out[node]:
+                matches.append((i - length + 1, i + 1, value))
+        return matches
+
+
+class LocalMatcher:
+    """
+    Local disease detector over the purchased categories plus their synonyms and abbreviations (e.g. "NSCLC" -> lung cancer).
+    Only purchased categories are indexed since nothing else can produce an ad. Text is normalized like the keyword cache
+    and patterns are padded with spaces, so matches always fall on word boundaries.
+
+    The index follows the ad inventory: an ownership change leaves the automaton untouched, a new category only adds its
+    own patterns, and only a removed category forces a full rebuild.
+    """
+
+    def __init__(self, inventory, synonyms=None):
+        self.synonyms = load_synonyms() if synonyms is None else synonyms
+        self._lock = threading.Lock()
+        self._patterns = {}  # padded pattern -> category
+        self._automaton = AhoCorasick()
+        self.version = None
+        self.rebuilds = 0
+
+        self.sync(inventory.snapshot())
+        inventory.subscribe(lambda snapshot, previous: self.sync(snapshot))
+
+    def _patterns_for(self, categories):
+        patterns = {}
+        for category in categories:
+            for alias in [category] + self.synonyms.get(category, {}).get("aliases", []):
+                normalized = normalize_query(alias)
+                if normalized:
+                    patterns[" " + normalized + " "] = category
+        return patterns
+
+    def sync(self, snapshot):
+        """
+        Brings the automaton in line with an inventory snapshot, doing as little work as possible.
+
+        Args:
+            snapshot (InventorySnapshot): the inventory to index
+        """
+        with self._lock:
+            wanted = self._patterns_for(snapshot.categories)
+            removed = [p for p in self._patterns if wanted.get(p) != self._patterns[p]]
+
+            if removed:
+                automaton = AhoCorasick()
+                for pattern, category in wanted.items():
+                    automaton.add(pattern, category)
+                automaton.build()
+                self._automaton = automaton
+                self.rebuilds += 1
+            else:
+                added = {p: c for p, c in wanted.items() if p not in self._patterns}
+                if added:
+                    # Build on a copy so concurrent scans keep using the old automaton until we swap
+                    automaton = self._automaton.copy()
+                    for pattern, category in added.items():
+                        automaton.add(pattern, category)
+                    automaton.build()
+                    self._automaton = automaton
+
+            self._patterns = wanted
+            self.version = snapshot.version
+
+    def match(self, query):
+        """
+        Args:
+            query (str): the user question
+
+        Returns:
+            list[str]: the purchased categories mentioned in the question, in order of first mention
+        """
+        text = " " + normalize_query(query) + " "
+        found = []
+        for _, _, category in sorted(self._automaton.search(text)):
+            if category not in found:
+                found.append(category)
+        return found
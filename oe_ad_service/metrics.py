@@ -0,0 +1,269 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        Returns:
+            the series for one combination of label values (created on first use; hold on to it on hot paths)
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _series(self):
+        return sorted(self._children.items()) if self.label_names else list(self._children.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for values, child in self._series():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, optionally split by labels.
+    """
+
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_labels(self.label_names, values)} {_number(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """
+        Returns:
+            a context manager that observes the seconds spent inside it
+        """
+        return _Stage(self)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets, optionally split by labels. An observation is a binary search and
+    three additions, so it can stay on in production.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts = list(child.counts)
+            total, count = child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, values, [('le', _number(bound))])} {cumulative}")
+        labels = _labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_number(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Callback(_Metric):
+    # A gauge or counter whose value is read from elsewhere (e.g. a component's stats()) when the metrics are scraped
+
+    def __init__(self, name, help, type, read):
+        super().__init__(name, help)
+        self.type = type
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", f"{self.name} {_number(float(value))}"]
+
+
+class Registry:
+    """
+    The process's metrics, exported in the Prometheus text format by /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, read, type="gauge"):
+        """
+        Registers a value read at scrape time.
+
+        Args:
+            name (str): metric name
+            help (str): description
+            read (callable): returns the current value (None to skip it)
+            type (str): "gauge" or "counter"
+        """
+        return self._register(_Callback(name, help, type, read))
+
+    def render(self):
+        """
+        Returns:
+            str: every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("oe_stage_seconds", "Time spent in each stage of the ad-serving path", labels=("stage",))
+
+
+def stage(name):
+    """
+    Times a stage of the hot path into oe_stage_seconds, as a context manager or a decorator (sync or async):
+
+        with stage("llm_call"):
+            ...
+
+        @stage("select_ad")
+        def select_ad(...):
+            ...
+
+    Args:
+        name (str): the stage label
+    """
+    return _Stage(stage_seconds.labels(name))
+
+
+class _Stage:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+    def __call__(self, function):
+        child = self.child
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+            return timed_async
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return timed
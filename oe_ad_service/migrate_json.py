@@ -0,0 +1,24 @@
+"""
+Imports the json data files (categories_ads.json, disease_counts.json, ad_clicks.json, ...) into the SQLite storage
+backend. Run it from the oe_ad_service directory, then start the server with OE_STORAGE_BACKEND=sqlite:
+
+    python migrate_json.py --db oe_ads.db
+    OE_STORAGE_BACKEND=sqlite uvicorn app:app
+"""
+import argparse
+from storage import SQLITE_PATH, SqliteStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the json data files into the SQLite storage backend")
+    parser.add_argument("--db", default=SQLITE_PATH, help="path of the SQLite database to write")
+    parser.add_argument("--source", default=".", help="directory containing the json files")
+    args = parser.parse_args()
+
+    imported = SqliteStore(args.db).import_json(args.source)
+    for table, rows in imported.items():
+        print(f"{table}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+import time
+from storage import store
+
+# Daily impression budgets (0 = unlimited); budgets.json can override them per company and per category:
+# {"companies": {"pfizer": 5000}, "categories": {"lung cancer": 2000}}
+BUDGETS_PATH = os.environ.get("OE_PACING_BUDGETS", "budgets.json")
+COMPANY_DAILY_CAP = int(os.environ.get("OE_COMPANY_DAILY_IMPRESSIONS", "0"))
+CATEGORY_DAILY_CAP = int(os.environ.get("OE_CATEGORY_DAILY_IMPRESSIONS", "0"))
+# At most this many impressions of one company's ads per user per window (0 = no frequency cap)
+FREQUENCY_CAP = int(os.environ.get("OE_FREQUENCY_CAP", "0"))
+FREQUENCY_WINDOW_S = int(os.environ.get("OE_FREQUENCY_WINDOW", "3600"))
+# How often the local impression counts are pushed to storage and the totals of all workers pulled back
+RECONCILE_INTERVAL_S = float(os.environ.get("OE_PACING_RECONCILE_INTERVAL", "10"))
+
+
+class ShardedCounter:
+    """
+    Counters split into one shard per thread. An increment only touches the calling thread's own dict, so the hot path
+    takes no lock; reads add up the shards.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def incr(self, key, amount=1):
+        shard = self._shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def get(self, key):
+        total = 0
+        for shard in self._shards:
+            total += shard.get(key, 0)
+        return total
+
+    def totals(self):
+        totals = {}
+        for shard in list(self._shards):
+            for key, amount in dict(shard).items():
+                totals[key] = totals.get(key, 0) + amount
+        return totals
+
+    def prune(self, keep):
+        """
+        Drops the keys for which keep(key) is false, e.g. finished days.
+        """
+        for shard in list(self._shards):
+            for key in [key for key in list(shard) if not keep(key)]:
+                shard.pop(key, None)
+
+
+class PacingService:
+    """
+    Daily impression budgets per company and per category, and a per-user frequency cap, enforced when an ad is chosen.
+    Impressions are counted in lock-free per-thread counters. A background thread periodically adds this worker's new
+    impressions to the "impressions" counter table and reads back the totals of every worker, so budgets hold across
+    workers to within one reconcile interval. Counts of past days are removed from the table once the day is over.
+
+    Args:
+        store (JsonStore | SqliteStore): where impression counts are reconciled
+        budgets (dict): per-company and per-category daily caps (defaults to budgets.json)
+        interval (float): seconds between reconciliations
+    """
+
+    def __init__(self, store, budgets=None, interval=RECONCILE_INTERVAL_S):
+        self.store = store
+        self.interval = interval
+        if budgets is None:
+            budgets = {}
+            if BUDGETS_PATH and os.path.exists(BUDGETS_PATH):
+                with open(BUDGETS_PATH, "r") as f:
+                    budgets = json.load(f)
+        self.company_caps = {company.lower(): cap for company, cap in budgets.get("companies", {}).items()}
+        self.category_caps = {disease.lower(): cap for disease, cap in budgets.get("categories", {}).items()}
+        self.company_default = budgets.get("company_default", COMPANY_DAILY_CAP)
+        self.category_default = budgets.get("category_default", CATEGORY_DAILY_CAP)
+        self.frequency_cap = budgets.get("frequency_cap", FREQUENCY_CAP)
+        self.frequency_window_s = budgets.get("frequency_window_s", FREQUENCY_WINDOW_S)
+        self.enabled = bool(self.company_default or self.category_default or self.frequency_cap
+                            or any(self.company_caps.values()) or any(self.category_caps.values()))
+
+        self._counts = ShardedCounter()  # (day, "company"|"category", name) and (window, "user", user, company)
+        # (daily key -> total across workers at the last reconciliation, daily key -> local count already added to
+        # storage); swapped as one tuple so a budget check never sees one updated without the other
+        self._synced = ({}, {})
+        self._reconcile_lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+        self.skipped = 0
+        self.reconciliations = 0
+        self.pruned = 0
+        self.last_reconcile_ms = 0.0
+
+    def _daily(self, key):
+        base, reported = self._synced
+        return base.get(key, 0) + self._counts.get(key) - reported.get(key, 0)
+
+    def allows(self, company, category, user=None, now=None):
+        """
+        Whether an ad may be served right now.
+
+        Args:
+            company (str): the advertiser
+            category (str): the disease category the ad is for
+            user (str): who would see it, for the frequency cap (optional)
+
+        Returns:
+            bool: False if the company or category is over its daily budget or the user has hit the frequency cap
+        """
+        if not self.enabled:
+            return True
+        now = time.time() if now is None else now
+        day = int(now // 86400)
+        company = company.lower()
+        category = category.lower()
+
+        cap = self.company_caps.get(company, self.company_default)
+        if cap and self._daily((day, "company", company)) >= cap:
+            self.skipped += 1
+            return False
+        cap = self.category_caps.get(category, self.category_default)
+        if cap and self._daily((day, "category", category)) >= cap:
+            self.skipped += 1
+            return False
+        if self.frequency_cap and user is not None:
+            window = int(now // self.frequency_window_s)
+            if self._counts.get((window, "user", user, company)) >= self.frequency_cap:
+                self.skipped += 1
+                return False
+        return True
+
+    def record(self, company, category, user=None, now=None):
+        """
+        Counts an impression against the budgets.
+        """
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        day = int(now // 86400)
+        company = company.lower()
+        self._counts.incr((day, "company", company))
+        self._counts.incr((day, "category", category.lower()))
+        if self.frequency_cap and user is not None:
+            self._counts.incr((int(now // self.frequency_window_s), "user", user, company))
+        self._ensure_started()
+
+    def reconcile(self, now=None):
+        """
+        Adds this worker's impressions since the last call to storage and refreshes the cross-worker totals for today.
+        """
+        now = time.time() if now is None else now
+        day = int(now // 86400)
+        window = int(now // self.frequency_window_s)
+        with self._reconcile_lock:
+            start = time.perf_counter()
+            totals = {key: amount for key, amount in self._counts.totals().items() if key[1] != "user"}
+            deltas = {}
+            for key, amount in totals.items():
+                delta = amount - self._synced[1].get(key, 0)
+                if delta:
+                    deltas["|".join(str(part) for part in key)] = delta
+            if deltas:
+                self.store.increment_batch({"impressions": deltas})
+            reported = dict(totals)
+
+            base = {}
+            expired = []
+            for stored_key, amount in self.store.load_table("impressions").items():
+                stored_day, kind, name = stored_key.split("|", 2)
+                if int(stored_day) == day:
+                    base[(day, kind, name)] = amount
+                elif int(stored_day) < day:
+                    expired.append(stored_key)
+            if expired:
+                # Budgets are daily, so past days' counts are no longer needed (found once per day, by whichever
+                # worker reconciles first after midnight)
+                self.store.delete_counters("impressions", expired)
+                self.pruned += len(expired)
+
+            self._synced = (base, {key: amount for key, amount in reported.items() if key[0] == day})
+            self._counts.prune(lambda key: key[0] >= (window if key[1] == "user" else day))
+
+            self.reconciliations += 1
+            self.last_reconcile_ms = (time.perf_counter() - start) * 1000
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._reconcile_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pacing-reconcile", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"pacing reconciliation failed, will retry: {e}")
+
+    def close(self):
+        self._stopped.set()
+        if self.enabled and self._thread is not None:
+            self.reconcile()
+
+    def stats(self):
+        """
+        Returns:
+            dict: configured caps, today's impressions per company and category and reconciliation figures
+        """
+        day = int(time.time() // 86400)
+        keys = set(self._synced[0]) | {key for key in self._counts.totals() if key[1] != "user"}
+        today = {}
+        for key in sorted(keys):
+            if key[0] == day:
+                today.setdefault(key[1], {})[key[2]] = self._daily(key)
+        return {
+            "enabled": self.enabled,
+            "company_caps": {"default": self.company_default, **self.company_caps},
+            "category_caps": {"default": self.category_default, **self.category_caps},
+            "frequency_cap": self.frequency_cap,
+            "frequency_window_s": self.frequency_window_s,
+            "impressions_today": today,
+            "skipped": self.skipped,
+            "reconciliations": self.reconciliations,
+            "pruned_counts": self.pruned,
+            "last_reconcile_ms": round(self.last_reconcile_ms, 3),
+        }
+
+
+pacing = PacingService(store)
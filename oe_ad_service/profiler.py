@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Allow on-demand profiling through /debug/profile (off by default: a profile exposes code paths and costs CPU while it runs)
+PROFILER_ENABLED = os.environ.get("OE_PROFILER", "0") == "1"
+MAX_PROFILE_S = 60
+
+# Leaf frames of threads that are just waiting for work; left out of profiles unless idle stacks are asked for
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socket.py", "readinto"),
+}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a running server: a background thread samples the Python stack of every other thread at a
+    fixed interval and counts how often each stack was seen. The result is in the collapsed-stack format ("root;...;leaf
+    count" per line) read by flamegraph.pl, speedscope and inferno. Only one profile runs at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiles = 0
+
+    def profile(self, seconds, interval_s=0.005, include_idle=False):
+        """
+        Samples every thread for a while.
+
+        Args:
+            seconds (float): how long to sample
+            interval_s (float): time between samples
+            include_idle (bool): keep stacks of threads that are only waiting for work
+
+        Returns:
+            tuple: (collapsed stacks as text, number of samples taken)
+
+        Raises:
+            RuntimeError: another profile is already running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("a profile is already running")
+        try:
+            stacks = Counter()
+            names = {}
+            me = threading.get_ident()
+            samples = 0
+            deadline = time.perf_counter() + min(seconds, MAX_PROFILE_S)
+            while time.perf_counter() < deadline:
+                names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    code = frame.f_code
+                    if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    stacks[";".join(reversed(labels))] += 1
+                samples += 1
+                time.sleep(interval_s)
+            self.profiles += 1
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()), samples
+
+
+profiler = SamplingProfiler()
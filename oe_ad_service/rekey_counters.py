@@ -0,0 +1,32 @@
+"""
+Merges the usage counters recorded under different names for the same disease ("type 2 diabetes", "T2D", ...) into
+their canonical category, as identify_keywords now counts them. Stop the server, then run it from the oe_ad_service
+directory (with the same OE_STORAGE_BACKEND as the server):
+
+    python rekey_counters.py --dry-run
+    python rekey_counters.py
+
+The per-minute/hour/day history in the event store is left under the old names.
+"""
+import argparse
+from canonical import REKEY_TABLES, canonicalizer, rekey
+from storage import store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-key the disease counters onto canonical categories")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would change")
+    parser.add_argument("--tables", nargs="+", default=list(REKEY_TABLES), help="counter tables to re-key")
+    args = parser.parse_args()
+
+    report = rekey(store, canonicalizer, tables=args.tables, dry_run=args.dry_run)
+    for table, result in report.items():
+        print(f"{table}: {result['before']} -> {result['after']} keys")
+        for old, new in result["renamed"].items():
+            print(f"  {old} -> {new}")
+        for key in result["dropped"]:
+            print(f"  {key} dropped (purchased category)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from starlette.responses import JSONResponse, Response
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("OE_RESPONSE_CACHE_SIZE", "256"))
+# A response whose data has changed may still be served for this many seconds while a fresh one is built in the
+# background (0 always rebuilds before answering)
+STALE_WHILE_REVALIDATE_S = float(os.environ.get("OE_RESPONSE_CACHE_SWR", "5"))
+
+
+class ResponseCache:
+    """
+    Cache of serialized JSON responses for the read-only analytics endpoints, keyed on the endpoint and tagged with the
+    versions of the data it was built from. A response is current while those versions are unchanged. Once they move,
+    the old response is still served for up to max_stale_s seconds after it was built while a single background refresh
+    builds the new one, so polling dashboards never wait on a rebuild and rebuilds happen at most once per window.
+
+    Responses carry a strong ETag (a hash of the body) and answer If-None-Match with 304.
+
+    Args:
+        max_entries (int): number of responses kept
+        max_stale_s (float): how long an outdated response may still be served
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, max_stale_s=STALE_WHILE_REVALIDATE_S):
+        self.max_entries = max_entries
+        self.max_stale_s = max_stale_s
+        self._entries = OrderedDict()  # key -> (versions, etag, body, built_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-refresh")
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.background_refreshes = 0
+
+    def _build(self, key, versions, producer):
+        body = JSONResponse(producer()).body
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        with self._lock:
+            self._entries[key] = (versions, etag, body, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
+
+    def _refresh(self, key, versions, producer):
+        try:
+            self._build(key, versions, producer)
+            self.background_refreshes += 1
+        except Exception as e:
+            print(f"response refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key, versions, producer):
+        """
+        Args:
+            key (str): identifies the response (endpoint plus parameters)
+            versions (tuple): versions of every piece of data the response depends on
+            producer (callable): builds the response content
+
+        Returns:
+            tuple: (etag, JSON body bytes)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                cached_versions, etag, body, built_at = entry
+                if cached_versions == versions:
+                    self.hits += 1
+                    return etag, body
+                if time.monotonic() - built_at < self.max_stale_s:
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(self._refresh, key, versions, producer)
+                    return etag, body
+            self.misses += 1
+        return self._build(key, versions, producer)
+
+    def respond(self, request, key, versions, producer):
+        """
+        Serves a cached JSON response with its ETag, or 304 if the client's copy is current.
+
+        Args:
+            request: the fastAPI request (for If-None-Match)
+            key (str): identifies the response
+            versions (tuple): versions of the data the response depends on
+            producer (callable): builds the response content
+
+        Returns:
+            fastapi Response
+        """
+        etag, body = self.get(key, versions, producer)
+        headers = {"ETag": etag, "Cache-Control": f"max-age=0, stale-while-revalidate={int(self.max_stale_s)}"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self):
+        """
+        Returns:
+            dict: occupancy and hit/miss counters
+        """
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "max_stale_s": self.max_stale_s,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "background_refreshes": self.background_refreshes,
+        }
+
+
+response_cache = ResponseCache()
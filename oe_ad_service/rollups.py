@@ -0,0 +1,240 @@
+import threading
+from datetime import datetime
+from events import events
+from inventory import inventory
+from shared import SHARED_STATE, follower
+from storage import store
+from telemetry import telemetry
+
+# October 10th refers to the day on which all the companies purchased the categories
+# Also the day I received the assessment
+PURCHASE_DATE = datetime(2025, 10, 10)
+
+
+def billing_period(today=None):
+    """
+    Returns:
+        tuple: (days since the categories were purchased, fraction of a monthly payment owed so far)
+    """
+    today = today or datetime.now()
+    days_passed = (today - PURCHASE_DATE).days
+    return days_passed, days_passed / 30
+
+
+class AnalyticsRollups:
+    """
+    Materialized per-category and per-company analytics. Usage counters are folded in as telemetry records them, and
+    ownership and prices follow the ad inventory, so company_summary and the revenue tracker only touch the categories a
+    company owns (or one row per company) instead of rescanning every table.
+
+    The rollups are seeded once from storage plus whatever is still buffered in telemetry; that happens on app startup
+    before any traffic, or on first use. When several workers share storage they are re-seeded whenever another worker
+    has flushed its counters (see refresh()).
+    """
+
+    # telemetry table -> rollup field
+    FIELDS = {"disease_counts": "mentions", "ad_clicks": "clicks", "disease_times": "time_ms"}
+
+    def __init__(self, inventory, telemetry):
+        self.inventory = inventory
+        self.telemetry = telemetry
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._categories = {}  # disease -> {"mentions", "clicks", "time_ms"}
+        self._owners = {}  # disease -> lowercased owning company
+        self._companies = {}  # lowercased company -> {"company", "categories", "monthly_cost", "mentions", "clicks", "time_ms"}
+        self.total_queries = 0
+        self.api_costs = 0.0
+        self.version = 0
+
+        telemetry.on_incr(self._on_incr)
+        inventory.subscribe(lambda snapshot, previous: self._on_inventory(snapshot))
+
+    def load(self):
+        """
+        Seeds the rollups from storage and the telemetry buffer. Safe to call more than once; only the first call loads.
+        """
+        if self._loaded:
+            return
+        with self.telemetry.seeding(), self._lock:
+            if self._loaded:
+                return
+            mentions = self.telemetry.view("disease_counts")
+            clicks = self.telemetry.view("ad_clicks")
+            times = self.telemetry.view("disease_times")
+
+            for disease in set(mentions) | set(clicks) | set(times):
+                self._categories[disease] = {
+                    "mentions": mentions.get(disease, 0),
+                    "clicks": clicks.get(disease, {}).get("clicks", 0),
+                    "time_ms": times.get(disease, 0),
+                }
+            self.total_queries = self.telemetry.view("total_queries").get("total_queries", 0)
+            self.api_costs = self.telemetry.view("query_costs").get("query", 0)
+
+            self._rebuild_companies(self.inventory.snapshot())
+            self._loaded = True
+            self.version += 1
+
+    def refresh(self):
+        """
+        Re-seeds the rollups from storage and the telemetry buffer, picking up the counters other workers have flushed.
+        """
+        with self._lock:
+            self._loaded = False
+            self._categories = {}
+        self.load()
+
+    def _rebuild_companies(self, snapshot):
+        # Called with self._lock held. Ownership changes are rare (purchases), so the company rows are recomputed from the
+        # snapshot; counter updates are the frequent case and are applied incrementally in _on_incr.
+        companies = {}
+        owners = {}
+        for disease, info in snapshot.categories.items():
+            key = info["company"].lower()
+            company = companies.setdefault(key, {
+                "company": info["company"], "categories": [], "monthly_cost": 0, "mentions": 0, "clicks": 0, "time_ms": 0,
+            })
+            row = self._categories.get(disease, {})
+            company["categories"].append(disease)
+            company["monthly_cost"] += info.get("category_cost", 0)
+            for field in self.FIELDS.values():
+                company[field] += row.get(field, 0)
+            owners[disease] = key
+        self._companies = companies
+        self._owners = owners
+
+    def _on_inventory(self, snapshot):
+        with self._lock:
+            if self._loaded:
+                self._rebuild_companies(snapshot)
+                self.version += 1
+
+    def _on_incr(self, name, key, amount):
+        with self._lock:
+            if not self._loaded:
+                # Not seeded yet; load() will pick this increment up from the telemetry buffer
+                return
+            field = self.FIELDS.get(name)
+            if field is not None:
+                row = self._categories.setdefault(key, {"mentions": 0, "clicks": 0, "time_ms": 0})
+                row[field] += amount
+                owner = self._owners.get(key)
+                if owner is not None:
+                    self._companies[owner][field] += amount
+            elif name == "total_queries":
+                self.total_queries += amount
+            elif name == "query_costs":
+                self.api_costs += amount
+            else:
+                return
+            self.version += 1
+
+    def reset_clicks(self, disease):
+        """
+        Mirrors storage's click reset for a category that changed hands.
+        """
+        self.load()
+        with self._lock:
+            row = self._categories.get(disease)
+            if row is None:
+                return
+            owner = self._owners.get(disease)
+            if owner is not None:
+                self._companies[owner]["clicks"] -= row["clicks"]
+            row["clicks"] = 0
+            self.version += 1
+
+    def category(self, disease):
+        """
+        Returns:
+            dict: mentions, clicks and time_ms for the category
+        """
+        self.load()
+        with self._lock:
+            return dict(self._categories.get(disease, {"mentions": 0, "clicks": 0, "time_ms": 0}))
+
+    def company_summary(self, company, today=None):
+        """
+        Per-category advertising metrics for the categories a company owns.
+
+        Args:
+            company (str): name of the company (any casing)
+            today (datetime): the day the prorated spend is computed for
+
+        Returns:
+            list[dict]: one row per owned category
+        """
+        self.load()
+        _, revenue_fraction = billing_period(today)
+        snapshot = self.inventory.snapshot()
+
+        with self._lock:
+            total_queries = self.total_queries
+            rows = [(disease, dict(self._categories.get(disease, {"mentions": 0, "clicks": 0, "time_ms": 0})))
+                    for disease in snapshot.company_categories(company)]
+
+        summary = []
+        for disease, row in rows:
+            # Per-day rates come from the time-bucketed event store (average over the recent window), not from lifetime
+            # totals spread over the days since purchase
+            mentions, clicks, times = row["mentions"], row["clicks"], row["time_ms"]
+            cost = snapshot.categories[disease]["category_cost"]
+            summary.append({
+                "disease": disease,
+                "mentions": mentions,
+                "clicks": clicks,
+                "mentions_per_query": str(round((mentions / total_queries if total_queries > 0 else 0) * 100, 3)) + "%",
+                "clicks_per_mention": clicks / mentions if mentions > 0 else 0,
+                "times": (times / 1000) / mentions if mentions > 0 else 0,
+                "monthly_category_cost": cost,
+                "total_paid": revenue_fraction * cost,
+                "clicks_per_dollar": clicks / (revenue_fraction * cost),
+                "mentions_per_day": events.daily_rate("mentions", disease),
+                "clicks_per_day": events.daily_rate("clicks", disease)
+            })
+        return summary
+
+    def company_totals(self, today=None):
+        """
+        Returns:
+            dict: company -> categories owned, monthly cost, prorated spend and total mentions/clicks/time
+        """
+        self.load()
+        _, revenue_fraction = billing_period(today)
+        with self._lock:
+            return {
+                row["company"]: {
+                    "categories": len(row["categories"]),
+                    "monthly_category_cost": row["monthly_cost"],
+                    "total_paid": row["monthly_cost"] * revenue_fraction,
+                    "mentions": row["mentions"],
+                    "clicks": row["clicks"],
+                    "time_ms": row["time_ms"],
+                }
+                for row in self._companies.values()
+            }
+
+    def monthly_revenue_by_company(self):
+        """
+        Returns:
+            dict: company -> sum of the monthly category costs it pays
+        """
+        self.load()
+        with self._lock:
+            return {row["company"]: row["monthly_cost"] for row in self._companies.values()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "version": self.version,
+                "categories": len(self._categories),
+                "companies": len(self._companies),
+            }
+
+
+rollups = AnalyticsRollups(inventory, telemetry)
+if SHARED_STATE:
+    follower.watch("rollups", store.counters_stamp, rollups.refresh)
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows); a single worker process is still safe
+    fcntl = None
+
+# Set when several worker processes serve the same data (uvicorn app:app --workers N), so each one picks up what the
+# others write: purchases, counters and events
+SHARED_STATE = os.environ.get("OE_SHARED_STATE", "0") == "1"
+# Seconds between checks for changes written by other workers
+SHARED_REFRESH_INTERVAL_S = float(os.environ.get("OE_SHARED_REFRESH_INTERVAL", "1.0"))
+# Key of the header line a compaction starts a rewritten log with
+LOG_EPOCH = "epoch"
+
+
+class FileLock:
+    """
+    Exclusive lock shared by every thread of this process and every process that opens the same lock file, for
+    read-modify-write cycles on files that several workers update. The file is opened per process, so a forked child
+    never shares its parent's lock.
+
+    Args:
+        path (str): the lock file (created on first use)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is None:
+            return self
+        try:
+            if self._pid != os.getpid():
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+        return False
+
+
+def file_stamp(path):
+    """
+    Returns:
+        tuple: identifies the current contents of a file that is only ever replaced or appended to (None if it doesn't
+            exist)
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def epoch_header(epoch):
+    """
+    Returns:
+        bytes: the first line of an append-only log rewritten by a compaction, carrying the compaction's epoch. Other
+            workers compare it with the epoch they have read, since the new file may reuse the old one's inode.
+    """
+    return (json.dumps({LOG_EPOCH: epoch}) + "\n").encode()
+
+
+def log_epoch(first_line):
+    """
+    Args:
+        first_line (bytes): the first line of a log
+
+    Returns:
+        tuple: (epoch, length of the header line); a log without a header (never compacted) is epoch 0
+    """
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        return 0, 0
+    if isinstance(header, dict) and LOG_EPOCH in header:
+        return header[LOG_EPOCH], len(first_line)
+    return 0, 0
+
+
+class SharedStateFollower:
+    """
+    Keeps this worker's in-memory state (the ad inventory, the analytics rollups, the unclaimed mentions index and the
+    event store) in step with the writes of other workers. A background thread polls a cheap stamp of each watched
+    piece of storage (a file's size and modification time, or a database's change counter) and runs the refresh
+    callbacks of the ones that changed, so other workers' updates show up within one refresh interval.
+
+    Args:
+        interval (float): seconds between polls
+    """
+
+    def __init__(self, interval=SHARED_REFRESH_INTERVAL_S):
+        self.interval = interval
+        self._watches = []  # [name, stamp function, callback, last stamp]
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.checks = 0
+        self.refreshes = {}
+        self.errors = 0
+
+    def watch(self, name, stamp, callback):
+        """
+        Args:
+            name (str): what is watched, for stats
+            stamp (callable): returns a value that changes whenever the watched data does
+            callback (callable): called (without arguments) after the stamp has changed
+        """
+        with self._lock:
+            self._watches.append([name, stamp, callback, stamp()])
+
+    def check(self):
+        """
+        Polls every watch once and runs the callbacks of those that changed.
+
+        Returns:
+            list[str]: the names of the watches that were refreshed
+        """
+        refreshed = []
+        with self._lock:
+            self.checks += 1
+            for watch in self._watches:
+                name, stamp, callback, last = watch
+                try:
+                    current = stamp()
+                    if current == last:
+                        continue
+                    callback()
+                    watch[3] = current
+                except Exception as e:
+                    # Leave the old stamp, so the refresh is retried on the next poll
+                    self.errors += 1
+                    print(f"shared state refresh of {name} failed, will retry: {e}")
+                    continue
+                self.refreshes[name] = self.refreshes.get(name, 0) + 1
+                refreshed.append(name)
+        return refreshed
+
+    def start(self):
+        """
+        Starts the polling thread (once). Called on app startup when OE_SHARED_STATE is set.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="shared-state", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def close(self):
+        self._stopped.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SHARED_STATE,
+                "file_locks": fcntl is not None,
+                "interval_s": self.interval,
+                "watches": [watch[0] for watch in self._watches],
+                "checks": self.checks,
+                "refreshes": dict(self.refreshes),
+                "errors": self.errors,
+            }
+
+
+follower = SharedStateFollower()
@@ -0,0 +1,132 @@
+import builtins
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Recorded as early as possible; app.py imports this module first
+PROCESS_START = time.perf_counter()
+
+# Comma separated warm-up hooks to run in the background at startup ("all" for every hook)
+WARMUP = os.environ.get("OE_WARMUP", "")
+
+import_costs = {}  # module imported by app.py -> ms, including everything it imported in turn
+lazy_import_costs = {}  # module loaded on first use -> ms
+warmup_costs = {}  # warm-up hook -> ms
+ready_ms = None
+
+_warmup_hooks = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def timed_imports():
+    """
+    Records how long each module imported inside the block takes to load, counting nested imports towards the module that
+    triggered them. Only active for the duration of the block, so it costs nothing once the app has started.
+    """
+    original = builtins.__import__
+    depth = [0]
+
+    def timed(name, globals=None, locals=None, fromlist=(), level=0):
+        if depth[0] > 0 or level != 0 or name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+        depth[0] += 1
+        start = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            depth[0] -= 1
+            import_costs[name] = import_costs.get(name, 0) + (time.perf_counter() - start) * 1000
+
+    builtins.__import__ = timed
+    try:
+        yield
+    finally:
+        builtins.__import__ = original
+
+
+def lazy_import(name):
+    """
+    Imports a heavy dependency on first use and records what the import cost.
+
+    Args:
+        name (str): the module name
+
+    Returns:
+        module: the imported module
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        lazy_import_costs.setdefault(name, (time.perf_counter() - start) * 1000)
+    return module
+
+
+def warmup_hook(name):
+    """
+    Decorator registering a function as a named warm-up hook.
+    """
+    def register(fn):
+        _warmup_hooks[name] = fn
+        return fn
+    return register
+
+
+def run_warmup(names=WARMUP):
+    """
+    Runs the requested warm-up hooks on a background thread so the server can take traffic immediately.
+
+    Args:
+        names (str): comma separated hook names, or "all"
+
+    Returns:
+        threading.Thread: the warm-up thread, or None if there is nothing to run
+    """
+    wanted = list(_warmup_hooks) if names.strip() == "all" else [n.strip() for n in names.split(",") if n.strip()]
+    if not wanted:
+        return None
+
+    def run():
+        for name in wanted:
+            hook = _warmup_hooks.get(name)
+            if hook is None:
+                print(f"unknown warm-up hook {name}")
+                continue
+            start = time.perf_counter()
+            try:
+                hook()
+            except Exception as e:
+                print(f"warm-up hook {name} failed: {e}")
+            warmup_costs[name] = (time.perf_counter() - start) * 1000
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_ready():
+    global ready_ms
+    ready_ms = (time.perf_counter() - PROCESS_START) * 1000
+
+
+def report():
+    """
+    Returns:
+        dict: time to ready and the per-module import and warm-up costs, in milliseconds
+    """
+    def rounded(costs):
+        return {name: round(ms, 3) for name, ms in sorted(costs.items(), key=lambda item: -item[1])}
+
+    return {
+        "ready_ms": round(ready_ms, 3) if ready_ms is not None else None,
+        "imports_ms": rounded(import_costs),
+        "lazy_imports_ms": rounded(lazy_import_costs),
+        "warmup_ms": rounded(warmup_costs),
+        "available_warmup_hooks": sorted(_warmup_hooks),
+    }
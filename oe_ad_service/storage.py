@@ -0,0 +1,691 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from metrics import registry
+from shared import FileLock, epoch_header, file_stamp, log_epoch
+
+# Which backend to use: "json" (the original flat files) or "sqlite"
+STORAGE_BACKEND = os.environ.get("OE_STORAGE_BACKEND", "json")
+SQLITE_PATH = os.environ.get("OE_SQLITE_PATH", "oe_ads.db")
+
+CATEGORIES_PATH = "categories_ads.json"
+# Standing bids of every company that has bought into a category (see auction.py)
+BIDS_PATH = "bids.json"
+# Written before a purchase touches the category and click files and removed once both are updated
+PURCHASE_JOURNAL_PATH = "purchase_journal.json"
+# Held by whichever worker process is in a read-modify-write cycle on the json files
+LOCK_PATH = ".oe_store.lock"
+
+# Append counter increments to a log instead of rewriting the counter files (json backend; 0 rewrites them per flush)
+COUNTER_LOG = os.environ.get("OE_COUNTER_LOG", "1") == "1"
+COUNTER_LOG_PATH = "counters.log"
+# Lists the counter files being replaced by a compaction of the log, until the log has been emptied
+COUNTER_COMPACTION_PATH = "counter_compaction.json"
+# Fold the log into the counter files once it is this large, or once its oldest record is this many seconds old
+COUNTER_LOG_COMPACT_BYTES = int(os.environ.get("OE_COUNTER_LOG_COMPACT_BYTES", str(1024 * 1024)))
+COUNTER_LOG_COMPACT_INTERVAL_S = float(os.environ.get("OE_COUNTER_LOG_COMPACT_INTERVAL", "300"))
+# fsync every append, so increments also survive a power loss rather than just a crash of the process
+COUNTER_LOG_FSYNC = os.environ.get("OE_COUNTER_LOG_FSYNC", "0") == "1"
+
+# Traffic to the json data files, exported at /metrics
+file_bytes = registry.counter("oe_storage_file_bytes_total", "Bytes read from and written to the json data files", labels=("op",))
+file_operations = registry.counter("oe_storage_file_operations_total", "Reads and writes of the json data files", labels=("op",))
+_bytes_read, _bytes_written = file_bytes.labels("read"), file_bytes.labels("write")
+_reads, _writes = file_operations.labels("read"), file_operations.labels("write")
+
+# Counter tables and the json file each one lives in
+COUNTER_PATHS = {
+    "disease_counts": "disease_counts.json",
+    "uncategorized": "uncategorized.json",
+    "disease_times": "disease_times.json",
+    "total_queries": "total_queries.json",
+    "query_costs": "query_costs.json",
+    "ad_clicks": "ad_clicks.json",
+    "impressions": "impressions.json",
+}
+
+# Counter tables whose entries are nested ({key: {field: n}}) rather than flat ({key: n})
+NESTED_FIELDS = {"ad_clicks": "clicks"}
+
+CATEGORY_FIELDS = ("ad_path", "company", "category_cost", "link")
+
+
+class VersionConflict(Exception):
+    """
+    Raised when a compare-and-swap on a category fails because the category has changed since it was read.
+    """
+
+
+def apply_deltas(name, data, deltas):
+    """
+    Adds a set of increments to a counter table in place.
+
+    Args:
+        name (str): the counter table
+        data (dict): the current contents of the table
+        deltas (dict): key -> amount to add
+
+    Returns:
+        dict: the updated table
+    """
+    field = NESTED_FIELDS.get(name)
+    for key, amount in deltas.items():
+        if field is None:
+            data[key] = data.get(key, 0) + amount
+        else:
+            entry = data.setdefault(key, {})
+            entry[field] = entry.get(field, 0) + amount
+    return data
+
+
+def counter_value(name, data, key):
+    """
+    Reads a single counter out of a table, handling the nested tables.
+    """
+    field = NESTED_FIELDS.get(name)
+    if field is None:
+        return data.get(key, 0)
+    return data.get(key, {}).get(field, 0)
+
+
+class CounterLog:
+    """
+    Write-ahead log for the counter tables of the json backend. A flush appends its batch of increments as one compact
+    line, so its cost depends on the size of the batch rather than on the number of counters. The counter files become
+    snapshots; the current tables are the snapshots plus the log, kept in memory and replayed when the store is first
+    used.
+
+    Once the log grows past compact_bytes, or its oldest record is older than compact_interval_s, the tables changed
+    since the last snapshot are rewritten and the log is emptied. The new snapshots go to temporary files first. A
+    journal listing them is then written, and it is the commit point: a crash before it leaves the old snapshots and
+    the log in place, and a crash after it is completed on the next start. A line torn by a crash mid-append was never
+    acknowledged and is cut off.
+
+    Several worker processes can share the log. Every operation runs under the store's lock file and first reads what
+    the others have appended. Each compaction starts the new log with a header line carrying the next epoch (a freshly
+    created log has none, and is epoch 0), so a log emptied by another worker's compaction is noticed even if the new
+    file reuses the old one's inode, and the tables are reloaded from the new snapshots.
+
+    Args:
+        store (JsonStore): the store whose counter files are the snapshots (its lock must be held when calling in)
+        compact_bytes (int): log size that triggers a compaction
+        compact_interval_s (float): age of the oldest record that triggers a compaction
+        fsync (bool): fsync every append
+    """
+
+    def __init__(self, store, compact_bytes=COUNTER_LOG_COMPACT_BYTES, compact_interval_s=COUNTER_LOG_COMPACT_INTERVAL_S,
+                 fsync=COUNTER_LOG_FSYNC):
+        self.store = store
+        self.path = store._path(COUNTER_LOG_PATH)
+        self.compact_bytes = compact_bytes
+        self.compact_interval_s = compact_interval_s
+        self.fsync = fsync
+
+        self._tables = None  # table -> contents (snapshot plus log)
+        self._dirty = set()  # tables changed since their snapshot
+        self._epoch = None  # the log read so far, how far, and where its records start
+        self._offset = 0
+        self._header_end = 0
+        self._oldest_record = None  # monotonic time of the first record appended since the last compaction
+
+        self.replay_s = 0.0
+        self.replayed_records = 0
+        self.appends = 0
+        self.compactions = 0
+        self.torn_records = 0
+
+    def _log_stamp(self):
+        # (epoch, size) of the log on disk
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return 0, 0
+        with f:
+            return log_epoch(f.readline())[0], os.fstat(f.fileno()).st_size
+
+    def _sync(self):
+        # Brings the in-memory tables up to date with the files: finishes an interrupted compaction, reloads the
+        # snapshots if the log has been replaced since it was read, then applies whatever has been appended since
+        if os.path.exists(self.store._path(COUNTER_COMPACTION_PATH)):
+            self._finish_compaction(self.store._read(COUNTER_COMPACTION_PATH))
+            self._tables = None
+        epoch, size = self._log_stamp() if self._tables is not None else (None, 0)
+        if self._tables is None or epoch != self._epoch or size < self._offset:
+            start = time.perf_counter()
+            self._tables = {name: self.store._read(filename) for name, filename in COUNTER_PATHS.items()}
+            self._dirty = set()
+            self._epoch = None
+            self._offset = 0
+            self._header_end = 0
+            self.replayed_records = self._follow()
+            self.replay_s = time.perf_counter() - start
+        else:
+            self._follow()
+
+    def _follow(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            # No log yet: the first append creates it, without a header
+            self._epoch = 0
+            return 0
+        with f:
+            if self._epoch is None:
+                self._epoch, self._header_end = log_epoch(f.readline())
+                self._offset = self._header_end
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            # Appends happen under the lock, so an unfinished line is the remains of a crash; cut it off so the next
+            # append starts on a fresh line
+            os.truncate(self.path, self._offset + end)
+            self.torn_records += 1
+        records = 0
+        for line in data[:end].splitlines():
+            try:
+                batch = json.loads(line)
+            except ValueError:
+                self.torn_records += 1
+                continue
+            self._apply(batch)
+            records += 1
+        self._offset += end
+        if records and self._oldest_record is None:
+            self._oldest_record = time.monotonic()
+        return records
+
+    def _apply(self, batch):
+        for name, deltas in batch.items():
+            apply_deltas(name, self._tables[name], deltas)
+            self._dirty.add(name)
+
+    def load_table(self, name):
+        self._sync()
+        data = self._tables[name]
+        if name in NESTED_FIELDS:
+            return {key: dict(value) for key, value in data.items()}
+        return dict(data)
+
+    def append(self, batch):
+        """
+        Logs a batch of increments and applies it to the tables.
+
+        Args:
+            batch (dict): table name -> {key: amount}
+        """
+        self._sync()
+        line = (json.dumps(batch, separators=(",", ":")) + "\n").encode()
+        with open(self.path, "ab") as f:
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self._offset = f.tell()
+        _bytes_written.inc(len(line))
+        _writes.inc()
+        self._apply(batch)
+        self.appends += 1
+
+        if self._oldest_record is None:
+            self._oldest_record = time.monotonic()
+        if self._offset >= self.compact_bytes or time.monotonic() - self._oldest_record >= self.compact_interval_s:
+            self.compact()
+
+    def replace_table(self, name, data):
+        """
+        Overwrites a whole table (re-keying, click resets). Not an increment, so it goes straight into a snapshot.
+        """
+        self._sync()
+        self._tables[name] = data
+        self._dirty.add(name)
+        self.compact()
+
+    def compact(self):
+        """
+        Rewrites the changed tables as snapshots and empties the log.
+        """
+        self._sync()
+        if not self._dirty and self._offset <= self._header_end:
+            return
+        tables = sorted(self._dirty)
+        for name in tables:
+            self.store._write_tmp(COUNTER_PATHS[name], self._tables[name])
+        journal = {"tables": [COUNTER_PATHS[name] for name in tables], "epoch": (self._epoch or 0) + 1}
+        # The commit point: from here on the new snapshots replace the log
+        self.store._write(COUNTER_COMPACTION_PATH, journal)
+        self._finish_compaction(journal)
+        self._dirty = set()
+        self.compactions += 1
+
+    def _finish_compaction(self, journal):
+        # Idempotent, so a compaction interrupted anywhere after its journal was written can simply be replayed
+        for filename in journal["tables"]:
+            path = self.store._path(filename)
+            if os.path.exists(path + ".tmp"):
+                os.replace(path + ".tmp", path)
+        epoch = journal.get("epoch", self._log_stamp()[0] + 1)
+        header = epoch_header(epoch)
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(header)
+        os.replace(self.path + ".tmp", self.path)
+        self._epoch = epoch
+        self._offset = self._header_end = len(header)
+        self._oldest_record = None
+        os.remove(self.store._path(COUNTER_COMPACTION_PATH))
+
+    def stats(self):
+        return {
+            "log_bytes": self._offset,
+            "epoch": self._epoch,
+            "replay_s": self.replay_s,
+            "replayed_records": self.replayed_records,
+            "appends": self.appends,
+            "compactions": self.compactions,
+            "torn_records": self.torn_records,
+        }
+
+
+class JsonStore:
+    """
+    Storage backend that keeps every table in its own json file, exactly as the service always has. Every write
+    rewrites the whole file into a temporary file and renames it over the old one, so readers see either the old or the
+    new contents, never a half-written file.
+
+    Read-modify-write cycles hold a lock file (see shared.FileLock), so several worker processes (uvicorn --workers N)
+    can share the files without losing each other's updates. The categories are cached in memory until the file is
+    replaced, by this process or another.
+
+    Counter increments go to an append-only log (see CounterLog) that is folded into the counter files from time to time,
+    unless counter_log is off.
+    """
+
+    def __init__(self, base_dir=".", counter_log=COUNTER_LOG):
+        self.base_dir = base_dir
+        self._lock = FileLock(self._path(LOCK_PATH))
+        self._categories = None
+        self._categories_stamp = None
+        self.counter_log = CounterLog(self) if counter_log else None
+
+    def _path(self, filename):
+        return os.path.join(self.base_dir, filename)
+
+    def _read(self, filename):
+        path = self._path(filename)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+                _bytes_read.inc(os.fstat(f.fileno()).st_size)
+            _reads.inc()
+            return data
+        return {}
+
+    def _write_tmp(self, filename, data):
+        # Writes the new contents next to the file; returns the temporary path to rename over it
+        tmp_path = self._path(filename) + ".tmp"
+        with open(tmp_path, "w") as f:
+            # total_queries.json has always been written compactly
+            if filename == COUNTER_PATHS["total_queries"]:
+                json.dump(data, f)
+            else:
+                json.dump(data, f, indent=2)
+            _bytes_written.inc(f.tell())
+        _writes.inc()
+        return tmp_path
+
+    def _write(self, filename, data):
+        os.replace(self._write_tmp(filename, data), self._path(filename))
+
+    # Counters
+    def load_table(self, name):
+        if self.counter_log is None:
+            return self._read(COUNTER_PATHS[name])
+        with self._lock:
+            return self.counter_log.load_table(name)
+
+    def save_table(self, name, data):
+        with self._lock:
+            if self.counter_log is None:
+                self._write(COUNTER_PATHS[name], data)
+            else:
+                self.counter_log.replace_table(name, data)
+
+    def increment_batch(self, batch):
+        """
+        Applies increments to several counter tables.
+
+        Args:
+            batch (dict): table name -> {key: amount}
+        """
+        with self._lock:
+            if self.counter_log is not None:
+                self.counter_log.append(batch)
+                return
+            for name, deltas in batch.items():
+                filename = COUNTER_PATHS[name]
+                self._write(filename, apply_deltas(name, self._read(filename), deltas))
+
+    def reset_clicks(self, disease):
+        with self._lock:
+            self._reset_clicks(disease)
+
+    def delete_counters(self, name, keys):
+        """
+        Removes counters from a table, e.g. expired impression counts. Increments to other keys are never lost.
+
+        Args:
+            name (str): the counter table
+            keys (iterable[str]): the counters to remove
+        """
+        with self._lock:
+            data = self._read(COUNTER_PATHS[name]) if self.counter_log is None else self.counter_log.load_table(name)
+            removed = [data.pop(key) for key in keys if key in data]
+            if not removed:
+                return
+            if self.counter_log is None:
+                self._write(COUNTER_PATHS[name], data)
+            else:
+                self.counter_log.replace_table(name, data)
+
+    def _reset_clicks(self, disease):
+        clicks = self._read(COUNTER_PATHS["ad_clicks"]) if self.counter_log is None else self.counter_log.load_table("ad_clicks")
+        if disease in clicks:
+            clicks[disease] = {"clicks": 0, "mentions": 0}
+        if self.counter_log is None:
+            self._write(COUNTER_PATHS["ad_clicks"], clicks)
+        else:
+            self.counter_log.replace_table("ad_clicks", clicks)
+
+    # Categories
+    def _load_categories(self):
+        # Called with self._lock held; re-reads the file if another process has replaced it since it was cached
+        stamp = file_stamp(self._path(CATEGORIES_PATH))
+        if self._categories is None or stamp != self._categories_stamp:
+            self._categories = self._read(CATEGORIES_PATH)
+            self._categories_stamp = stamp
+            for info in self._categories.values():
+                info.setdefault("version", 0)
+            journal = self._read(PURCHASE_JOURNAL_PATH)
+            if journal:
+                # A purchase was interrupted between its two file writes; finish it
+                self._apply_purchase(journal["disease"], journal["info"])
+        return self._categories
+
+    def load_categories(self):
+        with self._lock:
+            return {disease: dict(info) for disease, info in self._load_categories().items()}
+
+    def save_category(self, disease, info):
+        with self._lock:
+            categories = dict(self._load_categories())
+            categories[disease] = dict(info)
+            self._write(CATEGORIES_PATH, categories)
+            self._categories = categories
+            self._categories_stamp = file_stamp(self._path(CATEGORIES_PATH))
+
+    def purchase_category(self, disease, info, expected_version):
+        """
+        Compare-and-swap of a category's ownership: stores the new ad information and resets the category's clicks, but
+        only if the category is still at the expected version. The purchase is journaled first, so a crash between the
+        category and click writes is completed on the next start.
+
+        Args:
+            disease (str): the disease category
+            info (dict): the new ad information, including the new version
+            expected_version (int): the version the buyer's checks were made against
+
+        Raises:
+            VersionConflict: the category has changed since
+        """
+        with self._lock:
+            current = self._load_categories().get(disease)
+            if current is None or current.get("version", 0) != expected_version:
+                raise VersionConflict(f"{disease} has changed since version {expected_version}")
+            self._write(PURCHASE_JOURNAL_PATH, {"disease": disease, "info": info})
+            self._apply_purchase(disease, info)
+
+    def _apply_purchase(self, disease, info):
+        # Called with self._lock held; idempotent so an interrupted purchase can simply be replayed
+        categories = dict(self._categories)
+        categories[disease] = dict(info)
+        self._write(CATEGORIES_PATH, categories)
+        self._categories = categories
+        self._categories_stamp = file_stamp(self._path(CATEGORIES_PATH))
+        self._reset_clicks(disease)
+        os.remove(self._path(PURCHASE_JOURNAL_PATH))
+
+    # Change stamps, polled by workers that follow each other's writes (see shared.py)
+    def categories_stamp(self):
+        return file_stamp(self._path(CATEGORIES_PATH))
+
+    def counters_stamp(self):
+        return tuple(file_stamp(self._path(filename)) for filename in list(COUNTER_PATHS.values()) + [COUNTER_LOG_PATH])
+
+    # Bids
+    def load_bids(self):
+        """
+        Returns:
+            dict: disease -> company -> {"bid", "ad_path", "link"}
+        """
+        with self._lock:
+            return self._read(BIDS_PATH)
+
+    def save_bid(self, disease, company, entry):
+        with self._lock:
+            bids = self._read(BIDS_PATH)
+            bids.setdefault(disease, {})[company] = dict(entry)
+            self._write(BIDS_PATH, bids)
+
+
+class SqliteStore:
+    """
+    Storage backend on an embedded SQLite database in WAL mode. Counter increments are single-row upserts, so the cost
+    of a write no longer grows with the number of diseases tracked.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS counters (
+        tbl TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value NOT NULL DEFAULT 0,
+        PRIMARY KEY (tbl, key)
+    );
+    CREATE TABLE IF NOT EXISTS categories (
+        disease TEXT PRIMARY KEY,
+        company TEXT NOT NULL COLLATE NOCASE,
+        category_cost NOT NULL,
+        ad_path TEXT,
+        link TEXT,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS categories_company ON categories (company);
+    CREATE TABLE IF NOT EXISTS bids (
+        disease TEXT NOT NULL,
+        company TEXT NOT NULL,
+        bid NOT NULL,
+        ad_path TEXT,
+        link TEXT,
+        PRIMARY KEY (disease, company)
+    );
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(categories)")]
+            if "version" not in columns:
+                # Databases created before categories were versioned
+                conn.execute("ALTER TABLE categories ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def connection(self):
+        """
+        Returns:
+            sqlite3.Connection: this thread's connection to the database
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Counters
+    def load_table(self, name):
+        rows = self.connection().execute("SELECT key, value FROM counters WHERE tbl = ?", (name,)).fetchall()
+        field = NESTED_FIELDS.get(name)
+        if field is None:
+            return {key: value for key, value in rows}
+        return {key: {field: value} for key, value in rows}
+
+    def save_table(self, name, data):
+        field = NESTED_FIELDS.get(name)
+        with self.connection() as conn:
+            conn.execute("DELETE FROM counters WHERE tbl = ?", (name,))
+            conn.executemany(
+                "INSERT INTO counters (tbl, key, value) VALUES (?, ?, ?)",
+                [(name, key, value if field is None else value.get(field, 0)) for key, value in data.items()],
+            )
+
+    def increment_batch(self, batch):
+        """
+        Applies increments to several counter tables in one transaction, one upsert per counter.
+
+        Args:
+            batch (dict): table name -> {key: amount}
+        """
+        rows = [(name, key, amount) for name, deltas in batch.items() for key, amount in deltas.items()]
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT INTO counters (tbl, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (tbl, key) DO UPDATE SET value = value + excluded.value",
+                rows,
+            )
+
+    def reset_clicks(self, disease):
+        with self.connection() as conn:
+            conn.execute("UPDATE counters SET value = 0 WHERE tbl = 'ad_clicks' AND key = ?", (disease,))
+
+    def delete_counters(self, name, keys):
+        with self.connection() as conn:
+            conn.executemany("DELETE FROM counters WHERE tbl = ? AND key = ?", [(name, key) for key in keys])
+
+    # Categories
+    def load_categories(self):
+        rows = self.connection().execute(
+            "SELECT disease, ad_path, company, category_cost, link, version FROM categories ORDER BY rowid"
+        ).fetchall()
+        return {
+            disease: {"ad_path": ad_path, "company": company, "category_cost": cost, "link": link, "version": version}
+            for disease, ad_path, company, cost, link, version in rows
+        }
+
+    def save_category(self, disease, info):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT INTO categories (disease, ad_path, company, category_cost, link, version) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (disease) DO UPDATE SET ad_path = excluded.ad_path, company = excluded.company, "
+                "category_cost = excluded.category_cost, link = excluded.link, version = excluded.version",
+                (disease, info.get("ad_path"), info["company"], info["category_cost"], info.get("link"), info.get("version", 0)),
+            )
+
+    def purchase_category(self, disease, info, expected_version):
+        # The version check, the ownership change and the click reset commit (or roll back) as one transaction
+        with self.connection() as conn:
+            updated = conn.execute(
+                "UPDATE categories SET ad_path = ?, company = ?, category_cost = ?, link = ?, version = ? "
+                "WHERE disease = ? AND version = ?",
+                (info.get("ad_path"), info["company"], info["category_cost"], info.get("link"), info["version"], disease, expected_version),
+            ).rowcount
+            if updated != 1:
+                raise VersionConflict(f"{disease} has changed since version {expected_version}")
+            conn.execute("UPDATE counters SET value = 0 WHERE tbl = 'ad_clicks' AND key = ?", (disease,))
+
+    # Change stamps, polled by workers that follow each other's writes (see shared.py)
+    def categories_stamp(self):
+        # The table is small, and its contents are the only stamp that ignores the far more frequent counter commits
+        return self.load_categories()
+
+    def counters_stamp(self):
+        # Changes whenever another connection (another thread or worker) commits
+        return self.connection().execute("PRAGMA data_version").fetchone()[0]
+
+    # Bids
+    def load_bids(self):
+        bids = {}
+        rows = self.connection().execute("SELECT disease, company, bid, ad_path, link FROM bids ORDER BY rowid").fetchall()
+        for disease, company, bid, ad_path, link in rows:
+            bids.setdefault(disease, {})[company] = {"bid": bid, "ad_path": ad_path, "link": link}
+        return bids
+
+    def save_bid(self, disease, company, entry):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT INTO bids (disease, company, bid, ad_path, link) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (disease, company) DO UPDATE SET bid = excluded.bid, ad_path = excluded.ad_path, link = excluded.link",
+                (disease, company, entry["bid"], entry.get("ad_path"), entry.get("link")),
+            )
+
+    def import_json(self, base_dir="."):
+        """
+        Imports the json data files into the database, replacing whatever is there. Used by migrate_json.py.
+
+        Args:
+            base_dir (str): directory containing the json files
+
+        Returns:
+            dict: number of rows imported per table
+        """
+        source = JsonStore(base_dir)
+        imported = {}
+
+        categories = source.load_categories()
+        with self.connection() as conn:
+            conn.execute("DELETE FROM categories")
+        for disease, info in categories.items():
+            self.save_category(disease, info)
+        imported["categories"] = len(categories)
+
+        bids = source.load_bids()
+        with self.connection() as conn:
+            conn.execute("DELETE FROM bids")
+        for disease, bidders in bids.items():
+            for company, entry in bidders.items():
+                self.save_bid(disease, company, entry)
+        imported["bids"] = sum(len(bidders) for bidders in bids.values())
+
+        for name in COUNTER_PATHS:
+            data = source.load_table(name)
+            self.save_table(name, data)
+            imported[name] = len(data)
+        return imported
+
+
+def create_store(backend=STORAGE_BACKEND):
+    """
+    Args:
+        backend (str): "json" or "sqlite"
+
+    Returns:
+        JsonStore | SqliteStore: the storage backend
+    """
+    if backend == "sqlite":
+        return SqliteStore()
+    if backend == "json":
+        return JsonStore()
+    raise ValueError(f"Unknown storage backend {backend}")
+
+
+store = create_store()
+
+if getattr(store, "counter_log", None) is not None:
+    registry.callback("oe_counter_log_bytes", "Size of the counter log not yet folded into the counter files",
+                      lambda: store.counter_log.stats()["log_bytes"])
+    registry.callback("oe_counter_log_replay_seconds", "Time taken to load the counter files and replay the log at startup",
+                      lambda: store.counter_log.replay_s)
+    registry.callback("oe_counter_log_replayed_records", "Log records replayed at startup", lambda: store.counter_log.replayed_records)
+    registry.callback("oe_counter_log_compactions_total", "Compactions of the counter log", lambda: store.counter_log.compactions, "counter")
@@ -0,0 +1,272 @@
+import atexit
+import os
+import threading
+import time
+from storage import apply_deltas, store
+
+# Flush whenever this many seconds have passed or this many increments are waiting, whichever comes first
+FLUSH_INTERVAL_S = float(os.environ.get("OE_TELEMETRY_FLUSH_INTERVAL", "2.0"))
+FLUSH_MAX_PENDING = int(os.environ.get("OE_TELEMETRY_FLUSH_SIZE", "500"))
+
+
+class CounterBuffer:
+    """
+    In-memory aggregator for the usage counters (mentions, uncategorized mentions, clicks, time on query, LLM cost and
+    total queries). Increments on the hot path only touch a dict under a lock. A background thread folds them into
+    storage in batches, so each table is written at most once per flush instead of once per request.
+    """
+
+    def __init__(self, store, interval=FLUSH_INTERVAL_S, max_pending=FLUSH_MAX_PENDING):
+        self.store = store
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._pending = {}
+        self._pending_count = 0
+        # Increments that have been taken out of _pending but not saved yet; still visible to readers
+        self._inflight = {}
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Held from buffering an increment until its listeners have run (see seeding())
+        self._incr_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self._incr_listeners = []
+        self._versions = {}  # table -> number of changes seen, for caches of derived views
+
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.last_flush_size = 0
+
+    def on_flush(self, listener):
+        """
+        Registers a callback run after every flush that persisted something, e.g. to refresh derived views.
+
+        Args:
+            listener (callable): called with the flushed batch ({table: {key: amount}})
+        """
+        self._listeners.append(listener)
+
+    def on_incr(self, listener):
+        """
+        Registers a callback run on every increment, e.g. to keep materialized rollups current. It runs on the caller's
+        thread, so it has to be cheap.
+
+        Args:
+            listener (callable): called with (name, key, amount)
+        """
+        self._incr_listeners.append(listener)
+
+    def seeding(self):
+        """
+        Holds off new increments, for an incr listener that seeds itself from view(): every increment is then either
+        already in the view read inside the block or passed to the listener after it, never both or neither.
+
+            with telemetry.seeding():
+                data = telemetry.view(name)
+                ...  # mark the listener as seeded
+
+        Returns:
+            a context manager
+        """
+        return self._incr_lock
+
+    def incr(self, name, key, amount=1):
+        """
+        Adds an increment to the buffer. Never touches storage.
+
+        Args:
+            name (str): the counter table (see storage.COUNTER_PATHS)
+            key (str): the counter within the table
+            amount (int | float): how much to add
+        """
+        with self._incr_lock:
+            with self._lock:
+                table = self._pending.setdefault(name, {})
+                table[key] = table.get(key, 0) + amount
+                self._pending_count += 1
+                self._versions[name] = self._versions.get(name, 0) + 1
+                pending = self._pending_count
+
+            for listener in self._incr_listeners:
+                listener(name, key, amount)
+
+        self._ensure_started()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def incr_many(self, increments):
+        """
+        Adds several increments under a single lock acquisition, so a batch of events lands in the buffer (and later in
+        storage) together.
+
+        Args:
+            increments (list[tuple]): (name, key, amount) for each increment
+        """
+        if not increments:
+            return
+        with self._incr_lock:
+            with self._lock:
+                for name, key, amount in increments:
+                    table = self._pending.setdefault(name, {})
+                    table[key] = table.get(key, 0) + amount
+                    self._versions[name] = self._versions.get(name, 0) + 1
+                self._pending_count += len(increments)
+                pending = self._pending_count
+
+            for name, key, amount in increments:
+                for listener in self._incr_listeners:
+                    listener(name, key, amount)
+
+        self._ensure_started()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def discard(self, name, key):
+        """
+        Drops buffered increments for one counter that haven't been written yet, e.g. clicks on a category whose click
+        count has just been reset.
+
+        Args:
+            name (str): the counter table
+            key (str): the counter within the table
+        """
+        with self._lock:
+            amount = self._pending.get(name, {}).pop(key, None)
+            if amount is not None:
+                self._pending_count -= 1
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def version(self, name):
+        """
+        Args:
+            name (str): the counter table
+
+        Returns:
+            int: changes the table has seen through this buffer; a cached view of the table is current while this stays
+                the same
+        """
+        return self._versions.get(name, 0)
+
+    def view(self, name):
+        """
+        Returns the persisted table with any buffered increments applied, so readers see their own writes.
+
+        Args:
+            name (str): the counter table
+
+        Returns:
+            dict: the current value of the table
+        """
+        return apply_deltas(name, self.store.load_table(name), self.pending(name))
+
+    def pending(self, name):
+        """
+        Args:
+            name (str): the counter table
+
+        Returns:
+            dict: key -> increments that have been recorded but not yet persisted
+        """
+        with self._lock:
+            deltas = dict(self._inflight.get(name, {}))
+            for key, amount in self._pending.get(name, {}).items():
+                deltas[key] = deltas.get(key, 0) + amount
+        return deltas
+
+    def flush(self):
+        """
+        Writes every buffered increment to storage in a single batch.
+
+        Returns:
+            int: number of increments flushed
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                count = self._pending_count
+                self._pending = {}
+                self._pending_count = 0
+                self._inflight = batch
+
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self.store.increment_batch(batch)
+            except Exception:
+                with self._lock:
+                    # Put the batch back in the queue so the next flush retries it
+                    for name, deltas in batch.items():
+                        table = self._pending.setdefault(name, {})
+                        for key, amount in deltas.items():
+                            table[key] = table.get(key, 0) + amount
+                    self._pending_count += count
+                    self._inflight = {}
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.last_flush_size = count
+
+        for listener in self._listeners:
+            listener(batch)
+        return count
+
+    def stats(self):
+        """
+        Returns:
+            dict: queue depth and flush latency figures for the buffer
+        """
+        with self._lock:
+            queue_depth = self._pending_count
+            pending_keys = sum(len(t) for t in self._pending.values())
+        return {
+            "queue_depth": queue_depth,
+            "pending_keys": pending_keys,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "last_flush_size": self.last_flush_size,
+            "flush_interval_s": self.interval,
+            "flush_max_pending": self.max_pending,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._flush_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="telemetry-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"telemetry flush failed, will retry: {e}")
+
+    def close(self):
+        """
+        Stops the background thread and flushes whatever is left. Called on app shutdown and at interpreter exit.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        self.flush()
+
+
+telemetry = CounterBuffer(store)
+atexit.register(telemetry.close)
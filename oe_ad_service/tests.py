@@ -1,4 +1,31 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import classify
+from batcher import MicroBatcher
 from classify import identify_keywords, get_highest_paying_ad
+import time
+from assets import AssetPipeline, ad_payloads
+from auction import AuctionEngine
+from canonical import Canonicalizer, rekey
+from charts import ChartBusy, ChartService
+from fake_openai import FakeChatCompletions
+from llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMUnavailable
+from events import EventStore
+from inventory import AdInventory
+from pacing import PacingService
+import random
+from shared import SharedStateFollower
+from telemetry import CounterBuffer
+from topk import TopK
+from storage import CATEGORIES_PATH, COUNTER_COMPACTION_PATH, COUNTER_LOG_PATH, COUNTER_PATHS, JsonStore, SqliteStore, VersionConflict
 
 
 key1 = {
@@ -33,10 +60,547 @@ def identify_keywords_test_2():
 def identify_keywords_test_3():
     return identify_keywords(list(key1.keys())[2]) == sorted(key1[list(key1.keys())[2]])
 
+def get_highest_paying_ad_test(index):
+    """
+    Ads point at the optimized image variants; they are generated into a scratch directory rather than ad_assets/.
+    """
+    question, expected = list(key2.items())[index]
+    tmp = tempfile.mkdtemp()
+    assets = ad_payloads.assets
+    try:
+        if assets is not None:
+            ad_payloads.assets = AssetPipeline(tmp)
+        ad_payloads.warm()
+        return get_highest_paying_ad(question) == dict(expected, ad_path=ad_payloads.image_path(expected["ad_path"]))
+    finally:
+        ad_payloads.assets = assets
+        ad_payloads._payloads = None  # rebuilt from the real asset directory on next use
+        shutil.rmtree(tmp)
 def get_highest_paying_ad_test_1():
-    return get_highest_paying_ad(list(key2.keys())[0]) == key2[list(key2.keys())[0]]
+    return get_highest_paying_ad_test(0)
 def get_highest_paying_ad_test_2():
-    return get_highest_paying_ad(list(key2.keys())[1]) == key2[list(key2.keys())[1]]
+    return get_highest_paying_ad_test(1)
+
+def concurrent_purchase_test(store_type, levels=20, bids_per_level=100):
+    """
+    Load test for the compare-and-swap purchase: at every price level, bids_per_level bids race for the same category
+    version. Exactly one may win per level, and readers must never see a half-written categories file.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        shutil.copy(CATEGORIES_PATH, tmp)
+        if store_type == "sqlite":
+            store = SqliteStore(os.path.join(tmp, "test.db"))
+            store.import_json(tmp)
+        else:
+            store = JsonStore(tmp)
+        inventory = AdInventory(store)
+
+        disease = "lung cancer"
+        companies = ["pfizer", "genentech", "gsk", "eli lilly"]
+        torn_reads = []
+        done = threading.Event()
+
+        def reader():
+            while not done.is_set():
+                inventory.snapshot().lookup(disease)
+                if store_type == "json":
+                    try:
+                        with open(os.path.join(tmp, CATEGORIES_PATH)) as f:
+                            json.load(f)
+                    except ValueError:
+                        torn_reads.append(1)
+
+        def bid(price, company, version):
+            try:
+                inventory.purchase(disease, version, company=company, category_cost=price)
+                return True
+            except VersionConflict:
+                return False
+
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.start()
+        winners = []
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            for level in range(levels):
+                version = inventory.snapshot().version_of(disease)
+                price = 100 + level
+                results = list(pool.map(lambda i: bid(price, companies[i % len(companies)], version), range(bids_per_level)))
+                winners.append(sum(results))
+        done.set()
+        reader_thread.join()
+
+        final = AdInventory(store).snapshot().categories[disease]
+        return winners == [1] * levels and final["version"] == levels and final["category_cost"] == 100 + levels - 1 and not torn_reads
+    finally:
+        shutil.rmtree(tmp)
+
+
+def auction_selection_test(bidders_per_category=300, selections=2000):
+    """
+    Weighted and second-price selection over three categories with hundreds of bidders each: winners must follow the bids
+    and a selection must take well under a millisecond.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        shutil.copy(CATEGORIES_PATH, tmp)
+        inventory = AdInventory(JsonStore(tmp))
+        categories = ["lung cancer", "breast cancer", "melanoma"]
+        results = []
+        for mode in ("weighted", "second_price"):
+            engine = AuctionEngine(inventory, JsonStore(tmp), mode=mode, seed=1)
+            for category in categories:
+                for i in range(bidders_per_category):
+                    engine.place_bid(category, f"bidder {i}", 1 + i, persist=False)
+            engine.place_bid("melanoma", "big spender", 10000, persist=False)
+
+            start = time.perf_counter()
+            winners = [engine.select(categories) for _ in range(selections)]
+            per_selection_ms = (time.perf_counter() - start) * 1000 / selections
+
+            big_share = sum(1 for w in winners if w["company"] == "big spender") / selections
+            if mode == "weighted":
+                # big spender holds 10000 of the ~145000 total
+                expected = 10000 / (3 * sum(range(1, bidders_per_category + 1)) + 10000)
+                results.append(abs(big_share - expected) < 0.03)
+            else:
+                results.append(big_share == 1 and winners[0]["cost"] == bidders_per_category)
+            results.append(per_selection_ms < 1)
+        return all(results)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def second_price_test():
+    """
+    Second-price auction with standing bids: a company that never owned the category can bid and win it (also after a
+    restart), and the winner's own bids on the other matched categories don't set the price it pays.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        shutil.copy(CATEGORIES_PATH, tmp)
+        inventory = AdInventory(JsonStore(tmp))
+        engine = AuctionEngine(inventory, JsonStore(tmp), mode="second_price")
+
+        # genentech owns both categories (70 and 40); gsk's 25 is the only competing bid
+        engine.place_bid("lung cancer", "gsk", 25, "ad_images/gsk_lung_cancer.png", "https://www.gsk.com")
+        winner = engine.select(["Breast Cancer", "Lung Cancer"])
+        own_bids_excluded = winner["company"] == "genentech" and winner["cost"] == 25
+
+        # pfizer outbids eli lilly's 60 on obesity without buying it, and the bid survives a restart
+        engine.place_bid("obesity", "pfizer", 90, "ad_images/pfizer_obesity.png", "https://www.pfizer.com")
+        restarted = AuctionEngine(AdInventory(JsonStore(tmp)), JsonStore(tmp), mode="second_price")
+        winner = restarted.select(["Obesity"])
+        standing_bid_wins = winner["company"] == "pfizer" and winner["cost"] == 60 and restarted.bidders("obesity") == 2
+        return own_bids_excluded and standing_bid_wins
+    finally:
+        shutil.rmtree(tmp)
+
+
+def pacing_test(calls=100000):
+    """
+    Budgets and frequency caps: two workers sharing storage must respect a shared daily company budget after
+    reconciling, past days' counts must be dropped from storage, and the budget check plus impression count must cost
+    well under 50us per ad served.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        budgets = {"companies": {"pfizer": 5}, "frequency_cap": 2}
+        worker_a = PacingService(JsonStore(tmp), budgets=budgets, interval=3600)
+        worker_b = PacingService(JsonStore(tmp), budgets=budgets, interval=3600)
+        for _ in range(3):
+            worker_a.record("pfizer", "arthritis")
+        worker_a.reconcile()
+        for _ in range(2):
+            worker_b.record("pfizer", "meningitis")
+        worker_b.reconcile()
+        shared_budget = worker_b.allows("pfizer", "pneumonia") is False and worker_a.allows("gsk", "hiv") is True
+
+        # The next day the budget starts over and yesterday's counts are dropped from storage
+        tomorrow = time.time() + 86400
+        worker_a.reconcile(now=tomorrow)
+        rolled_over = (worker_a.allows("pfizer", "pneumonia", now=tomorrow) is True
+                       and JsonStore(tmp).load_table("impressions") == {} and worker_a.pruned == 3)
+
+        worker_a.record("gsk", "hiv", user="u1")
+        worker_a.record("gsk", "hiv", user="u1")
+        frequency_cap = worker_a.allows("gsk", "hiv", user="u1") is False and worker_a.allows("gsk", "hiv", user="u2") is True
+
+        pacing = PacingService(JsonStore(tmp), budgets={"company_default": 10 ** 9, "category_default": 10 ** 9, "frequency_cap": 10 ** 9}, interval=3600)
+        start = time.perf_counter()
+        for i in range(calls):
+            if pacing.allows("genentech", "lung cancer", user=f"user {i % 100}"):
+                pacing.record("genentech", "lung cancer", user=f"user {i % 100}")
+        per_call_us = (time.perf_counter() - start) * 1e6 / calls
+        print(f"pacing check + record: {per_call_us:.2f}us per ad")
+        return shared_budget and rolled_over and frequency_cap and per_call_us < 50
+    finally:
+        shutil.rmtree(tmp)
+
+
+def topk_test(items=100000, capacity=100):
+    """
+    Unclaimed mentions index: on a long-tailed stream the bounded Space-Saving counter must find the same top 10 as exact
+    counting, keep every count within its error bound and track no more than capacity strings.
+    """
+    rng = random.Random(7)
+    stream = [f"disease {int(rng.paretovariate(1.1))}" for _ in range(items)]
+    exact = TopK(mode="exact")
+    bounded = TopK(capacity, mode="auto")
+    for item in stream:
+        exact.incr(item)
+        bounded.incr(item)
+
+    counts = dict(exact.ranked())
+    same_top = [d for d, _ in bounded.ranked(10)] == [d for d, _ in exact.ranked(10)]
+    within_bounds = all(count - bounded.error(d) <= counts[d] <= count for d, count in bounded.ranked())
+    return same_top and within_bounds and bounded.approximate and len(bounded) <= capacity
+
+
+def canonicalization_test():
+    """
+    Disease-name canonicalization: synonyms, abbreviations and near misses map onto one category, unknown names are kept,
+    and re-keying merges the counters recorded under the old names.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        shutil.copy(CATEGORIES_PATH, tmp)
+        store = JsonStore(tmp)
+        canonicalizer = Canonicalizer(AdInventory(store))
+        names = ["Type 2 Diabetes", "diabetes mellitus", "T2D", "type 2 diabetis"]
+        synonyms = {canonicalizer.canonical(name) for name in names} == {"diabetes"}
+        unknown = canonicalizer.canonical(" Gout ") == "gout" and canonicalizer.canonical("hypotension") == "hypotension"
+        keywords = canonicalizer.keywords(["NSCLC", "Lung cancer", "Gout"]) == ["Lung Cancer", "Gout"]
+
+        store.save_table("disease_counts", {"diabetes": 2, "t2d": 3, "gout": 1})
+        store.save_table("uncategorized", {"t2d": 3, "gout": 1})
+        rekey(store, canonicalizer, tables=("disease_counts", "uncategorized"))
+        rekeyed = (store.load_table("disease_counts") == {"diabetes": 5, "gout": 1}
+                   and store.load_table("uncategorized") == {"gout": 1})
+        return synonyms and unknown and keywords and rekeyed
+    finally:
+        shutil.rmtree(tmp)
+
+
+def _worker_store(backend, tmp):
+    return SqliteStore(os.path.join(tmp, "test.db")) if backend == "sqlite" else JsonStore(tmp)
+
+
+def _hammer_counters(backend, tmp, increments, flush_every):
+    # One worker process: counts through its own telemetry buffer, flushing often so the flushes of all workers collide
+    buffer = CounterBuffer(_worker_store(backend, tmp), interval=3600, max_pending=10 ** 9)
+    for i in range(increments):
+        buffer.incr("disease_counts", f"disease {i % 10}")
+        buffer.incr("ad_clicks", "lung cancer")
+        buffer.incr("total_queries", "total_queries")
+        if i % flush_every == 0:
+            buffer.flush()
+    buffer.close()
+
+
+def _race_purchase(backend, tmp, company, start, results):
+    start.wait()
+    try:
+        _worker_store(backend, tmp).purchase_category("hiv", {**CATEGORIES["hiv"], "company": company, "version": 1}, 0)
+        results.put(company)
+    except VersionConflict:
+        pass
+
+
+CATEGORIES = {"hiv": {"ad_path": "ad_images/gsk_hiv.png", "company": "gsk", "category_cost": 30, "link": "", "version": 0}}
+
+
+def multi_worker_test(backend, workers=8, increments=500, flush_every=20):
+    """
+    Shared state across worker processes: workers flushing counters into the same storage concurrently must not lose a
+    single increment, exactly one of several processes racing for the same category version may buy it, and a worker
+    following the shared state must see the purchase on its next refresh.
+    """
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    tmp = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmp, CATEGORIES_PATH), "w") as f:
+            json.dump(CATEGORIES, f)
+        store = _worker_store(backend, tmp)
+        if backend == "sqlite":
+            store.import_json(tmp)
+        inventory = AdInventory(store)
+        inventory.snapshot()
+        follower = SharedStateFollower(interval=3600)
+        follower.watch("inventory", store.categories_stamp, inventory.refresh)
+
+        processes = [context.Process(target=_hammer_counters, args=(backend, tmp, increments, flush_every)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        counts = store.load_table("disease_counts")
+        exact = (all(process.exitcode == 0 for process in processes)
+                 and counts == {f"disease {i}": workers * increments // 10 for i in range(10)}
+                 and store.load_table("ad_clicks") == {"lung cancer": {"clicks": workers * increments}}
+                 and store.load_table("total_queries") == {"total_queries": workers * increments})
+
+        start = context.Event()
+        results = context.Queue()
+        processes = [context.Process(target=_race_purchase, args=(backend, tmp, f"company {i}", start, results)) for i in range(workers)]
+        for process in processes:
+            process.start()
+        start.set()
+        for process in processes:
+            process.join()
+        winners = []
+        try:
+            while True:
+                winners.append(results.get(timeout=0.5))
+        except queue.Empty:
+            pass
+        one_winner = len(winners) == 1 and store.load_categories()["hiv"]["company"] == winners[0]
+
+        followed = follower.check() == ["inventory"] and inventory.snapshot().categories["hiv"]["version"] == 1
+        return exact and one_winner and followed
+    finally:
+        shutil.rmtree(tmp)
+
+
+def counter_log_test(keys=100000, appends=1000):
+    """
+    Counter log of the json backend: increments are replayed after a restart, a line torn by a crash is dropped, a
+    compaction interrupted before or after its commit point loses and duplicates nothing, one done by another store on
+    the same files is picked up, and appending to a table of 100k counters costs well under a millisecond.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        store = JsonStore(tmp, counter_log=True)
+        store.save_table("disease_counts", {f"disease {i}": 1 for i in range(keys)})
+        snapshot_mtime = os.path.getmtime(os.path.join(tmp, COUNTER_PATHS["disease_counts"]))
+        start = time.perf_counter()
+        for i in range(appends):
+            store.increment_batch({"disease_counts": {"disease 0": 1}, "ad_clicks": {"lung cancer": 1}})
+        per_append_ms = (time.perf_counter() - start) * 1000 / appends
+        print(f"counter log append: {per_append_ms:.3f}ms per flush")
+        fast = per_append_ms < 1 and os.path.getmtime(os.path.join(tmp, COUNTER_PATHS["disease_counts"])) == snapshot_mtime
+
+        expected = {"disease 0": appends + 1, "disease 1": 1}
+        def current():
+            restarted = JsonStore(tmp, counter_log=True)
+            counts = restarted.load_table("disease_counts")
+            return ({key: counts[key] for key in expected} == expected and len(counts) == keys
+                    and restarted.load_table("ad_clicks") == {"lung cancer": {"clicks": appends}})
+        replayed = current()
+
+        with open(os.path.join(tmp, COUNTER_LOG_PATH), "a") as f:
+            f.write('{"disease_counts":{"disease 0":10')
+        torn = current()
+        JsonStore(tmp, counter_log=True).increment_batch({"disease_counts": {"disease 1": 1}})
+        expected["disease 1"] = 2
+        appended_after_torn = current()
+
+        # A compaction that crashes after writing new snapshots but before its journal leaves everything as it was
+        crashed = JsonStore(tmp, counter_log=True)
+        crashed.load_table("disease_counts")
+        crashed._write_tmp(COUNTER_PATHS["disease_counts"], {"wrong": 1})
+        before_commit = current()
+
+        # One that crashes after its journal is completed by the next process to use the store
+        crashed = JsonStore(tmp, counter_log=True)
+        log = crashed.counter_log
+        log.load_table("disease_counts")
+        for name in log._dirty:
+            crashed._write_tmp(COUNTER_PATHS[name], log._tables[name])
+        crashed._write(COUNTER_COMPACTION_PATH, {"tables": [COUNTER_PATHS[name] for name in log._dirty]})
+        after_commit = current() and crashed.counter_log._sync() is None and crashed.counter_log._dirty == set()
+
+        # Another worker compacts a few times while this one is idle (so the new log may reuse the inode of the one it
+        # read), then appends: the log may end up shorter or longer than where this worker stopped reading
+        idle, other = JsonStore(tmp, counter_log=True), JsonStore(tmp, counter_log=True)
+        compacting = JsonStore(tmp, counter_log=True)
+        compacting.counter_log.compact_bytes = 0  # compacts after every append
+        expected_count = idle.load_table("disease_counts").get("disease 2", 0)
+        compacted_elsewhere = True
+        for compactions in range(1, 5):
+            for appends_after in (1, 50):
+                idle.increment_batch({"disease_counts": {"disease 2": 1}})
+                for _ in range(compactions):
+                    compacting.increment_batch({"disease_counts": {"disease 2": 1}})
+                for _ in range(appends_after):
+                    other.increment_batch({"disease_counts": {"disease 2": 1}})
+                expected_count += 1 + compactions + appends_after
+                compacted_elsewhere &= idle.load_table("disease_counts")["disease 2"] == expected_count
+        compacted_elsewhere &= current()
+
+        return fast and replayed and torn and appended_after_torn and before_commit and after_commit and compacted_elsewhere
+    finally:
+        shutil.rmtree(tmp)
+
+
+def _compact_events(path, compactions, appends, ts):
+    store = EventStore(path, shared=True)
+    for _ in range(compactions):
+        store.record("clicks", "gout", ts=ts)
+        store.flush()
+        store.compact()
+    for _ in range(appends):
+        store.record("clicks", "gout", ts=ts)
+    store.flush()
+
+
+def event_log_follow_test():
+    """
+    Shared event log: another process compacts it a few times while this worker is idle (so the rewritten log may reuse
+    the inode of the one it read) and then appends, leaving it shorter or longer than where this worker stopped reading.
+    Following the log must still count every event exactly once.
+    """
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "events.log")
+        ts = time.time()
+        store = EventStore(path, shared=True)
+        expected = 0
+        counted = True
+        for compactions in range(1, 5):
+            for appends in (1, 50):
+                store.record("clicks", "gout", ts=ts)
+                store.flush()
+                process = context.Process(target=_compact_events, args=(path, compactions, appends, ts))
+                process.start()
+                process.join()
+                expected += 1 + compactions + appends
+                store.follow()
+                counted &= sum(value for _, value in store.series("clicks", "gout", last=2)) == expected
+        return counted
+    finally:
+        shutil.rmtree(tmp)
+
+
+def llm_fault_test():
+    """
+    OpenAI client wrapper against the fake server with injected faults: transient errors are retried, a call never
+    outlives its deadline, consecutive failures open the circuit so calls fail at once without reaching the server, and a
+    trial call after the cooldown closes it again.
+    """
+    fake = FakeChatCompletions(latency_ms=5, jitter_ms=0, seed=3)
+    base_url = fake.start()
+    try:
+        breaker = CircuitBreaker(failures=3, cooldown_s=0.5)
+        client = LLMClient(api_key="fake", base_url=base_url, timeout_s=1, max_retries=4, backoff_s=0.01, breaker=breaker)
+        request = {"model": "gpt-4.1", "messages": [{"role": "user", "content": "Here is the user question: Is gout painful?"}]}
+
+        fake.error_rate, fake.error_status = 0.5, 503
+        answers = [client.create(**request).choices[0].message.content for _ in range(10)]
+        retried = answers == ["1. Gout"] * 10 and fake.errors > 0 and client.retries == fake.errors
+
+        fake.error_rate, fake.slow_rate, fake.slow_ms = 0, 1, 3000
+        start = time.perf_counter()
+        try:
+            client.create(**request)
+            deadline = False
+        except LLMUnavailable:
+            deadline = time.perf_counter() - start < 1.5
+
+        fake.error_rate, fake.slow_rate = 1, 0
+        for _ in range(2):
+            try:
+                client.create(**request)
+            except LLMUnavailable:
+                pass
+        requests_when_opened = fake.errors
+        start = time.perf_counter()
+        try:
+            client.create(**request)
+            short_circuit = False
+        except CircuitOpenError:
+            short_circuit = time.perf_counter() - start < 0.01 and fake.errors == requests_when_opened
+        opened = breaker.state == "open" and short_circuit
+
+        fake.error_rate = 0
+        time.sleep(0.6)
+        closed = client.create(**request).choices[0].message.content == "1. Gout" and breaker.state == "closed"
+
+        # A half-open trial cancelled while it backs off before a retry must not leave the breaker waiting for it
+        for _ in range(breaker.failures):
+            breaker.record_failure()
+        time.sleep(0.6)
+        fake.error_rate = 1
+        client.backoff_s = 10
+
+        async def cancel_in_backoff():
+            trial = asyncio.ensure_future(client.acreate(**request))
+            while client.failures == failures_before:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            trial.cancel()
+            try:
+                await trial
+            except asyncio.CancelledError:
+                pass
+
+        failures_before = client.failures
+        client._rng.seed(1)  # a backoff long enough to cancel in
+        asyncio.run(cancel_in_backoff())
+        fake.error_rate = 0
+        client.backoff_s = 0.01
+        abandoned = breaker.state == "half_open" and client.create(**request).choices[0].message.content == "1. Gout" \
+            and breaker.state == "closed"
+        return retried and deadline and opened and closed and abandoned
+    finally:
+        fake.stop()
+
+
+def chart_pool_recovery_test():
+    """
+    Chart renders survive a render process dying: the request whose render it was drawing gets ChartBusy (a 503) rather
+    than an error, and the next request renders on a fresh pool. Once the service is closed, renders are refused instead
+    of starting another pool.
+    """
+    service = ChartService(workers=1, render_timeout_s=60)
+
+    async def render(title, size=2):
+        spec = {"kind": "pie", "labels": ["a", "b"], "values": [1, 2], "title": title, "figsize": [size, size]}
+        try:
+            return (await service.get(title, lambda: spec))[1] is not None
+        except ChartBusy:
+            return False
+
+    async def killed_mid_render():
+        task = asyncio.ensure_future(render("during", size=60))
+        await asyncio.sleep(0.5)
+        for process in list(service._pool._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        return await task
+
+    try:
+        before = asyncio.run(render("before"))
+        during = asyncio.run(killed_mid_render())
+        after = asyncio.run(render("after"))
+        service.close()
+        closed = asyncio.run(render("closed")) is False and service._pool is None
+        return before and during is False and after and service.pool_restarts == 1 and closed
+    finally:
+        service.close()
+
+
+def keyword_batch_isolation_test():
+    """
+    Micro-batched keyword extraction: a question left unanswered by the batched prompt is retried on its own, and when
+    that retry fails only its caller gets the error; the other questions of the batch still get their keywords.
+    """
+    fake = FakeChatCompletions(latency_ms=5, jitter_ms=0, unanswerable=("unanswerable",))
+    default_llm = classify.llm
+    try:
+        classify.llm = LLMClient(api_key="fake", base_url=fake.start(), timeout_s=2, max_retries=0, breaker=CircuitBreaker())
+        batcher = MicroBatcher(classify.send_keyword_batch, 0.05, 8)
+        questions = ["Is gout painful at night?", "Who gets lung cancer most often?", "Is this unanswerable arthritis question?"]
+
+        async def ask_together():
+            return await asyncio.gather(*(batcher.submit(question) for question in questions), return_exceptions=True)
+
+        results = asyncio.run(ask_together())
+        return (results[:2] == ["1. Gout", "1. Lung Cancer"] and isinstance(results[2], LLMUnavailable)
+                and batcher.batches == 1 and fake.requests == 2)
+    finally:
+        classify.llm = default_llm
+        fake.stop()
 
 
 def main():
@@ -51,6 +615,46 @@ def main():
         print("Test 4 Passed")
     if get_highest_paying_ad_test_2():
         print("Test 5 Passed")
+
+    if concurrent_purchase_test("json"):
+        print("Test 6 Passed")
+    if concurrent_purchase_test("sqlite"):
+        print("Test 7 Passed")
+
+    if auction_selection_test():
+        print("Test 8 Passed")
+
+    if pacing_test():
+        print("Test 9 Passed")
+
+    if topk_test():
+        print("Test 10 Passed")
+
+    if canonicalization_test():
+        print("Test 11 Passed")
+
+    if multi_worker_test("json"):
+        print("Test 12 Passed")
+    if multi_worker_test("sqlite"):
+        print("Test 13 Passed")
+
+    if counter_log_test():
+        print("Test 14 Passed")
+
+    if llm_fault_test():
+        print("Test 15 Passed")
+
+    if chart_pool_recovery_test():
+        print("Test 16 Passed")
+
+    if event_log_follow_test():
+        print("Test 17 Passed")
+
+    if keyword_batch_isolation_test():
+        print("Test 18 Passed")
+
+    if second_price_test():
+        print("Test 19 Passed")
     
 
 
@@ -0,0 +1,202 @@
+import heapq
+import itertools
+import os
+import threading
+from shared import SHARED_STATE, follower
+from storage import store
+from telemetry import telemetry
+
+# How the unclaimed mentions are ranked:
+#   "exact"        - every disease string is counted exactly (memory grows with the number of distinct strings)
+#   "space_saving" - only the CAPACITY most mentioned strings are tracked (Space-Saving), counts may be overestimated
+#   "auto"         - exact until more than CAPACITY distinct strings have been seen, then Space-Saving
+TOPK_MODE = os.environ.get("OE_UNCLAIMED_TOPK_MODE", "auto")
+TOPK_MODES = ("exact", "space_saving", "auto")
+TOPK_CAPACITY = int(os.environ.get("OE_UNCLAIMED_TOPK_CAPACITY", "1000"))
+
+
+class TopK:
+    """
+    Counts items and keeps them ranked. In exact mode every item is counted. Otherwise this is the Space-Saving
+    heavy-hitters algorithm: at most capacity items are monitored, and a new item replaces the least counted one and
+    inherits its count (recorded as the new item's error). An item counted more than total / capacity times is always
+    among those monitored, and its count exceeds the true count by at most its error. The least counted item is found
+    through a min-heap with lazy deletion, so an increment costs O(log capacity).
+
+    Args:
+        capacity (int): items monitored once the counter is approximate
+        mode (str): one of TOPK_MODES
+    """
+
+    def __init__(self, capacity=TOPK_CAPACITY, mode=TOPK_MODE):
+        if mode not in TOPK_MODES:
+            raise ValueError(f"Unknown top-k mode {mode}")
+        self.capacity = capacity
+        self.mode = mode
+        self.approximate = mode == "space_saving"
+        self._counts = {}  # item -> count
+        self._errors = {}  # item -> overestimation bound (only items that replaced another one)
+        self._heap = []  # (count, sequence, item); entries whose count is outdated are skipped
+        self._sequence = itertools.count()
+        self.total = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def incr(self, item, amount=1):
+        self.total += amount
+        count = self._counts.get(item)
+        if count is not None:
+            count += amount
+        elif not self.approximate or len(self._counts) < self.capacity:
+            count = amount
+        else:
+            floor, evicted = self._pop_min()
+            del self._counts[evicted]
+            self._errors.pop(evicted, None)
+            self._errors[item] = floor
+            self.evictions += 1
+            count = floor + amount
+        self._counts[item] = count
+
+        if self.approximate:
+            heapq.heappush(self._heap, (count, next(self._sequence), item))
+            if len(self._heap) > 4 * self.capacity:
+                self._rebuild_heap()
+        elif self.mode == "auto" and len(self._counts) > self.capacity:
+            self._switch_to_space_saving()
+
+    def _pop_min(self):
+        while True:
+            count, _, item = heapq.heappop(self._heap)
+            if self._counts.get(item) == count:
+                return count, item
+
+    def _rebuild_heap(self):
+        self._heap = [(count, next(self._sequence), item) for item, count in self._counts.items()]
+        heapq.heapify(self._heap)
+
+    def _switch_to_space_saving(self):
+        # Keep the capacity most counted items. Every dropped item was counted no more than the least counted item kept,
+        # so the Space-Saving guarantees hold from here on.
+        self._counts = dict(self.ranked(self.capacity))
+        self.approximate = True
+        self._rebuild_heap()
+
+    def ranked(self, limit=None, offset=0):
+        """
+        Args:
+            limit (int): how many items to return (None for all)
+            offset (int): how many of the top items to skip
+
+        Returns:
+            list[tuple]: (item, count), most counted first; ties keep the order in which items were first seen
+        """
+        items = self._counts.items()
+        if limit is None:
+            ranked = sorted(items, key=lambda entry: entry[1], reverse=True)
+        else:
+            ranked = heapq.nlargest(offset + limit, items, key=lambda entry: entry[1])
+        return ranked[offset:] if limit is None else ranked[offset:offset + limit]
+
+    def error(self, item):
+        """
+        Returns:
+            int: by how much the item's count may exceed its true count
+        """
+        return self._errors.get(item, 0)
+
+
+class MentionIndex:
+    """
+    Ranked index over one telemetry counter table (the unclaimed disease mentions), kept current as telemetry records
+    increments, so /categories_for_sale and its chart read the top entries instead of sorting the whole table per request.
+    Memory is bounded by the top-k capacity once the table outgrows it.
+
+    The index is seeded once from storage plus whatever is still buffered in telemetry; that happens on app startup
+    before any traffic, or on first use. When several workers share storage it is re-seeded whenever another worker has
+    flushed its counters; `generation` counts the seedings, for caches of its pages.
+
+    Args:
+        telemetry (CounterBuffer): the telemetry buffer to follow
+        table (str): the counter table to index
+        capacity (int): see TopK
+        mode (str): see TopK
+    """
+
+    def __init__(self, telemetry, table, capacity=TOPK_CAPACITY, mode=TOPK_MODE):
+        self.telemetry = telemetry
+        self.table = table
+        self.capacity = capacity
+        self.mode = mode
+        self._topk = None
+        self._lock = threading.Lock()
+        self.generation = 0
+
+        telemetry.on_incr(self._on_incr)
+
+    def load(self):
+        """
+        Seeds the index from storage and the telemetry buffer. Safe to call more than once; only the first call loads.
+        """
+        if self._topk is not None:
+            return
+        with self.telemetry.seeding(), self._lock:
+            if self._topk is not None:
+                return
+            topk = TopK(self.capacity, self.mode)
+            for key, value in self.telemetry.view(self.table).items():
+                topk.incr(key, value["mentions"] if isinstance(value, dict) else value)
+            self._topk = topk
+            self.generation += 1
+
+    def refresh(self):
+        """
+        Re-seeds the index from storage and the telemetry buffer, picking up the mentions other workers have flushed.
+        """
+        with self._lock:
+            self._topk = None
+        self.load()
+
+    def _on_incr(self, name, key, amount):
+        if name != self.table:
+            return
+        with self._lock:
+            if self._topk is not None:
+                # Not seeded yet otherwise; load() will pick this increment up from the telemetry buffer
+                self._topk.incr(key, amount)
+
+    def page(self, limit=None, offset=0):
+        """
+        Args:
+            limit (int): how many entries to return (None for all that are tracked)
+            offset (int): how many of the top entries to skip
+
+        Returns:
+            tuple: (list of (key, count) most mentioned first, number of entries tracked, whether counts are approximate)
+        """
+        self.load()
+        with self._lock:
+            return self._topk.ranked(limit, offset), len(self._topk), self._topk.approximate
+
+    def stats(self):
+        """
+        Returns:
+            dict: mode, capacity, entries tracked and total mentions seen
+        """
+        self.load()
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "approximate": self._topk.approximate,
+                "capacity": self.capacity,
+                "entries": len(self._topk),
+                "total": self._topk.total,
+                "evictions": self._topk.evictions,
+            }
+
+
+unclaimed = MentionIndex(telemetry, "uncategorized")
+if SHARED_STATE:
+    follower.watch("unclaimed", store.counters_stamp, unclaimed.refresh)